@@ -3,6 +3,16 @@ ASGI config for digitmile project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the supported deployment for the game-client endpoints: it switches
+checkClassroomKey and insertLevelStatistics to the native async views, so one worker
+process serves many slow clients concurrently without a thread per request. Run it with
+an ASGI server, e.g.:
+
+    uvicorn digitmile.asgi:application --workers 4 --timeout-keep-alive 30
+
+CONN_MAX_AGE defaults to 0 here: async ORM calls run on a shared thread and persistent
+connections are not reused across requests under ASGI. Set DB_POOL=1 to reuse connections.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +22,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digitmile.settings')
+os.environ.setdefault('DIGITMILE_ASYNC_VIEWS', '1')
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -0,0 +1,16 @@
+"""
+ASGI config of the API-only deployment, see digitmile/settings_api.py and digitmile/asgi.py.
+
+    uvicorn digitmile.asgi_api:application --workers 4 --timeout-keep-alive 30
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digitmile.settings_api')
+os.environ.setdefault('DIGITMILE_ASYNC_VIEWS', '1')
+# Persistent connections are not reused across requests under ASGI, use DB_POOL=1 instead
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
+application = get_asgi_application()
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import copy
 import os
 from pathlib import Path
 
@@ -46,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'digitmileapi.metrics.metrics_middleware',
+    'digitmileapi.routers.pin_primary_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,8 +81,6 @@ WSGI_APPLICATION = 'digitmile.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-print(os.getenv('DB_NAME'))
-
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql', # Specifies the database backend
@@ -89,9 +90,66 @@ DATABASES = {
         'HOST': os.getenv('DB_HOST'),             # e.g., 'localhost' or an IP address
         'PORT': os.getenv('DB_PORT', '5432'),     # Default PostgreSQL port is 5432.
                                                   # os.getenv can take a default value if the env var isn't set.
+        # Keep connections open between requests instead of paying the TCP/TLS/auth handshake
+        # on every request. In seconds; 0 closes the connection at the end of each request.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        # Ping a persistent connection before reusing it, so a restarted server or a dropped
+        # idle connection costs one reconnect instead of a failed request
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'OPTIONS': {},
     }
 }
 
+# DB_POOL=1 uses psycopg 3's connection pool (pip install "psycopg[binary,pool]") instead of
+# persistent connections. Each worker process gets its own pool of DB_POOL_MIN_SIZE to
+# DB_POOL_MAX_SIZE connections; under ASGI this is the only way to reuse connections.
+if os.getenv('DB_POOL', '0') == '1':
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # Django refuses persistent connections together with a pool
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
+# Set DB_PGBOUNCER=transaction when connecting through PgBouncer in transaction pooling mode.
+# Consecutive transactions may run on different server connections there, so server-side
+# cursors (.iterator()) and prepared statements would break.
+if os.getenv('DB_PGBOUNCER') == 'transaction':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+    try:
+        import psycopg  # noqa: F401
+    except ImportError:
+        pass  # psycopg2 never prepares statements
+    else:
+        DATABASES['default']['OPTIONS']['prepare_threshold'] = None
+
+# Read replicas, as a comma-separated list of host[:port][/name] (e.g. "replica1,replica2:5433").
+# They share everything else with 'default' and become the aliases replica1, replica2, ...
+# Only the reads that opt in go there (see digitmileapi/routers.py): classroom rosters, exports
+# and the RunStatistics admin changelist. An empty host means DB_HOST, so to try it locally
+# point a replica at the primary itself ("/<DB_NAME>"): the routing is the same, only without lag.
+DB_REPLICA_ALIASES = []
+for number, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    replica_host, _, replica_name = replica.strip().partition('/')
+    replica_host, _, replica_port = replica_host.partition(':')
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': replica_host or DATABASES['default']['HOST'],
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'NAME': replica_name or DATABASES['default']['NAME'],
+        'OPTIONS': copy.deepcopy(DATABASES['default']['OPTIONS']),
+        # Tests run against 'default' only, replicas just mirror it
+        'TEST': {'MIRROR': 'default'},
+    }
+    DB_REPLICA_ALIASES.append(alias)
+
+DATABASE_ROUTERS = ['digitmileapi.routers.ReplicaRouter']
+
+# After a request that wrote something, the same browser reads from the primary for this many
+# seconds, so teachers see their own changes in the admin even while a replica lags behind
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', '5'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -132,3 +190,110 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# DigitMile API
+
+# Upper bound on the number of results accepted by /api/insertLevelStatisticsBatch/ in one request
+LEVEL_STATISTICS_BATCH_MAX_ITEMS = int(os.getenv('LEVEL_STATISTICS_BATCH_MAX_ITEMS', '500'))
+
+# Cache for /api/checkClassroomKey/ rosters (see digitmileapi/roster_cache.py).
+# BACKEND is the alias of a shared cache from CACHES (e.g. Redis or Memcached); leave it empty
+# to only keep the in-process LRU tier. TTL is in seconds.
+ROSTER_CACHE = {
+    'TTL': int(os.getenv('ROSTER_CACHE_TTL', '60')),
+    'MAX_ENTRIES': int(os.getenv('ROSTER_CACHE_MAX_ENTRIES', '1024')),
+    'BACKEND': os.getenv('ROSTER_CACHE_BACKEND') or None,
+}
+
+# Bloom filter over all classroom keys that rejects mistyped keys without a query (see
+# digitmileapi/key_filter.py). Rebuilt in the background every MAX_AGE seconds. Other processes
+# announce new classrooms through the shared ROSTER_CACHE BACKEND, so the filter is only on by
+# default with one; forced on without it, other processes take up to MAX_AGE seconds to accept
+# a newly created classroom (fine for a single process).
+CLASSROOM_KEY_FILTER = {
+    'ENABLED': os.getenv('CLASSROOM_KEY_FILTER_ENABLED', '1' if ROSTER_CACHE['BACKEND'] else '0') == '1',
+    'ERROR_RATE': float(os.getenv('CLASSROOM_KEY_FILTER_ERROR_RATE', '0.001')),
+    'MAX_AGE': int(os.getenv('CLASSROOM_KEY_FILTER_MAX_AGE', '60')),
+}
+
+# How long the student tokens handed out by /api/checkClassroomKey/ stay valid, in seconds
+# (see digitmileapi/tokens.py). A few hours covers a lesson; after that clients fall back to names.
+STUDENT_TOKEN_MAX_AGE = int(os.getenv('STUDENT_TOKEN_MAX_AGE', str(6 * 3600)))
+
+# Serve checkClassroomKey/insertLevelStatistics with the native async views (digitmileapi/async_views.py).
+# digitmile/asgi.py turns this on; under WSGI the DRF views are used.
+ASYNC_API_VIEWS = os.getenv('DIGITMILE_ASYNC_VIEWS', '0') == '1'
+
+# How /api/insertLevelStatistics/ writes results (see digitmileapi/ingest.py).
+# 'sync' commits every result before answering; 'buffered' queues it, answers 202 and writes
+# in batches of FLUSH_SIZE rows or every FLUSH_INTERVAL seconds. Full queues answer 503.
+INGEST = {
+    'MODE': os.getenv('INGEST_MODE', 'sync'),
+    'MAX_QUEUE': int(os.getenv('INGEST_MAX_QUEUE', '10000')),
+    'FLUSH_SIZE': int(os.getenv('INGEST_FLUSH_SIZE', '500')),
+    'FLUSH_INTERVAL': float(os.getenv('INGEST_FLUSH_INTERVAL', '1.0')),
+    'USE_COPY': os.getenv('INGEST_USE_COPY', '1') == '1',
+}
+
+# Retention of the RunStatistics log (see digitmileapi/compaction.py and `manage.py compact_runs`).
+# Runs older than KEEP_DAYS days are archived to ARCHIVE_DIR as gzip NDJSON, one file per day,
+# and replaced by per-student daily aggregates; BATCH_SIZE runs are moved per transaction.
+RUN_RETENTION = {
+    'KEEP_DAYS': int(os.getenv('RUN_RETENTION_DAYS', '180')),
+    'ARCHIVE_DIR': os.getenv('RUN_ARCHIVE_DIR') or str(BASE_DIR / 'archive'),
+    'BATCH_SIZE': int(os.getenv('RUN_COMPACTION_BATCH_SIZE', '5000')),
+}
+
+# Nightly student progress analytics (see digitmileapi/analytics.py and `manage.py compute_student_progress`).
+# WORKERS processes analyse one school each (0: one per CPU). RECENT_RUNS is the window of the
+# recent win rate; the rating weighs runs RATING_HALF_LIFE runs back half as much as the newest
+# and starts every student from RATING_PRIOR_RUNS runs at the regional win rate.
+ANALYTICS = {
+    'WORKERS': int(os.getenv('ANALYTICS_WORKERS', '0')),
+    'RECENT_RUNS': int(os.getenv('ANALYTICS_RECENT_RUNS', '20')),
+    'RATING_HALF_LIFE': float(os.getenv('ANALYTICS_RATING_HALF_LIFE', '20')),
+    'RATING_PRIOR_RUNS': float(os.getenv('ANALYTICS_RATING_PRIOR_RUNS', '10')),
+}
+
+# Live feed of new runs for teachers, /api/live/runStatistics/ (see digitmileapi/live.py); needs ASGI.
+# QUEUE_SIZE is how many unsent batches a slow subscriber may have before it is dropped, HEARTBEAT
+# the seconds between keep-alive comments. Set NOTIFY on Postgres when the game clients and the
+# teachers are not served by the same worker process, runs then travel via LISTEN/NOTIFY.
+LIVE_FEED = {
+    'ENABLED': os.getenv('LIVE_FEED_ENABLED', '1') == '1',
+    'QUEUE_SIZE': int(os.getenv('LIVE_FEED_QUEUE_SIZE', '256')),
+    'HEARTBEAT': float(os.getenv('LIVE_FEED_HEARTBEAT', '15')),
+    'NOTIFY': os.getenv('LIVE_FEED_NOTIFY', '0') == '1',
+}
+
+# Admin changelists of huge tables (RunStatistics, Student) use the Postgres planner's row
+# estimate instead of an exact COUNT(*) once it reaches this many rows
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '100000'))
+
+# Request metrics served at /metrics (see digitmileapi/metrics.py). With several worker processes
+# set DIR to a directory all of them can write to, and empty it when the service starts.
+# With TOKEN set, scrapes need `Authorization: Bearer <TOKEN>`.
+METRICS = {
+    'ENABLED': os.getenv('METRICS_ENABLED', '1') == '1',
+    'DIR': os.getenv('METRICS_DIR') or os.getenv('PROMETHEUS_MULTIPROC_DIR') or None,
+    'FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+    'TOKEN': os.getenv('METRICS_TOKEN') or None,
+}
+
+# Share of successful checkClassroomKey requests that get an info log line; errors are always logged
+API_LOG_SAMPLE_RATE = float(os.getenv('API_LOG_SAMPLE_RATE', '0.01'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'digitmileapi.logs.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'digitmileapi': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
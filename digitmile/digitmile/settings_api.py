@@ -0,0 +1,39 @@
+"""
+Settings for the API-only deployment that serves the game clients.
+
+Everything comes from settings.py; this only drops what the game-client endpoints never use
+(admin, sessions, messages, static files, CSRF and clickjacking middleware, DRF authentication
+and the browsable API), so workers import less on start and run fewer middleware per request.
+The admin and the teacher-facing endpoints are served by a separate deployment with the
+full digitmile.settings.
+
+    gunicorn digitmile.wsgi_api:application
+    uvicorn digitmile.asgi_api:application
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    # auth and contenttypes stay because Teacher.user points at auth.User
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'digitmileapi',
+]
+
+MIDDLEWARE = [
+    'digitmileapi.metrics.metrics_middleware',
+    'digitmileapi.routers.pin_primary_middleware',
+    'django.middleware.security.SecurityMiddleware',
+]
+
+ROOT_URLCONF = 'digitmile.urls_api'
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    # The game clients do not log in, so skip looking for a session or credentials entirely
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'UNAUTHENTICATED_USER': None,
+    'DEFAULT_RENDERER_CLASSES': ['digitmileapi.renderers.ORJSONRenderer'],
+}
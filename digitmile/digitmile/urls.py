@@ -17,8 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.urls import path, include # Make sure include is imported
+from digitmileapi.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('digitmileapi.urls')),  # This line tells Django to look at myapi.urls for paths starting with 'api/'
+    path('metrics', metrics_view, name='metrics'),
 ]
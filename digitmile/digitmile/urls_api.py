@@ -0,0 +1,14 @@
+"""
+URL configuration of the API-only deployment (digitmile/settings_api.py).
+
+Only the game-client endpoints; the admin and the teacher-facing endpoints live in digitmile/urls.py.
+"""
+from django.urls import include, path
+
+from digitmileapi.metrics import metrics_view
+from digitmileapi.urls import game_client_urlpatterns
+
+urlpatterns = [
+    path('api/', include(game_client_urlpatterns)),
+    path('metrics', metrics_view, name='metrics'),
+]
@@ -0,0 +1,11 @@
+"""
+WSGI config of the API-only deployment, see digitmile/settings_api.py.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digitmile.settings_api')
+
+application = get_wsgi_application()
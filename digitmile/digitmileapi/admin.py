@@ -1,13 +1,39 @@
 # your_app_name/admin.py
 from django.contrib import admin
-from .models import School, Teacher, Classroom, Student, RunStatistics # Import your models
+from .models import School, Teacher, Classroom, Student, RunStatistics, get_teacher_profile as get_user_teacher_profile # Import your models
+from .pagination import EstimatedCountPaginator
+from .routers import replica_reads
+from .search import IndexedSearchMixin
 from django.contrib.auth.models import User # If you need it directly
 
 # Make sure TeacherProfileInline and UserAdmin are set up as discussed before
 # if you want to manage Teacher profiles through the User admin.
 
+
+def get_teacher_profile(request):
+    # The permission hooks below run many times per admin page; request.user is the same object
+    # throughout, so the teacher is looked up once per request (see models.get_teacher_profile)
+    return get_user_teacher_profile(request.user)
+
+
+class TeacherListFilter(admin.RelatedFieldListFilter):
+    # Teacher.__str__ reads the related user, so load them together instead of one query per choice
+    def field_choices(self, field, request, model_admin):
+        return [(teacher.pk, str(teacher)) for teacher in Teacher.objects.select_related('user').order_by('full_name')]
+
+
+class SuperuserTeacherFilterMixin:
+    # Teachers only ever see their own rows, a filter listing every teacher is of no use to them
+    # and costs a query over all teachers on each changelist
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if request.user.is_superuser:
+            return list_filter
+        return [entry for entry in list_filter if not (isinstance(entry, tuple) and entry[1] is TeacherListFilter)]
+
+
 @admin.register(School)
-class SchoolAdmin(admin.ModelAdmin):
+class SchoolAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('name', 'municipality')
     search_fields = ('name',)
 
@@ -15,14 +41,16 @@ class SchoolAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         if request.user.is_superuser:
             return qs # Superusers see all schools
-        if hasattr(request.user, 'teacher_profile') and request.user.teacher_profile.school:
+        teacher = get_teacher_profile(request)
+        if teacher and teacher.school_id:
             # Teachers see only their own school
-            return qs.filter(pk=request.user.teacher_profile.school.pk)
+            return qs.filter(pk=teacher.school_id)
         return qs.none() # No schools if not superuser or teacher without a school
 
     def get_readonly_fields(self, request, obj=None):
         # If a teacher is viewing their school, make all fields read-only
-        if not request.user.is_superuser and obj and hasattr(request.user, 'teacher_profile') and obj == request.user.teacher_profile.school:
+        teacher = get_teacher_profile(request)
+        if not request.user.is_superuser and obj and teacher and obj.pk == teacher.school_id:
             # Return a list of all model fields to make them read-only
             return [field.name for field in obj._meta.fields]
         return super().get_readonly_fields(request, obj)
@@ -36,7 +64,8 @@ class SchoolAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return True
         # If obj exists and belongs to the teacher, they can open the change form (which will be read-only)
-        if obj and hasattr(request.user, 'teacher_profile') and obj == request.user.teacher_profile.school:
+        teacher = get_teacher_profile(request)
+        if obj and teacher and obj.pk == teacher.school_id:
             return True # Allows opening the form, get_readonly_fields makes it read-only
         return False
 
@@ -46,16 +75,18 @@ class SchoolAdmin(admin.ModelAdmin):
 
 # Teacher Admin (if needed separately, or managed via UserAdmin inline)
 @admin.register(Teacher)
-class TeacherAdmin(admin.ModelAdmin):
+class TeacherAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('user', 'full_name', 'school')
     search_fields = ('full_name', 'user__username', 'school__name')
     raw_id_fields = ('user',)
+    list_select_related = ('user', 'school')
 
 @admin.register(Classroom)
-class ClassroomAdmin(admin.ModelAdmin):
+class ClassroomAdmin(SuperuserTeacherFilterMixin, IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('classroom_key', 'teacher')
     search_fields = ('classroom_key', 'teacher__full_name', 'teacher__user__username')
-    list_filter = ('teacher',) # This will be useful for superusers
+    list_filter = (('teacher', TeacherListFilter),) # This will be useful for superusers
+    list_select_related = ('teacher__user',)
 
     # Restrict queryset for non-superusers (teachers)
     def get_queryset(self, request):
@@ -63,10 +94,17 @@ class ClassroomAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return qs
         # Assuming teacher profile is linked to user via 'teacher_profile'
-        if hasattr(request.user, 'teacher_profile'):
-            return qs.filter(teacher=request.user.teacher_profile)
+        teacher = get_teacher_profile(request)
+        if teacher:
+            return qs.filter(teacher=teacher)
         return qs.none() # Or handle if user is staff but not teacher and not superuser
 
+    # Teacher.__str__ reads the user, so the teacher choices need it loaded up front
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "teacher":
+            kwargs["queryset"] = Teacher.objects.select_related('user')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
     # Teachers should not add new classrooms via this admin
     def has_add_permission(self, request):
         if request.user.is_superuser:
@@ -78,7 +116,8 @@ class ClassroomAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return True
         # Allow viewing but not changing for teachers for their own classrooms
-        if obj is not None and hasattr(request.user, 'teacher_profile') and obj.teacher == request.user.teacher_profile:
+        teacher = get_teacher_profile(request)
+        if obj is not None and teacher and obj.teacher_id == teacher.pk:
              # If you want them to change *some* fields, you'd need more logic or readonly_fields
              # For simplicity here, let's say they can't change anything about the classroom object itself.
              # To allow them to click into it and see students, they need view, but change is too broad.
@@ -89,7 +128,8 @@ class ClassroomAdmin(admin.ModelAdmin):
 
 
     def get_readonly_fields(self, request, obj=None):
-        if not request.user.is_superuser and obj and hasattr(request.user, 'teacher_profile') and obj.teacher == request.user.teacher_profile:
+        teacher = get_teacher_profile(request)
+        if not request.user.is_superuser and obj and teacher and obj.teacher_id == teacher.pk:
             # Make all fields readonly for teachers viewing their classroom
             return [field.name for field in self.opts.fields if field.name != self.opts.pk.name]
         return super().get_readonly_fields(request, obj)
@@ -102,10 +142,14 @@ class ClassroomAdmin(admin.ModelAdmin):
         return False
 
 @admin.register(Student)
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(SuperuserTeacherFilterMixin, IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('full_name', 'classroom', 'get_teacher_name')
     search_fields = ('full_name', 'classroom__classroom_key')
-    list_filter = ('classroom__teacher',) # Useful for superusers
+    list_filter = (('classroom__teacher', TeacherListFilter),) # Useful for superusers
+    # Classroom.__str__ reads the teacher and Teacher.__str__ the user, fetch them in the same query
+    list_select_related = ('classroom__teacher__user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def get_teacher_name(self, obj):
         if obj.classroom:
@@ -120,18 +164,23 @@ class StudentAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         if request.user.is_superuser:
             return qs
-        if hasattr(request.user, 'teacher_profile'):
+        teacher = get_teacher_profile(request)
+        if teacher:
             # Show only students in classrooms belonging to this teacher
-            return qs.filter(classroom__teacher=request.user.teacher_profile)
+            return qs.filter(classroom__teacher=teacher)
         return qs.none() # No students if not superuser or not a teacher
 
     # Restrict classroom choices in forms (add/change student)
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "classroom":
-            if not request.user.is_superuser and hasattr(request.user, 'teacher_profile'):
+            # Classroom.__str__ reads the teacher, load it with the choices
+            teacher = get_teacher_profile(request)
+            if not request.user.is_superuser and teacher:
                 # Limit choices to classrooms taught by this teacher
-                kwargs["queryset"] = Classroom.objects.filter(teacher=request.user.teacher_profile)
-            # For superusers, all classrooms will be available by default
+                kwargs["queryset"] = Classroom.objects.filter(teacher=teacher).select_related('teacher')
+            else:
+                # For superusers, all classrooms will be available
+                kwargs["queryset"] = Classroom.objects.select_related('teacher')
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     # Control add permission
@@ -139,11 +188,15 @@ class StudentAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return True
         # Allow teachers to add students if they have classrooms
-        if hasattr(request.user, 'teacher_profile'):
+        teacher = get_teacher_profile(request)
+        if teacher:
             # Check if teacher has the general 'add_student' permission first
             if not request.user.has_perm(f'{self.opts.app_label}.add_student'):
                 return False
-            return Classroom.objects.filter(teacher=request.user.teacher_profile).exists()
+            # Asked several times per page, so remember the answer for this request
+            if not hasattr(request, '_teacher_has_classrooms'):
+                request._teacher_has_classrooms = Classroom.objects.filter(teacher=teacher).exists()
+            return request._teacher_has_classrooms
         return False
 
     # Control change permission for specific student objects
@@ -153,9 +206,10 @@ class StudentAdmin(admin.ModelAdmin):
             return False
         if request.user.is_superuser:
             return True
-        if obj is not None and hasattr(request.user, 'teacher_profile'):
+        teacher = get_teacher_profile(request)
+        if obj is not None and teacher:
             # Teacher can change student if student is in one of their classrooms
-            return obj.classroom.teacher == request.user.teacher_profile
+            return obj.classroom.teacher_id == teacher.pk
         # If obj is None (e.g. on the changelist page), rely on get_queryset.
         # For the "add" form, this isn't called with obj, has_add_permission handles that.
         return False # Default to no permission if not superuser and no object to check or object not theirs
@@ -166,18 +220,20 @@ class StudentAdmin(admin.ModelAdmin):
             return False
         if request.user.is_superuser:
             return True
-        if obj is not None and hasattr(request.user, 'teacher_profile'):
+        teacher = get_teacher_profile(request)
+        if obj is not None and teacher:
             # Teacher can delete student if student is in one of their classrooms
-            return obj.classroom.teacher == request.user.teacher_profile
+            return obj.classroom.teacher_id == teacher.pk
         return False
 
     # Ensure student is saved to one of the teacher's classrooms
     def save_model(self, request, obj, form, change):
-        if not request.user.is_superuser and hasattr(request.user, 'teacher_profile'):
+        teacher = get_teacher_profile(request)
+        if not request.user.is_superuser and teacher:
             # If adding a new student or changing an existing one,
             # the classroom field should have been limited by formfield_for_foreignkey.
             # This is an additional safeguard.
-            if obj.classroom.teacher != request.user.teacher_profile:
+            if obj.classroom.teacher_id != teacher.pk:
                 # This should ideally not happen if formfield_for_foreignkey is working.
                 # Raise an error or prevent saving.
                 from django.core.exceptions import PermissionDenied
@@ -185,10 +241,16 @@ class StudentAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 @admin.register(RunStatistics)
-class RunStatisticsAdmin(admin.ModelAdmin):
-    list_display = ('student', 'player_won', 'get_classroom_from_student')
-    list_filter = ('player_won', 'student__classroom__teacher')
+class RunStatisticsAdmin(SuperuserTeacherFilterMixin, IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ('student', 'player_won', 'place', 'score', 'get_classroom_from_student', 'created_at')
+    list_filter = ('player_won', ('student__classroom__teacher', TeacherListFilter))
     search_fields = ('student__full_name',)
+    # The student and their classroom (whose __str__ reads the teacher) come with each row
+    list_select_related = ('student__classroom__teacher',)
+    # Millions of rows: no exact COUNT(*) per page load, and no <select> of every student
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('student',)
 
     def get_classroom_from_student(self, obj):
         if obj.student and obj.student.classroom:
@@ -196,15 +258,19 @@ class RunStatisticsAdmin(admin.ModelAdmin):
         return None
     get_classroom_from_student.short_description = 'Classroom'
 
+    # The changelist is the heaviest read in the admin, let it run on a replica. The rows are
+    # only fetched while the template renders, so render inside the block too.
+    def changelist_view(self, request, extra_context=None):
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
     # Restrict queryset for non-superusers (teachers)
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        if request.user.is_superuser:
-            return qs
-        if hasattr(request.user, 'teacher_profile'):
-            # Show only stats for students in classrooms belonging to this teacher
-            return qs.filter(student__classroom__teacher=request.user.teacher_profile)
-        return qs.none()
+        # Show only stats for students in classrooms belonging to this teacher
+        return super().get_queryset(request).visible_to(request.user)
 
     # Teachers should not add, change, or delete RunStatistics directly (it's an audit/log table)
     def has_add_permission(self, request):
@@ -0,0 +1,316 @@
+# myapi/analytics.py
+"""
+Student progress analytics (StudentProgress, see `manage.py compute_student_progress`).
+
+The run log of a school is read as plain columns (values_list, no model instances) into NumPy
+arrays sorted by student and time, and every metric is computed over all students of the school
+at once:
+  * totals and win rate, including the runs compaction.py has moved into daily aggregates
+  * the win rate over the last RECENT_RUNS runs
+  * the current streak (wins in a row, negative for losses) and the longest winning streak
+  * a 0-100 rating: the win rate with every run weighted by its age in runs (half as much
+    RATING_HALF_LIFE runs back), starting from RATING_PRIOR_RUNS runs at the regional win rate
+    so a couple of lucky runs do not top the table
+  * the average score, accuracy (correct / all moves) and time of the runs that report them
+
+Schools are independent, so each one is analysed in a worker process. The parent then ranks
+every rating within its classroom, school and municipality and writes the table in one go.
+Students whose runs have all been compacted keep their totals but get no rating.
+
+NumPy is an optional dependency of the API, it is only needed here.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import RunStatistics, School, Student, StudentDailyAggregate, StudentProgress, StudentRunSummary
+from .routers import read_alias
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RUN_COLUMNS = ('student_id', 'player_won', 'place', 'score', 'correct_moves', 'wrong_moves', 'time_elapsed')
+# StudentProgress fields that come out of student_metrics() and rank_within()
+METRIC_FIELDS = (
+    'total_runs', 'total_wins', 'win_rate', 'recent_win_rate', 'current_streak', 'best_win_streak',
+    'rating', 'average_score', 'accuracy', 'average_time',
+    'classroom_percentile', 'school_percentile', 'municipality_percentile',
+)
+WRITE_BATCH_SIZE = 5000
+
+
+def analytics_options():
+    return getattr(settings, 'ANALYTICS', {})
+
+
+def load_runs(school_id, using, chunk_size=20000):
+    """
+    The runs of every student of a school as a dict of arrays, sorted by student and then time.
+    Nullable level metrics are floats with NaN where the client did not send them.
+    """
+    rows = (
+        RunStatistics.objects.using(using)
+        .filter(student__classroom__teacher__school_id=school_id)
+        .order_by('student_id', 'created_at', 'id')
+        .values_list(*RUN_COLUMNS)
+        .iterator(chunk_size=chunk_size)
+    )
+    chunks = []
+    while batch := list(islice(rows, chunk_size)):
+        columns = list(zip(*batch))
+        chunks.append(
+            [np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=bool)]
+            + [np.array(column, dtype=np.float64) for column in columns[2:]]  # None becomes NaN
+        )
+    if not chunks:
+        return {
+            name: np.empty(0, dtype=np.int64 if name == 'student_id' else bool if name == 'player_won' else np.float64)
+            for name in RUN_COLUMNS
+        }
+    return {name: np.concatenate([chunk[index] for chunk in chunks]) for index, name in enumerate(RUN_COLUMNS)}
+
+
+def _group_sums(group, count, values):
+    return np.bincount(group, weights=values, minlength=count)
+
+
+def _mean_where_present(group, count, values):
+    present = ~np.isnan(values)
+    total = _group_sums(group, count, np.where(present, values, 0.0))
+    reported = _group_sums(group, count, present)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(reported > 0, total / reported, np.nan)
+
+
+def student_metrics(runs, recent_runs=20, half_life=20.0, prior_runs=10.0, prior_win_rate=0.25):
+    """
+    Per-student metrics from load_runs() arrays. Returns a dict of arrays, one entry per student
+    in 'student_id' order.
+    """
+    student_ids = runs['student_id']
+    won = runs['player_won']
+    if not len(student_ids):
+        empty = {name: np.empty(0, dtype=np.int64) for name in ('student_id', 'total_runs', 'total_wins', 'current_streak', 'best_win_streak')}
+        return empty | {name: np.empty(0) for name in ('recent_win_rate', 'rating', 'average_score', 'accuracy', 'average_time')}
+
+    # Runs of one student are contiguous: where each student starts, and for every run its
+    # student (group), its position among that student's runs and how many runs came after it
+    starts = np.flatnonzero(np.r_[True, student_ids[1:] != student_ids[:-1]])
+    sizes = np.diff(np.r_[starts, len(student_ids)])
+    count = len(starts)
+    group = np.repeat(np.arange(count), sizes)
+    position = np.arange(len(student_ids)) - starts[group]
+    runs_after = sizes[group] - 1 - position
+
+    wins = _group_sums(group, count, won)
+
+    recent = runs_after < recent_runs
+    recent_win_rate = _group_sums(group, count, won & recent) / _group_sums(group, count, recent)
+
+    # Current streak: the runs after the last one with a different outcome than the newest
+    newest_won = won[starts + sizes - 1]
+    last_different = np.maximum.reduceat(np.where(won != newest_won[group], position, -1), starts)
+    streak = sizes - 1 - last_different
+    current_streak = np.where(newest_won, streak, -streak)
+
+    # Longest winning streak: split the runs into stretches of equal outcomes
+    stretch_starts = np.flatnonzero((position == 0) | np.r_[True, won[1:] != won[:-1]])
+    stretch_lengths = np.diff(np.r_[stretch_starts, len(won)])
+    winning = won[stretch_starts]
+    best_win_streak = np.zeros(count, dtype=np.int64)
+    np.maximum.at(best_win_streak, group[stretch_starts][winning], stretch_lengths[winning])
+
+    weights = 0.5 ** (runs_after / half_life)
+    rating = 100 * (
+        (_group_sums(group, count, weights * won) + prior_runs * prior_win_rate)
+        / (_group_sums(group, count, weights) + prior_runs)
+    )
+
+    correct, wrong = runs['correct_moves'], runs['wrong_moves']
+    both = ~np.isnan(correct) & ~np.isnan(wrong)
+    moves = _group_sums(group, count, np.where(both, correct + wrong, 0.0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accuracy = np.where(moves > 0, _group_sums(group, count, np.where(both, correct, 0.0)) / moves, np.nan)
+
+    return {
+        'student_id': student_ids[starts],
+        'total_runs': sizes,
+        'total_wins': wins.astype(np.int64),
+        'recent_win_rate': recent_win_rate,
+        'current_streak': current_streak,
+        'best_win_streak': best_win_streak,
+        'rating': rating,
+        'average_score': _mean_where_present(group, count, runs['score']),
+        'accuracy': accuracy,
+        'average_time': _mean_where_present(group, count, runs['time_elapsed']),
+    }
+
+
+def rank_within(groups, values):
+    """
+    For every value, the share (0-100) of the other values in the same group that are lower.
+    NaN values are left out and ranked NaN, as are values alone in their group.
+    """
+    percentiles = np.full(len(values), np.nan)
+    ranked = np.flatnonzero(~np.isnan(values))
+    if not len(ranked):
+        return percentiles
+    order = ranked[np.lexsort((values[ranked], groups[ranked]))]
+    sorted_groups, sorted_values = groups[order], values[order]
+    index = np.arange(len(order))
+    new_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    new_value = new_group | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    group_start = np.maximum.accumulate(np.where(new_group, index, 0))
+    value_start = np.maximum.accumulate(np.where(new_value, index, 0))
+    group_starts = np.flatnonzero(new_group)
+    group_size = np.diff(np.r_[group_starts, len(order)])[np.cumsum(new_group) - 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        percentiles[order] = np.where(group_size > 1, 100 * (value_start - group_start) / (group_size - 1), np.nan)
+    return percentiles
+
+
+def analyze_school(school_id, using, options, prior_win_rate):
+    """
+    Worker: every metric of the students of one school that have runs, raw or compacted, plus
+    their classroom. Returns a dict of arrays sorted by student id.
+    """
+    metrics = student_metrics(
+        load_runs(school_id, using),
+        recent_runs=options.get('RECENT_RUNS', 20),
+        half_life=options.get('RATING_HALF_LIFE', 20.0),
+        prior_runs=options.get('RATING_PRIOR_RUNS', 10.0),
+        prior_win_rate=prior_win_rate,
+    )
+    compacted = np.array(
+        StudentDailyAggregate.objects.using(using)
+        .filter(student__classroom__teacher__school_id=school_id)
+        .values('student_id').annotate(runs=Sum('total_runs'), wins=Sum('total_wins'))
+        .values_list('student_id', 'runs', 'wins'),
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    students = np.array(
+        Student.objects.using(using).filter(classroom__teacher__school_id=school_id).values_list('id', 'classroom_id'),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    students = students[np.argsort(students[:, 0])]
+
+    student_ids = np.union1d(metrics['student_id'], compacted[:, 0])
+    # A student deleted or moved to another school between these queries has runs but no row in
+    # `students`: leave them out, their progress row would have no classroom (or no student)
+    student_ids = student_ids[np.isin(student_ids, students[:, 0])]
+    kept_runs = np.isin(metrics['student_id'], student_ids)
+    compacted = compacted[np.isin(compacted[:, 0], student_ids)]
+    with_runs = np.searchsorted(student_ids, metrics['student_id'][kept_runs])
+    with_compacted = np.searchsorted(student_ids, compacted[:, 0])
+
+    result = {
+        'student_id': student_ids,
+        'classroom_id': students[np.searchsorted(students[:, 0], student_ids), 1],
+    }
+    for name in ('total_runs', 'total_wins', 'current_streak', 'best_win_streak'):
+        result[name] = np.zeros(len(student_ids), dtype=np.int64)
+        result[name][with_runs] = metrics[name][kept_runs]
+    for name in ('recent_win_rate', 'rating', 'average_score', 'accuracy', 'average_time'):
+        result[name] = np.full(len(student_ids), np.nan)
+        result[name][with_runs] = metrics[name][kept_runs]
+    result['total_runs'][with_compacted] += compacted[:, 1]
+    result['total_wins'][with_compacted] += compacted[:, 2]
+    return result
+
+
+def _init_worker():
+    # Workers started with "spawn" (macOS, Windows) begin without Django. Forked ones inherit
+    # it, and no open connections because compute_student_progress() closes them first.
+    import django
+    django.setup()
+
+
+def regional_win_rate(using):
+    totals = StudentRunSummary.objects.using(using).aggregate(runs=Sum('total_runs'), wins=Sum('total_wins'))
+    return totals['wins'] / totals['runs'] if totals['runs'] else 0.25
+
+
+def _value(value):
+    # NaN is how the arrays say "no value", the table says it with NULL
+    return None if isinstance(value, float) and value != value else value
+
+
+def compute_student_progress(workers=None, log=None):
+    """
+    Recomputes StudentProgress for every student with runs; `workers` defaults to
+    ANALYTICS['WORKERS'] (0: one per CPU, 1: no worker processes). Returns the number of
+    students and schools analysed.
+    """
+    if np is None:
+        raise ImproperlyConfigured("The student progress analytics need NumPy, install it with `pip install numpy`")
+    options = analytics_options()
+    workers = options.get('WORKERS', 0) if workers is None else workers
+    workers = workers or os.cpu_count() or 1
+    using = read_alias()
+    schools = dict(School.objects.using(using).values_list('id', 'municipality'))
+    prior_win_rate = regional_win_rate(using)
+    computed_at = timezone.now()
+
+    results = {}
+    if workers == 1:
+        for school_id in schools:
+            results[school_id] = analyze_school(school_id, using, options, prior_win_rate)
+    else:
+        connections.close_all()  # Not to be inherited by the workers
+        with ProcessPoolExecutor(max_workers=min(workers, len(schools) or 1), initializer=_init_worker) as pool:
+            futures = {pool.submit(analyze_school, school_id, using, options, prior_win_rate): school_id for school_id in schools}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if log:
+                    log(f"Analysed {len(results)} of {len(schools)} schools")
+
+    results = [(school_id, result) for school_id, result in results.items() if len(result['student_id'])]
+    if not results:
+        columns = {name: np.empty(0) for name in ('student_id', *METRIC_FIELDS)}
+    else:
+        columns = {name: np.concatenate([result[name] for _, result in results]) for name in results[0][1]}
+        school_ids = np.concatenate([np.full(len(result['student_id']), school_id) for school_id, result in results])
+        municipality_names, municipality_ids = np.unique(
+            np.array([schools[school_id] for school_id, _ in results], dtype=object), return_inverse=True
+        )
+        municipalities = np.concatenate([
+            np.full(len(result['student_id']), municipality_ids[index]) for index, (_, result) in enumerate(results)
+        ])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            columns['win_rate'] = np.where(columns['total_runs'] > 0, columns['total_wins'] / columns['total_runs'], 0.0)
+        columns['classroom_percentile'] = rank_within(columns['classroom_id'], columns['rating'])
+        columns['school_percentile'] = rank_within(school_ids, columns['rating'])
+        columns['municipality_percentile'] = rank_within(municipalities, columns['rating'])
+
+    write_progress(columns, computed_at)
+    return {'students': len(columns['student_id']), 'schools': len(results)}
+
+
+def write_progress(columns, computed_at):
+    """
+    Upserts one StudentProgress row per entry of the `columns` arrays and drops the rows of
+    students that no longer have runs, in one transaction.
+    """
+    using = router.db_for_write(StudentProgress)
+    names = list(METRIC_FIELDS)
+    rows = zip(columns['student_id'].tolist(), *(columns[name].tolist() for name in names))
+    with transaction.atomic(using=using):
+        while batch := list(islice(rows, WRITE_BATCH_SIZE)):
+            StudentProgress.objects.using(using).bulk_create(
+                [
+                    StudentProgress(student_id=row[0], computed_at=computed_at, **{name: _value(value) for name, value in zip(names, row[1:])})
+                    for row in batch
+                ],
+                update_conflicts=True,
+                unique_fields=['student'],
+                update_fields=[*names, 'computed_at'],
+            )
+        StudentProgress.objects.using(using).filter(computed_at__lt=computed_at).delete()
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class DigitmileapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'digitmileapi'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        # Connects the roster cache invalidation handlers
+        from . import signals  # noqa: F401
+        from .metrics import install_db_execute_wrapper
+
+        # Lets the metrics middleware count queries and DB time per request
+        connection_created.connect(install_db_execute_wrapper, dispatch_uid='digitmileapi_metrics_db_wrapper')
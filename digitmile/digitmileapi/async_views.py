@@ -0,0 +1,263 @@
+# myapi/async_views.py
+"""
+Native async versions of the game-client endpoints, for the ASGI deployment (digitmile/asgi.py).
+
+DRF's APIView is synchronous, so under ASGI every call to views.py is handed to a thread pool.
+These views run on the event loop and use Django's async ORM for their reads instead, so a worker can keep
+thousands of slow mobile clients waiting without a thread for each. Request and response
+bodies are the same as in views.py.
+
+LiveRunStatisticsView, the teachers' live feed, is async only: it holds a connection open for
+the whole lesson.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError
+from django.http import HttpResponseNotModified, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from .models import Classroom, Student, RunStatistics
+from .ingest import BufferFull, get_ingestion_buffer, is_buffered
+from .key_filter import get_classroom_key_filter
+from .live import get_broker, live_feed_options
+from .logs import sampled
+from .resolvers import aload_classroom, aload_students, aresolve_student
+from .renderers import api_response, parse_body
+from .roster_cache import get_roster_cache
+from .rosters import aroster_delta, etag_matches, parse_since_version, roster_etag
+from .run_summaries import insert_runs
+from .serializers import LevelStatisticsInputSerializer, check_classroom_payload
+
+logger = logging.getLogger(__name__)
+
+
+def _with_etag(response, etag):
+    response['ETag'] = etag
+    return response
+
+
+def _not_modified(etag):
+    return _with_etag(HttpResponseNotModified(), etag)
+
+
+# The game clients do not carry a CSRF token, same as with the DRF views
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCheckClassroomKeyView(View):
+    """
+    Checks if a classroom key exists and returns classroom, teacher, and student data.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        data = parse_body(request)
+        classroom_key_from_request = data.get("classroomKey") if isinstance(data, dict) else None
+
+        if not classroom_key_from_request:
+            return api_response(request, {"error": "Invalid input: classroomKey missing"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            since_version = parse_since_version(data.get("sinceVersion"))
+        except ValueError:
+            return api_response(request, {"error": "Invalid input: sinceVersion must be a non-negative integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if_none_match = request.headers.get('If-None-Match')
+
+        roster_cache = get_roster_cache()
+        cached_payload = await roster_cache.aget(classroom_key_from_request)
+        if cached_payload is not None:
+            etag = roster_etag(classroom_key_from_request, cached_payload['version'])
+            if etag_matches(if_none_match, etag):
+                return _not_modified(etag)
+            if since_version is not None:
+                delta = await aroster_delta(classroom_key_from_request, since_version, cached_payload['version'])
+                if delta is not None:
+                    return _with_etag(api_response(request, delta, status=status.HTTP_200_OK), etag)
+            return _with_etag(api_response(request, cached_payload, status=status.HTTP_200_OK), etag)
+
+        key_filter = get_classroom_key_filter()
+        if not await key_filter.amight_contain(classroom_key_from_request):
+            return api_response(request, {"message": "Classroom key verification failed or classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            classroom_id, teacher_name, school_name, municipality, version = await aload_classroom(classroom_key_from_request)
+        except Classroom.DoesNotExist:
+            key_filter.record_false_positive()
+            if sampled():
+                logger.info("classroom not found", extra={'classroom_key': classroom_key_from_request})
+            return api_response(request, {"message": "Classroom key verification failed or classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = roster_etag(classroom_key_from_request, version)
+        if etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        if since_version is not None:
+            delta = await aroster_delta(classroom_key_from_request, since_version, version)
+            if delta is not None:
+                return _with_etag(api_response(request, delta, status=status.HTTP_200_OK), etag)
+        students = await aload_students(classroom_id)
+
+        response_data = check_classroom_payload(school_name, municipality, teacher_name, students, classroom_id, version)
+        await roster_cache.aset(classroom_key_from_request, response_data)
+        if sampled():
+            logger.info("classroom found", extra={
+                'classroom_id': classroom_id,
+                'classroom_key': classroom_key_from_request,
+                'students': len(students),
+            })
+        return _with_etag(api_response(request, response_data, status=status.HTTP_200_OK), etag)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncInsertLevelStatisticsView(View):
+    """
+    Inserts run statistics for a student in a given classroom.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        data = parse_body(request)
+        if data is None:
+            return api_response(request, {"error": "Invalid input: malformed request body"}, status=status.HTTP_400_BAD_REQUEST)
+
+        input_serializer = LevelStatisticsInputSerializer(data=data)
+        if not input_serializer.is_valid():
+            return api_response(request, input_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = input_serializer.validated_data
+        if data['student'] is not None:
+            # Signed student token from checkClassroomKey: the ids are used as they are, no lookups
+            student_id, classroom_id = data['student']
+        else:
+            key_filter = get_classroom_key_filter()
+            if not await key_filter.amight_contain(data["classroomKey"]):
+                return api_response(request, {"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+
+            try:
+                student_id, classroom_id = await aresolve_student(data["classroomKey"], data["user"])
+            except Classroom.DoesNotExist:
+                key_filter.record_false_positive()
+                return api_response(request, {"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+            except Student.DoesNotExist:
+                return api_response(request, {"error": "User (Student) not found in this classroom"}, status=status.HTTP_404_NOT_FOUND)
+            except Student.MultipleObjectsReturned:
+                return api_response(request, {"error": "More than one student with this name in this classroom"}, status=status.HTTP_409_CONFLICT)
+
+        run_stat = RunStatistics.from_level_statistics(student_id, data['levelStatistics'])
+
+        # Write-behind mode: submit() never blocks, so it is safe to call from the event loop
+        if is_buffered():
+            try:
+                get_ingestion_buffer().submit(run_stat, classroom_id)
+            except BufferFull:
+                response = api_response(request, {"error": "Server busy, please retry"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+                response['Retry-After'] = '1'
+                return response
+            return api_response(request, {"message": "Data accepted"}, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            # The counters are updated in the same transaction as the insert, and transactions
+            # are not available to the async ORM yet, so this one step runs on a thread
+            await sync_to_async(insert_runs)([(run_stat, classroom_id)])
+        except IntegrityError:
+            # The student of a token was deleted after the token was handed out
+            return api_response(request, {"error": "User (Student) not found in this classroom"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception:
+            logger.exception("inserting run statistics failed", extra={'classroom_key': data.get("classroomKey"), 'student_id': student_id})
+            return api_response(request, {"error": "Internal server error while saving statistics"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return api_response(request, {"message": "Data inserted successfully"}, status=status.HTTP_201_CREATED)
+
+
+async def _student_names(student_ids):
+    return {
+        student_id: (full_name, classroom_key)
+        async for student_id, full_name, classroom_key in
+        Student.objects.filter(id__in=student_ids).values_list('id', 'full_name', 'classroom__classroom_key')
+    }
+
+
+async def _live_events(classroom_ids, heartbeat):
+    broker = get_broker()
+    subscription = broker.subscribe(classroom_ids)
+    names = {}  # student_id -> (full_name, classroom_key), filled as students show up
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                events = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection and notices clients that went away
+                yield ": keep-alive\n\n"
+                continue
+            if events is None:
+                yield "event: overflow\ndata: {}\n\n"
+                return
+            missing = {event['student_id'] for event in events} - names.keys()
+            if missing:
+                names.update(await _student_names(missing))
+            for event in events:
+                if event['student_id'] not in names:
+                    continue  # deleted in the meantime
+                full_name, classroom_key = names[event['student_id']]
+                data = {
+                    'id': event['id'],
+                    'classroom': classroom_key,
+                    'student': full_name,
+                    'playerWon': event['player_won'],
+                    'place': event['place'],
+                    'score': event['score'],
+                    'correctMoves': event['correct_moves'],
+                    'wrongMoves': event['wrong_moves'],
+                    'timeElapsed': event['time_elapsed'],
+                    'createdAt': event['created_at'],
+                }
+                yield f"event: run\ndata: {json.dumps(data)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class LiveRunStatisticsView(View):
+    """
+    Server-Sent Events stream of the runs written in the logged-in teacher's classrooms (every
+    classroom for superusers), replacing reloads of the RunStatistics admin changelist.
+    ?classroom=<key> narrows it to one classroom. Each result is a `run` event with a JSON body;
+    an `overflow` event means the client read too slowly and should reconnect.
+    """
+    http_method_names = ['get']
+
+    async def get(self, request, *args, **kwargs):
+        options = live_feed_options()
+        if not options.get('ENABLED', True):
+            return api_response(request, {"error": "Live feed is disabled"}, status=status.HTTP_404_NOT_FOUND)
+        # Under WSGI the never-ending response would be buffered in memory instead of streamed
+        if not isinstance(request, ASGIRequest):
+            return api_response(request, {"error": "Live feed needs the ASGI server"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        user = await request.auser()
+        if not user.is_authenticated:
+            return api_response(request, {"detail": "Authentication credentials were not provided."}, status=status.HTTP_403_FORBIDDEN)
+
+        classroom_key = request.GET.get('classroom')
+        classrooms = Classroom.objects.all()
+        if not user.is_superuser:
+            classrooms = classrooms.filter(teacher__user=user)
+        if classroom_key:
+            classrooms = classrooms.filter(classroom_key=classroom_key)
+
+        if user.is_superuser and not classroom_key:
+            classroom_ids = None
+        else:
+            classroom_ids = {classroom_id async for classroom_id in classrooms.values_list('id', flat=True)}
+            if not classroom_ids:
+                return api_response(request, {"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(
+            _live_events(classroom_ids, options.get('HEARTBEAT', 15)),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold the events back
+        return response
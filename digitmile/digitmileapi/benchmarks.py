@@ -0,0 +1,319 @@
+# myapi/benchmarks.py
+"""
+Synthetic data and a load harness for the game-client endpoints.
+
+Used by `manage.py seed_benchmark_data` and `manage.py benchmark_api`. Everything seeded here
+uses classroom keys starting with BENCHMARK_PREFIX, so it can be told apart from (and removed
+without touching) real data. Run it against SQLite or a local Postgres, never production.
+"""
+import datetime
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Classroom, RunStatistics, School, Student, Teacher
+from .tokens import make_student_token
+
+BENCHMARK_PREFIX = 'bench-'
+
+
+def seed(schools=10, teachers_per_school=5, classrooms_per_teacher=2, students_per_classroom=25,
+         runs=100000, batch_size=5000, random_seed=0):
+    """
+    Creates the given number of schools, teachers, classrooms and students and `runs` random runs
+    spread over the last 90 days. Returns the number of rows created per model.
+    """
+    rng = random.Random(random_seed)
+    municipalities = [f"{BENCHMARK_PREFIX}municipality-{i}" for i in range(max(1, schools // 5))]
+
+    school_objs = School.objects.bulk_create([
+        School(name=f"{BENCHMARK_PREFIX}school-{i}", municipality=rng.choice(municipalities))
+        for i in range(schools)
+    ])
+    teacher_objs = Teacher.objects.bulk_create([
+        Teacher(full_name=f"{BENCHMARK_PREFIX}teacher-{school.pk}-{i}", school=school)
+        for school in school_objs for i in range(teachers_per_school)
+    ])
+    classroom_objs = Classroom.objects.bulk_create([
+        Classroom(classroom_key=f"{BENCHMARK_PREFIX}{teacher.pk}-{i}", teacher=teacher)
+        for teacher in teacher_objs for i in range(classrooms_per_teacher)
+    ])
+    student_objs = Student.objects.bulk_create([
+        Student(full_name=f"Student {i}", classroom=classroom)
+        for classroom in classroom_objs for i in range(students_per_classroom)
+    ], batch_size=batch_size)
+
+    student_ids = [student.pk for student in student_objs]
+    now = timezone.now()
+
+    def random_runs():
+        for _ in range(runs):
+            place = rng.randint(1, 4)
+            yield RunStatistics(
+                student_id=rng.choice(student_ids),
+                player_won=place == 1,
+                place=place,
+                score=rng.randint(0, 1000),
+                correct_moves=rng.randint(0, 40),
+                wrong_moves=rng.randint(0, 15),
+                time_elapsed=round(rng.uniform(20, 600), 2),
+                created_at=now - datetime.timedelta(seconds=rng.randint(0, 90 * 24 * 3600)),
+            )
+
+    run_iter = random_runs()
+    created_runs = 0
+    while True:
+        batch = list(islice(run_iter, batch_size))
+        if not batch:
+            break
+        RunStatistics.objects.bulk_create(batch)
+        created_runs += len(batch)
+
+    return {
+        'schools': len(school_objs),
+        'teachers': len(teacher_objs),
+        'classrooms': len(classroom_objs),
+        'students': len(student_objs),
+        'runs': created_runs,
+    }
+
+
+def clear():
+    # Cascades from the schools down to the runs
+    return School.objects.filter(name__startswith=BENCHMARK_PREFIX).delete()[0]
+
+
+def targets(limit=1000):
+    """
+    (classroom_key, student name, student token) of seeded students to send requests for.
+    """
+    students = (
+        Student.objects.filter(classroom__classroom_key__startswith=BENCHMARK_PREFIX)
+        .values_list('classroom__classroom_key', 'full_name', 'classroom_id', 'id')[:limit]
+    )
+    return [
+        (classroom_key, full_name, make_student_token(classroom_id, student_id))
+        for classroom_key, full_name, classroom_id, student_id in students
+    ]
+
+
+def request_body(endpoint, target, rng, use_tokens=False):
+    classroom_key, full_name, token = target
+    if endpoint == 'checkClassroomKey':
+        return {'classroomKey': classroom_key}
+    place = rng.randint(1, 4)
+    student = {'token': token} if use_tokens else {'classroomKey': classroom_key, 'user': full_name}
+    return {
+        **student,
+        'levelStatistics': {
+            'place': place,
+            'score': rng.randint(0, 1000),
+            'correctMoves': rng.randint(0, 40),
+            'wrongMoves': rng.randint(0, 15),
+            'timeElapsed': round(rng.uniform(20, 600), 2),
+        },
+    }
+
+
+class _TestClientTransport:
+    """
+    Sends requests through Django's test client in this process and counts their queries.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def post(self, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(SERVER_NAME='localhost')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(path, body, content_type='application/json')
+        return response.status_code, len(queries.captured_queries)
+
+
+class _HTTPTransport:
+    """
+    Sends requests to a running server; query counts are not visible from outside.
+    """
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def post(self, path, body):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run(endpoint, requests=1000, concurrency=10, base_url=None, random_seed=0, use_tokens=False):
+    """
+    Sends `requests` POSTs to /api/<endpoint>/ from `concurrency` threads, through the test
+    client or to `base_url`, and returns a JSON-serializable report. `use_tokens` sends
+    student tokens instead of classroom key and name to insertLevelStatistics.
+    """
+    rng = random.Random(random_seed)
+    students = targets()
+    if not students:
+        raise ValueError("No benchmark data found, run `manage.py seed_benchmark_data` first")
+    bodies = [request_body(endpoint, rng.choice(students), rng, use_tokens) for _ in range(requests)]
+    transport = _HTTPTransport(base_url) if base_url else _TestClientTransport()
+    path = f"/api/{endpoint}/"
+
+    def send(body):
+        started = time.perf_counter()
+        status_code, query_count = transport.post(path, body)
+        return time.perf_counter() - started, status_code, query_count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, bodies))
+        elapsed = time.perf_counter() - started
+        # Every worker thread opened a database connection of its own. The barrier hands each
+        # thread exactly one of these tasks, so all of them get closed.
+        barrier = threading.Barrier(concurrency)
+        list(executor.map(lambda _: (barrier.wait(), connections.close_all()), range(concurrency)))
+
+    latencies = sorted(latency * 1000 for latency, _, _ in results)
+    status_counts = {}
+    for _, status_code, _ in results:
+        status_counts[str(status_code)] = status_counts.get(str(status_code), 0) + 1
+    query_counts = [query_count for _, _, query_count in results if query_count is not None]
+
+    return {
+        'endpoint': endpoint,
+        'student_tokens': use_tokens,
+        'transport': 'http' if base_url else 'test_client',
+        'database': connection.vendor,
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1) if elapsed else None,
+        'status_counts': status_counts,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'mean': round(statistics.fmean(latencies), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries_per_request': {
+            'mean': round(statistics.fmean(query_counts), 2),
+            'max': max(query_counts),
+        } if query_counts else None,
+    }
+
+
+def regressions(report, baseline, tolerance=0.2):
+    """
+    Compares a report with an earlier one for the same endpoint and returns a list of
+    human-readable regressions: p95 latency or throughput worse by more than `tolerance`,
+    or more queries per request.
+    """
+    found = []
+    if report['latency_ms']['p95'] > baseline['latency_ms']['p95'] * (1 + tolerance):
+        found.append(f"p95 latency {baseline['latency_ms']['p95']}ms -> {report['latency_ms']['p95']}ms")
+    if baseline['requests_per_second'] and report['requests_per_second'] < baseline['requests_per_second'] * (1 - tolerance):
+        found.append(f"throughput {baseline['requests_per_second']}/s -> {report['requests_per_second']}/s")
+    if report['queries_per_request'] and baseline['queries_per_request']:
+        if report['queries_per_request']['max'] > baseline['queries_per_request']['max']:
+            found.append(
+                f"queries per request {baseline['queries_per_request']['max']} -> {report['queries_per_request']['max']}"
+            )
+    return found
+
+
+def _timed(callable_, iterations):
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        callable_()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        'p50': round(percentile(latencies, 0.50), 3),
+        'p95': round(percentile(latencies, 0.95), 3),
+        'p99': round(percentile(latencies, 0.99), 3),
+        'mean': round(statistics.fmean(latencies), 3),
+    }
+
+
+def connect_latency(iterations=200, using='default'):
+    """
+    Latency of one `SELECT 1` in three situations:
+
+    - new_connection: a brand new driver connection per query (what CONN_MAX_AGE=0 without a
+      pool costs on every request),
+    - request_cycle: the query wrapped in the request_started/request_finished signals, so it
+      follows the configured CONN_MAX_AGE, CONN_HEALTH_CHECKS and pool settings,
+    - reused: the same open connection every time (the lower bound).
+    """
+    db = connections[using]
+
+    def query(cursor_connection):
+        with cursor_connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+
+    def new_connection():
+        # Straight to the driver, bypassing persistent connections and the pool
+        raw = db.Database.connect(**db.get_connection_params())
+        try:
+            with raw.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+        finally:
+            raw.close()
+
+    def request_cycle():
+        request_started.send(sender=None)
+        try:
+            query(db)
+        finally:
+            request_finished.send(sender=None)
+
+    settings_dict = db.settings_dict
+    report = {
+        'database': db.vendor,
+        'iterations': iterations,
+        'conn_max_age': settings_dict['CONN_MAX_AGE'],
+        'conn_health_checks': settings_dict['CONN_HEALTH_CHECKS'],
+        'pool': bool(settings_dict['OPTIONS'].get('pool')),
+        'latency_ms': {
+            'new_connection': _timed(new_connection, iterations),
+            'request_cycle': _timed(request_cycle, iterations),
+        },
+    }
+    db.ensure_connection()
+    report['latency_ms']['reused'] = _timed(lambda: query(db), iterations)
+    db.close()
+    return report
@@ -0,0 +1,163 @@
+# myapi/compaction.py
+"""
+Retention for the RunStatistics log (see `manage.py compact_runs`).
+
+Runs created before the cutoff (a UTC midnight KEEP_DAYS days ago, so days are compacted whole)
+leave the hot table in batches of BATCH_SIZE rows, oldest id first. Each batch is one short
+transaction that
+  1. locks the rows of the batch (and nothing else, inserts keep going),
+  2. appends them to one gzip-compressed NDJSON file per day under ARCHIVE_DIR and fsyncs it,
+  3. adds their run and win counts to StudentDailyAggregate,
+  4. deletes them.
+If the process dies between 2 and the commit, the rows stay in the table and are archived again
+by the next run, so an archive file can hold a run twice; run ids tell the copies apart.
+
+Reports that count runs (rebuild_run_summaries, the daily rollups) add StudentDailyAggregate to
+the raw runs. The student and classroom counters do not change when runs are compacted. Exports
+only contain raw runs, older ones are in the archive. On Postgres, month partitions left empty
+are dropped at the end.
+"""
+import datetime
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import RunStatistics, StudentDailyAggregate
+from .partitions import drop_empty_partitions, is_partitioned
+
+ARCHIVE_COLUMNS = [field.attname for field in RunStatistics._meta.concrete_fields]
+
+
+def _options():
+    return getattr(settings, 'RUN_RETENTION', {})
+
+
+def compaction_cutoff(keep_days=None, now=None):
+    """
+    UTC midnight `keep_days` (default RUN_RETENTION['KEEP_DAYS']) days before `now`; runs
+    created before it are compacted.
+    """
+    if keep_days is None:
+        keep_days = _options().get('KEEP_DAYS', 180)
+    today = (now or timezone.now()).astimezone(datetime.timezone.utc).date()
+    return datetime.datetime.combine(
+        today - datetime.timedelta(days=keep_days), datetime.time.min, tzinfo=datetime.timezone.utc
+    )
+
+
+def archive_path(archive_dir, day):
+    return Path(archive_dir) / f"{day:%Y}" / f"{day:%m}" / f"run_statistics-{day.isoformat()}.ndjson.gz"
+
+
+def _json_default(value):
+    # created_at is the only value json cannot encode by itself
+    return value.isoformat()
+
+
+def _archive(archive_dir, rows_by_day):
+    for day, rows in rows_by_day.items():
+        path = archive_path(archive_dir, day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Every batch appends a gzip member of its own; zcat and gzip.open read them as one stream
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                archive.writelines(json.dumps(row, default=_json_default).encode() + b'\n' for row in rows)
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def _add_daily_aggregates(connection, counts):
+    """
+    Adds {(student_id, day): (runs, wins)} to StudentDailyAggregate with a single upsert,
+    the same way run_summaries bumps its counters.
+    """
+    quote = connection.ops.quote_name
+    table = quote(StudentDailyAggregate._meta.db_table)
+    rows = sorted(counts.items())
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    params = [
+        value
+        for (student_id, day), (runs, wins) in rows
+        for value in (student_id, connection.ops.adapt_datefield_value(day), runs, wins)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (student_id, day, total_runs, total_wins) VALUES {values} "
+            f"ON CONFLICT (student_id, day) DO UPDATE SET "
+            f"total_runs = {table}.total_runs + EXCLUDED.total_runs, "
+            f"total_wins = {table}.total_wins + EXCLUDED.total_wins",
+            params,
+        )
+
+
+def compact_batch(cutoff, archive_dir, after_id=0, batch_size=5000, using=None):
+    """
+    Archives, aggregates and deletes up to `batch_size` runs created before `cutoff` with an id
+    above `after_id`. Returns the archived rows (dicts of ARCHIVE_COLUMNS), oldest id first.
+    """
+    using = using or router.db_for_write(RunStatistics)
+    runs = RunStatistics.objects.using(using).filter(created_at__lt=cutoff)
+    with transaction.atomic(using=using):
+        rows = list(
+            runs.filter(id__gt=after_id).order_by('id')
+            .select_for_update().values(*ARCHIVE_COLUMNS)[:batch_size]
+        )
+        if not rows:
+            return rows
+
+        rows_by_day = defaultdict(list)
+        counts = defaultdict(lambda: [0, 0])
+        for row in rows:
+            day = row['created_at'].astimezone(datetime.timezone.utc).date()
+            rows_by_day[day].append(row)
+            daily = counts[row['student_id'], day]
+            daily[0] += 1
+            daily[1] += int(row['player_won'])
+
+        _archive(archive_dir, rows_by_day)
+        _add_daily_aggregates(connections[using], counts)
+        runs.filter(id__in=[row['id'] for row in rows]).delete()
+    return rows
+
+
+def compact_runs(keep_days=None, archive_dir=None, batch_size=None, pause=0.0, max_batches=None, log=None):
+    """
+    Compacts every run created before compaction_cutoff(keep_days); the arguments default to
+    settings.RUN_RETENTION. `pause` seconds between batches give replicas and autovacuum time
+    to keep up. Returns a dict with the cutoff, the number of runs and batches, the days
+    touched and the partitions dropped.
+    """
+    options = _options()
+    archive_dir = archive_dir or options.get('ARCHIVE_DIR')
+    batch_size = batch_size or options.get('BATCH_SIZE', 5000)
+    using = router.db_for_write(RunStatistics)
+    cutoff = compaction_cutoff(keep_days)
+
+    result = {'cutoff': cutoff, 'runs': 0, 'batches': 0, 'days': set(), 'dropped_partitions': []}
+    after_id = 0
+    while max_batches is None or result['batches'] < max_batches:
+        rows = compact_batch(cutoff, archive_dir, after_id, batch_size, using)
+        if not rows:
+            break
+        after_id = rows[-1]['id']
+        result['runs'] += len(rows)
+        result['batches'] += 1
+        result['days'].update(row['created_at'].astimezone(datetime.timezone.utc).date() for row in rows)
+        if log:
+            log(f"Compacted {result['runs']} runs, up to id {after_id}")
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    connection = connections[using]
+    if is_partitioned(connection):
+        result['dropped_partitions'] = drop_empty_partitions(connection, cutoff.date())
+    return result
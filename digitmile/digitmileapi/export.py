@@ -0,0 +1,125 @@
+# myapi/export.py
+"""
+Streaming CSV/NDJSON export of RunStatistics joined with student, classroom, teacher and school.
+
+Rows are read with a server-side cursor (.iterator(chunk_size=...)) as plain tuples and written
+out as they arrive, so memory use stays flat no matter how many runs are exported. Used by
+ExportRunStatisticsView and `manage.py export_run_statistics`.
+
+A StreamingHttpResponse only streams an iterator of the handler's own kind: under ASGI Django
+reads a sync iterator into memory before sending anything (and under WSGI an async one), so
+ExportRunStatisticsView hands ASGI requests aexport_lines(). That one does not use .aiterator():
+for values_list() querysets it opens the cursor on the event loop, which Django refuses, so the
+same server-side cursor is read chunk by chunk on a thread instead.
+"""
+import csv
+import itertools
+import json
+
+from asgiref.sync import sync_to_async
+
+from .models import RunStatistics
+
+# (column name in the export, ORM lookup)
+EXPORT_COLUMNS = [
+    ('run_id', 'id'),
+    ('created_at', 'created_at'),
+    ('student_id', 'student_id'),
+    ('student', 'student__full_name'),
+    ('classroom_key', 'student__classroom__classroom_key'),
+    ('teacher', 'student__classroom__teacher__full_name'),
+    ('school', 'student__classroom__teacher__school__name'),
+    ('municipality', 'student__classroom__teacher__school__municipality'),
+    ('player_won', 'player_won'),
+    ('place', 'place'),
+    ('score', 'score'),
+    ('correct_moves', 'correct_moves'),
+    ('wrong_moves', 'wrong_moves'),
+    ('time_elapsed', 'time_elapsed'),
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def filter_run_statistics(queryset, teacher=None, school=None, municipality=None, since=None, until=None):
+    """
+    Narrows a RunStatistics queryset to one teacher (id), school (id) or municipality (name),
+    and optionally to runs created in [since, until).
+    """
+    if teacher:
+        queryset = queryset.filter(student__classroom__teacher_id=teacher)
+    if school:
+        queryset = queryset.filter(student__classroom__teacher__school_id=school)
+    if municipality:
+        queryset = queryset.filter(student__classroom__teacher__school__municipality=municipality)
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lt=until)
+    return queryset
+
+
+def _json_default(value):
+    # created_at is the only value json cannot encode by itself
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+class _Echo:
+    # csv.writer wants a file; this one just hands every formatted line back
+    def write(self, value):
+        return value
+
+
+def _rows(queryset):
+    return queryset.order_by().values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+
+
+def _headers():
+    return [name for name, _ in EXPORT_COLUMNS]
+
+
+def _line_formatter(export_format):
+    # Returns (header line or None, function turning a row into a line)
+    headers = _headers()
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        return writer.writerow(headers), writer.writerow
+    if export_format == 'ndjson':
+        return None, lambda row: json.dumps(dict(zip(headers, row)), default=_json_default) + '\n'
+    raise ValueError(f"Unknown export format '{export_format}'")
+
+
+def export_lines(queryset, export_format='csv', chunk_size=2000):
+    """
+    Yields the export of `queryset` line by line (str) in the given format.
+    """
+    header, format_row = _line_formatter(export_format)
+    if header is not None:
+        yield header
+    for row in _rows(queryset).iterator(chunk_size=chunk_size):
+        yield format_row(row)
+
+
+async def aexport_lines(queryset, export_format='csv', chunk_size=2000):
+    """
+    Async version of export_lines(), for responses served under ASGI.
+    """
+    header, format_row = _line_formatter(export_format)
+    if header is not None:
+        yield header
+    rows = _rows(queryset).iterator(chunk_size=chunk_size)
+    next_chunk = sync_to_async(lambda: list(itertools.islice(rows, chunk_size)))
+    while chunk := await next_chunk():
+        for row in chunk:
+            yield format_row(row)
+
+
+def export_queryset(user=None):
+    # Starting point of every export; `user` applies the same scoping as the admin
+    queryset = RunStatistics.objects.all()
+    if user is not None:
+        queryset = queryset.visible_to(user)
+    return queryset
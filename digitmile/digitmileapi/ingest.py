@@ -0,0 +1,234 @@
+# myapi/ingest.py
+"""
+Write-behind ingestion for /api/insertLevelStatistics/ (settings.INGEST['MODE'] = 'buffered').
+
+The view resolves the student as usual, appends the unsaved RunStatistics row to a bounded
+in-process queue and answers 202 Accepted right away. A background thread drains the queue
+when FLUSH_SIZE rows are waiting or FLUSH_INTERVAL seconds have passed, and writes the whole
+batch in one transaction (COPY on Postgres, bulk_create elsewhere) together with the summary
+counters. When the queue is full, submit() raises BufferFull and the view answers 503, so
+clients back off instead of the process growing without bounds.
+
+Rows still in the queue are flushed when the process exits normally (atexit), which covers
+the graceful shutdown of gunicorn and uvicorn workers. A hard kill loses at most one queue.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, router, transaction
+
+from .live import announce_runs
+from .models import RunStatistics, Student
+from .pgcopy import copy_rows, next_ids
+from .run_summaries import insert_runs, record_runs
+
+logger = logging.getLogger(__name__)
+
+COPY_COLUMNS = [
+    'student_id', 'player_won', 'place', 'score',
+    'correct_moves', 'wrong_moves', 'time_elapsed', 'created_at',
+]
+
+# Longest the flusher thread waits for rows before checking whether the process is stopping
+STOP_POLL_INTERVAL = 0.1
+
+
+class BufferFull(Exception):
+    pass
+
+
+class IngestionBuffer:
+    """
+    Bounded queue of (RunStatistics, classroom_id) pairs with a background flusher thread.
+    """
+    def __init__(self, max_size=10000, flush_size=500, flush_interval=1.0, use_copy=True, max_retries=3):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.use_copy = use_copy
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # Counters, see stats()
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='digitmile-ingest', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def submit(self, run_stat, classroom_id):
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((run_stat, classroom_id))
+        except queue.Full:
+            self.rejected += 1
+            raise BufferFull("Ingestion queue is full")
+        self.accepted += 1
+
+    def _take_batch(self):
+        # Waits for up to flush_interval seconds or until flush_size rows are queued. Wakes up
+        # every STOP_POLL_INTERVAL to see whether stop() was called, so the rows taken so far are
+        # written before stop() gives up waiting for the thread.
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size and not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, STOP_POLL_INTERVAL)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                batch = self._take_batch()
+                if batch:
+                    self._write(batch)
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        """
+        Writes everything that is queued right now. Safe to call from any thread.
+        """
+        while True:
+            batch = []
+            while len(batch) < self.flush_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.flush()
+
+    def _write(self, batch):
+        with self._flush_lock:
+            for attempt in range(1, self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    close_old_connections()
+                    self._write_batch(batch)
+                except IntegrityError:
+                    # Results sent with the token of a student that has been deleted since; drop those
+                    kept = self._without_deleted_students(batch)
+                    logger.warning("Dropping %d run statistics of deleted students", len(batch) - len(kept))
+                    self.failed_rows += len(batch) - len(kept)
+                    batch = kept
+                    if not batch or attempt == self.max_retries:
+                        self.failed_rows += len(batch)
+                        return
+                    continue
+                except Exception:
+                    logger.exception("Flushing %d run statistics failed (attempt %d of %d)", len(batch), attempt, self.max_retries)
+                    if attempt == self.max_retries:
+                        self.failed_rows += len(batch)
+                        return
+                    time.sleep(min(self.flush_interval * attempt, 5))
+                    continue
+                elapsed = time.perf_counter() - started
+                self.flushes += 1
+                self.flushed_rows += len(batch)
+                self.last_flush_seconds = elapsed
+                self.total_flush_seconds += elapsed
+                return
+
+    def _without_deleted_students(self, batch):
+        existing = set(Student.objects.filter(
+            id__in={run_stat.student_id for run_stat, _ in batch}
+        ).values_list('id', flat=True))
+        kept = [(run_stat, classroom_id) for run_stat, classroom_id in batch if run_stat.student_id in existing]
+        for run_stat, _ in kept:
+            run_stat.pk = None  # assigned by the insert that was rolled back
+        return kept
+
+    def _write_batch(self, batch):
+        using = router.db_for_write(RunStatistics)
+        connection = connections[using]
+        if not (self.use_copy and connection.vendor == 'postgresql'):
+            insert_runs(batch)
+            return
+        table = RunStatistics._meta.db_table
+        with transaction.atomic(using=using):
+            # The ids are taken up front and copied along with the rows, so the live feed gets
+            # saved runs with their ids, the same as after bulk_create()
+            for (run_stat, _), pk in zip(batch, next_ids(connection, table, len(batch))):
+                run_stat.pk = pk
+            copy_rows(
+                connection,
+                table,
+                ['id'] + COPY_COLUMNS,
+                ([run_stat.pk] + [getattr(run_stat, column) for column in COPY_COLUMNS] for run_stat, _ in batch),
+            )
+            record_runs((run_stat.student_id, classroom_id, run_stat.player_won) for run_stat, classroom_id in batch)
+            announce_runs(using, batch)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'failed_rows': self.failed_rows,
+            'last_flush_seconds': self.last_flush_seconds,
+            'total_flush_seconds': self.total_flush_seconds,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def is_buffered():
+    return getattr(settings, 'INGEST', {}).get('MODE', 'sync') == 'buffered'
+
+
+def get_ingestion_buffer():
+    """
+    Returns the process-wide IngestionBuffer, built from settings.INGEST on first use.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                options = getattr(settings, 'INGEST', {})
+                _buffer = IngestionBuffer(
+                    max_size=options.get('MAX_QUEUE', 10000),
+                    flush_size=options.get('FLUSH_SIZE', 500),
+                    flush_interval=options.get('FLUSH_INTERVAL', 1.0),
+                    use_copy=options.get('USE_COPY', True),
+                )
+    return _buffer
+
+
+def get_ingestion_stats():
+    # Without creating the buffer: None when this process never buffered a result
+    return _buffer.stats() if _buffer is not None else None
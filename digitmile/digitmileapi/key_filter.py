@@ -0,0 +1,263 @@
+# myapi/key_filter.py
+"""
+In-process Bloom filter over every Classroom.classroom_key.
+
+Children mistype classroom keys all the time, and every wrong key used to cost a query. The
+filter answers "this key cannot exist" from memory in a few microseconds; "it may exist" still
+goes to the database as before, and when the database then finds nothing that is counted as a
+false positive (about ERROR_RATE of the wrong keys).
+
+Classrooms saved in this process are added right away by signals.py. Classrooms saved in
+*another* process (another worker, the admin deployment, import_roster) are announced through
+the shared cache of the roster cache (ROSTER_CACHE['BACKEND']): every save bumps a generation
+number there. Before rejecting a key, a process reads the generation (one cache round trip,
+still far cheaper than the query it saves); while it differs from the one its filter was built
+at, misses go to the database. Without a shared cache there is no way to hear about those saves, so settings.py only
+turns the filter on by default when ROSTER_CACHE['BACKEND'] is set.
+
+The filter is built in a background thread, on first use and again after MAX_AGE seconds or
+once the generation moved; requests keep answering from the current filter (or, before the
+first one is ready, from the database) meanwhile. Deleted or renamed keys stay in the filter
+until the next rebuild, which only costs a query.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from .models import Classroom
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'digitmile:classroom-keys:generation'
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter for strings, sized for `capacity` entries at `error_rate`.
+    """
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(1024, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Two 64-bit halves of one digest, combined as in Kirsch & Mitzenmacher
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class ClassroomKeyFilter:
+    def __init__(self, error_rate=0.001, max_age=60, backend=None):
+        self.error_rate = error_rate
+        self.max_age = max_age
+        self.shared = caches[backend] if backend else None
+        self._bloom = None
+        self._built_at = 0.0
+        self._generation = None  # read from the shared cache right before the current filter was built
+        self._latest_generation = None  # last one read from the shared cache
+        self._generation_checked_at = 0.0
+        self._rebuild_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._add_lock = threading.Lock()
+        self._pending = None  # keys added while a rebuild is reading the table
+
+        # Counters, see stats()
+        self.passed = 0
+        self.rejected = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+
+    def _stale(self):
+        bloom = self._bloom
+        return (
+            bloom is None
+            or time.monotonic() - self._built_at > self.max_age
+            or bloom.count > bloom.capacity
+        )
+
+    def rebuild(self):
+        """
+        Builds a new filter from the table and swaps it in, on the calling thread. Requests
+        go through refresh() instead.
+        """
+        with self._rebuild_lock:
+            with self._add_lock:
+                self._pending = set()
+            # Read before the table, so a save that happens during the scan triggers another rebuild
+            read_at = time.monotonic()
+            generation = self.shared.get(GENERATION_KEY) if self.shared is not None else None
+            count = Classroom.objects.count()
+            # Twice the current number of classrooms, so new ones fit until the next rebuild
+            bloom = BloomFilter(max(2 * count, 1024), self.error_rate)
+            for classroom_key in Classroom.objects.values_list('classroom_key', flat=True).iterator(chunk_size=10000):
+                bloom.add(classroom_key)
+            with self._add_lock:
+                for classroom_key in self._pending:
+                    bloom.add(classroom_key)
+                self._pending = None
+                self._bloom = bloom
+            self._built_at = time.monotonic()
+            self._generation = generation
+            if read_at >= self._generation_checked_at:
+                # Unless a request saw a newer generation during the scan
+                self._latest_generation = generation
+                self._generation_checked_at = read_at
+            self.rebuilds += 1
+
+    def refresh(self):
+        """
+        Rebuilds the filter in a background thread, unless that is already happening.
+        """
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='digitmile-key-filter', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Rebuilding the classroom key filter failed")
+        finally:
+            self._refreshing = False
+            connections.close_all()
+
+    def add(self, classroom_key):
+        with self._add_lock:
+            if self._bloom is not None:
+                self._bloom.add(classroom_key)
+            if self._pending is not None:
+                self._pending.add(classroom_key)
+
+    def _current(self):
+        # The filter to answer from, None until the first one is built
+        if self._stale():
+            self.refresh()
+        return self._bloom
+
+    def _should_check_generation(self, bloom, found):
+        # Every miss: a key saved elsewhere a moment ago must not be rejected
+        return bloom is not None and not found and self.shared is not None
+
+    def _seen_generation(self, generation):
+        self._generation_checked_at = time.monotonic()
+        self._latest_generation = generation
+
+    def _result(self, bloom, found):
+        if found:
+            self.passed += 1
+            return True
+        if bloom is None or self._latest_generation != self._generation:
+            # No filter yet, or classrooms were saved elsewhere since it was built: ask the database
+            if bloom is not None:
+                self.refresh()
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def might_contain(self, classroom_key):
+        """
+        False when no classroom can have this key; True when it may exist.
+        """
+        bloom = self._current()
+        found = bloom is not None and classroom_key in bloom
+        if self._should_check_generation(bloom, found):
+            self._seen_generation(self.shared.get(GENERATION_KEY))
+        return self._result(bloom, found)
+
+    async def amight_contain(self, classroom_key):
+        bloom = self._current()
+        found = bloom is not None and classroom_key in bloom
+        if self._should_check_generation(bloom, found):
+            self._seen_generation(await self.shared.aget(GENERATION_KEY))
+        return self._result(bloom, found)
+
+    def record_false_positive(self):
+        # The filter let a key through that the database did not know
+        self.false_positives += 1
+
+    def bump_generation(self):
+        # Tells the other processes that classroom keys were added (see the module docstring)
+        if self.shared is not None:
+            self.shared.set(GENERATION_KEY, time.time_ns(), None)
+
+    def stats(self):
+        bloom = self._bloom
+        return {
+            'keys': bloom.count if bloom else 0,
+            'size_bytes': len(bloom.bits) if bloom else 0,
+            'passed': self.passed,
+            'rejected': self.rejected,
+            'false_positives': self.false_positives,
+            'rebuilds': self.rebuilds,
+        }
+
+
+class _AlwaysMaybe:
+    # Stand-in when the filter is disabled, every key goes to the database. Still bumps the
+    # generation, for the processes sharing the cache that do have a filter.
+    def __init__(self, backend=None):
+        self.shared = caches[backend] if backend else None
+
+    def might_contain(self, classroom_key):
+        return True
+
+    async def amight_contain(self, classroom_key):
+        return True
+
+    def add(self, classroom_key):
+        pass
+
+    def record_false_positive(self):
+        pass
+
+    bump_generation = ClassroomKeyFilter.bump_generation
+
+    def stats(self):
+        return None
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_classroom_key_filter():
+    """
+    Returns the process-wide ClassroomKeyFilter, built from settings.CLASSROOM_KEY_FILTER on first use.
+    """
+    global _filter
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                options = getattr(settings, 'CLASSROOM_KEY_FILTER', {})
+                backend = getattr(settings, 'ROSTER_CACHE', {}).get('BACKEND')
+                if not options.get('ENABLED', True):
+                    _filter = _AlwaysMaybe(backend)
+                else:
+                    _filter = ClassroomKeyFilter(
+                        error_rate=options.get('ERROR_RATE', 0.001),
+                        max_age=options.get('MAX_AGE', 60),
+                        backend=backend,
+                    )
+    return _filter
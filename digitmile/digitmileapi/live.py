@@ -0,0 +1,216 @@
+# myapi/live.py
+"""
+Fan-out of newly written runs to the live feed (LiveRunStatisticsView, Server-Sent Events).
+
+Every insert path (run_summaries.insert_runs and the COPY path of the ingestion buffer) calls
+announce_runs() inside its transaction. The runs reach the broker of this process once the
+transaction commits, and the broker hands them to every subscription that watches their
+classroom. A subscription is an asyncio queue on the event loop of the stream that owns it, so
+publishing from a request thread or the flusher thread only schedules a callback there.
+
+Nothing is published while nobody is watching. A subscriber that falls QUEUE_SIZE batches
+behind is not waited for: its queue is emptied and it gets an overflow event, after which the
+browser reconnects.
+
+With LIVE_FEED['NOTIFY'] on Postgres, runs are sent with NOTIFY instead (delivered on commit),
+and each process that serves streams LISTENs on one extra connection. That is needed as soon as
+the game clients and the teachers are served by different worker processes or deployments.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'digitmile_runs'
+# NOTIFY payloads must stay below 8000 bytes, one event is about 250
+EVENTS_PER_NOTIFY = 25
+LISTEN_POLL_SECONDS = 5.0
+
+
+def live_feed_options():
+    return getattr(settings, 'LIVE_FEED', {})
+
+
+def _uses_notify(connection):
+    return live_feed_options().get('NOTIFY', False) and connection.vendor == 'postgresql'
+
+
+def run_event(run_stat, classroom_id):
+    return {
+        'id': run_stat.pk,
+        'student_id': run_stat.student_id,
+        'classroom_id': classroom_id,
+        'player_won': run_stat.player_won,
+        'place': run_stat.place,
+        'score': run_stat.score,
+        'correct_moves': run_stat.correct_moves,
+        'wrong_moves': run_stat.wrong_moves,
+        'time_elapsed': run_stat.time_elapsed,
+        'created_at': run_stat.created_at.isoformat(),
+    }
+
+
+class Subscription:
+    """
+    The queue of one stream. Must be created on the event loop that reads it.
+    """
+    def __init__(self, classroom_ids, queue_size):
+        self.classroom_ids = classroom_ids  # None: every classroom
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def wants(self, classroom_id):
+        return self.classroom_ids is None or classroom_id in self.classroom_ids
+
+    def deliver(self, events):
+        # Runs on self.loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """
+        The next list of events, or None once this subscriber has fallen too far behind.
+        """
+        return await self.queue.get()
+
+
+class Broker:
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._listener = None
+
+        # Counters, see stats()
+        self.published = 0
+        self.overflows = 0
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self, classroom_ids=None):
+        if _uses_notify(connections[DEFAULT_DB_ALIAS]):
+            self._ensure_listener()
+        subscription = Subscription(classroom_ids, self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription.overflowed:
+            self.overflows += 1
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events):
+        """
+        Hands run events to the subscriptions that watch their classrooms; callable from any thread.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        self.published += len(events)
+        for subscription in subscriptions:
+            wanted = [event for event in events if subscription.wants(event['classroom_id'])]
+            if not wanted:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, wanted)
+            except RuntimeError:
+                # Its event loop is gone, the stream ended without unsubscribing
+                self.unsubscribe(subscription)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen_forever, name='digitmile-live-listener', daemon=True)
+                self._listener.start()
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("LISTEN %s failed, reconnecting", CHANNEL)
+                time.sleep(1)
+
+    def _listen(self):
+        # A connection of its own, outside Django's per-thread connection handling
+        wrapper = connections[DEFAULT_DB_ALIAS]
+        connection = wrapper.Database.connect(**wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while True:
+                if callable(connection.notifies):  # psycopg 3
+                    for notify in connection.notifies(timeout=LISTEN_POLL_SECONDS):
+                        self.publish(json.loads(notify.payload))
+                elif select.select([connection], [], [], LISTEN_POLL_SECONDS)[0]:  # psycopg2
+                    connection.poll()
+                    while connection.notifies:
+                        self.publish(json.loads(connection.notifies.pop(0).payload))
+        finally:
+            connection.close()
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscriptions),
+            'published': self.published,
+            'overflows': self.overflows,
+        }
+
+
+def announce_runs(using, runs):
+    """
+    Publishes saved (RunStatistics, classroom_id) pairs to the live feed once the current
+    transaction on `using` commits. Call it inside the transaction that inserts them.
+    """
+    options = live_feed_options()
+    if not options.get('ENABLED', True):
+        return
+    connection = connections[using]
+    if _uses_notify(connection):
+        events = [run_event(run_stat, classroom_id) for run_stat, classroom_id in runs]
+        chunks = [json.dumps(events[i:i + EVENTS_PER_NOTIFY]) for i in range(0, len(events), EVENTS_PER_NOTIFY)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT " + ", ".join(["pg_notify(%s, %s)"] * len(chunks)),
+                [value for chunk in chunks for value in (CHANNEL, chunk)],
+            )
+        return
+    broker = get_broker()
+    if broker.has_subscribers():
+        events = [run_event(run_stat, classroom_id) for run_stat, classroom_id in runs]
+        transaction.on_commit(partial(broker.publish, events), using=using)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Returns the process-wide Broker, configured from settings.LIVE_FEED on first use.
+    """
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = Broker(queue_size=live_feed_options().get('QUEUE_SIZE', 256))
+    return _broker
@@ -0,0 +1,35 @@
+# myapi/logs.py
+"""
+Structured logging helpers for the API views.
+
+JsonFormatter writes one JSON object per line, including anything passed as `extra=`.
+sampled() thins out the per-request info logs of the hot endpoints
+(settings.API_LOG_SAMPLE_RATE); warnings and errors are always logged.
+"""
+import json
+import logging
+import random
+
+from django.conf import settings
+
+# Attributes every LogRecord has; anything else on a record came in through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def sampled():
+    rate = getattr(settings, 'API_LOG_SAMPLE_RATE', 0.01)
+    return rate >= 1 or random.random() < rate
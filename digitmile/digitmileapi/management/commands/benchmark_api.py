@@ -0,0 +1,66 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from digitmileapi import benchmarks
+
+ENDPOINTS = ['checkClassroomKey', 'insertLevelStatistics']
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives checkClassroomKey and insertLevelStatistics at a given concurrency, through Django's "
+        "test client or against a running server (--url), and prints p50/p95/p99 latency, requests/sec "
+        "and queries per request as JSON. Needs data from `manage.py seed_benchmark_data`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=ENDPOINTS + ['all'], default='all')
+        parser.add_argument('--requests', type=int, default=1000, help="Requests per endpoint.")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000. "
+                                          "Without it requests go through the test client in this process.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--tokens', action='store_true', help="Send student tokens instead of classroom key and name.")
+        parser.add_argument('--output', '-o', help="Also write the report to this file.")
+        parser.add_argument('--baseline', help="Report of an earlier run; exit with an error on regressions.")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed relative slowdown against --baseline (default 0.2 = 20%%).")
+
+    def handle(self, *args, **options):
+        endpoints = ENDPOINTS if options['endpoint'] == 'all' else [options['endpoint']]
+        try:
+            reports = [
+                benchmarks.run(
+                    endpoint,
+                    requests=options['requests'],
+                    concurrency=options['concurrency'],
+                    base_url=options['url'],
+                    random_seed=options['seed'],
+                    use_tokens=options['tokens'],
+                )
+                for endpoint in endpoints
+            ]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = json.dumps({'results': reports}, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = {report['endpoint']: report for report in json.load(f)['results']}
+            found = []
+            for report in reports:
+                if report['endpoint'] in baseline:
+                    found += [
+                        f"{report['endpoint']}: {regression}"
+                        for regression in benchmarks.regressions(report, baseline[report['endpoint']], options['tolerance'])
+                    ]
+            if found:
+                raise CommandError("Regressions against the baseline:\n" + '\n'.join(found))
+            self.stderr.write(self.style.SUCCESS("No regressions against the baseline."))
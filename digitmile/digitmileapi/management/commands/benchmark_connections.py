@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from digitmileapi import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures what a database connection costs: a new connection per query, a query inside a "
+        "simulated request with the configured CONN_MAX_AGE/pool settings, and a reused connection. "
+        "Try it with different DB_CONN_MAX_AGE, DB_POOL and DB_PGBOUNCER values."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--output', '-o', help="Also write the report to this file.")
+
+    def handle(self, *args, **options):
+        report = benchmarks.connect_latency(options['iterations'], using=options['database'])
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
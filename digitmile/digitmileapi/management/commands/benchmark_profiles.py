@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter per settings profile, so the import time is a real cold start
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+startup = time.perf_counter() - started
+
+import statistics
+from django.conf import settings
+from django.test import Client
+
+# A request that is rejected before any query is made: what is left is the middleware, URL
+# resolving and DRF request handling around the view
+client = Client(SERVER_NAME='localhost')
+for _ in range(50):
+    client.post('/api/checkClassroomKey/', {}, content_type='application/json')
+latencies = []
+for _ in range(int(sys.argv[1])):
+    request_started = time.perf_counter()
+    client.post('/api/checkClassroomKey/', {}, content_type='application/json')
+    latencies.append((time.perf_counter() - request_started) * 1e6)
+latencies.sort()
+print(json.dumps({
+    'startup_ms': round(startup * 1000, 1),
+    'modules_loaded': len(sys.modules),
+    'installed_apps': len(settings.INSTALLED_APPS),
+    'middleware': len(settings.MIDDLEWARE),
+    'request_us': {
+        'p50': round(latencies[len(latencies) // 2], 1),
+        'mean': round(statistics.fmean(latencies), 1),
+    },
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares cold-start time, loaded modules and per-request framework overhead of the full "
+        "settings (digitmile.settings) and the API-only profile (digitmile.settings_api)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--runs', type=int, default=3, help="Cold starts per profile, the fastest one is reported.")
+        parser.add_argument(
+            '--profiles', nargs='+', default=['digitmile.settings', 'digitmile.settings_api'],
+            help="Settings modules to compare.",
+        )
+
+    def probe(self, settings_module, requests):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE, str(requests)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"{settings_module} failed to start:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        report = {}
+        for settings_module in options['profiles']:
+            runs = [self.probe(settings_module, options['requests']) for _ in range(options['runs'])]
+            report[settings_module] = min(runs, key=lambda run: run['startup_ms'])
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from digitmileapi.compaction import compact_runs, compaction_cutoff
+from digitmileapi.models import RunStatistics
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves runs older than the retention window out of RunStatistics: archives them as gzip "
+        "NDJSON (one file per day), adds them to the per-student daily aggregates and deletes them "
+        "in small batches. Meant to run nightly; defaults come from settings.RUN_RETENTION."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, help="Keep raw runs of this many past days.")
+        parser.add_argument('--archive-dir', help="Directory for the archive files.")
+        parser.add_argument('--batch-size', type=int, help="Runs archived and deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.0, help="Seconds to wait between batches.")
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches, the rest is left for the next run.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the runs that would be compacted.")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            cutoff = compaction_cutoff(options['keep_days'])
+            count = RunStatistics.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f"{count} runs created before {cutoff:%Y-%m-%d} would be compacted.")
+            return
+
+        result = compact_runs(
+            keep_days=options['keep_days'],
+            archive_dir=options['archive_dir'],
+            batch_size=options['batch_size'],
+            pause=options['sleep'],
+            max_batches=options['max_batches'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        for name in result['dropped_partitions']:
+            self.stdout.write(f"Dropped empty partition {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {result['runs']} runs created before {result['cutoff']:%Y-%m-%d} "
+            f"({len(result['days'])} days) in {result['batches']} batches."
+        ))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from digitmileapi.analytics import compute_student_progress
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the student progress table (win rates, streaks, ratings and their rank within "
+        "classroom, school and municipality) from the run log. Meant to run nightly; needs NumPy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            help="Worker processes, one school at a time each. Defaults to ANALYTICS['WORKERS'] (0: one per CPU); 1 runs in this process.",
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] is not None and options['workers'] < 0:
+            raise CommandError("--workers must be 0 or more.")
+        started = time.perf_counter()
+        try:
+            result = compute_student_progress(workers=options['workers'], log=self.stdout.write)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Computed the progress of {result['students']} students in {result['schools']} schools "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
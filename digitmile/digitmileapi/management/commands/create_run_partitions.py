@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from digitmileapi.models import RunStatistics
+from digitmileapi.partitions import ensure_month_partitions, is_partitioned, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the monthly RunStatistics partitions for the current month and the next "
+        "--months-ahead months (Postgres only). Schedule it so inserts never land in the DEFAULT partition."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3)
+
+    def handle(self, *args, **options):
+        using = router.db_for_write(RunStatistics)
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            self.stdout.write(f"Nothing to do: {connection.vendor} tables are not partitioned.")
+            return
+        if not is_partitioned(connection):
+            raise CommandError("RunStatistics is not partitioned, run the migrations first.")
+
+        first = month_start(datetime.date.today())
+        last = first
+        for _ in range(options['months_ahead']):
+            last = (last + datetime.timedelta(days=32)).replace(day=1)
+
+        with transaction.atomic(using=using):
+            created = ensure_month_partitions(connection, first, last)
+
+        for name in created:
+            self.stdout.write(f"Created partition {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partition(s) created up to {last:%Y-%m}."))
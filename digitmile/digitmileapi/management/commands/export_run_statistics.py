@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from digitmileapi.export import EXPORT_FORMATS, export_lines, export_queryset, filter_run_statistics
+from digitmileapi.routers import read_alias
+
+
+class Command(BaseCommand):
+    help = "Streams RunStatistics joined with student, classroom, teacher and school to a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="File to write to, standard output by default.")
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--teacher', type=int, help="Only runs of this teacher's classrooms (teacher id).")
+        parser.add_argument('--school', type=int, help="Only runs of this school (school id).")
+        parser.add_argument('--municipality', help="Only runs of schools in this municipality.")
+        parser.add_argument('--since', help="Only runs created at or after this ISO 8601 datetime.")
+        parser.add_argument('--until', help="Only runs created before this ISO 8601 datetime.")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows fetched per round trip.")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ('since', 'until'):
+            if options[name]:
+                dates[name] = parse_datetime(options[name])
+                if dates[name] is None:
+                    raise CommandError(f"--{name} must be an ISO 8601 datetime")
+
+        queryset = filter_run_statistics(
+            export_queryset(),
+            teacher=options['teacher'],
+            school=options['school'],
+            municipality=options['municipality'],
+            **dates,
+        ).using(read_alias())
+        lines = export_lines(queryset, options['format'], chunk_size=options['chunk_size'])
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            count = 0
+            for line in lines:
+                out.write(line)
+                count += 1
+        finally:
+            if options['output']:
+                out.close()
+        if options['output']:
+            rows = count - 1 if options['format'] == 'csv' else count
+            self.stderr.write(self.style.SUCCESS(f"Exported {rows} runs to {options['output']}."))
@@ -0,0 +1,257 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from digitmileapi.key_filter import get_classroom_key_filter
+from digitmileapi.models import Classroom, School, Student, Teacher
+from digitmileapi.pgcopy import copy_rows
+from digitmileapi.roster_cache import get_roster_cache
+from digitmileapi.rosters import bump_roster_versions
+
+
+def read_rows(path, file_format=None):
+    """
+    Yields one dict per record of a CSV (with a header row) or NDJSON file, without loading the file.
+    """
+    path = Path(path)
+    file_format = file_format or ('csv' if path.suffix.lower() == '.csv' else 'ndjson')
+    with path.open(newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _clean(row, column):
+    value = row.get(column)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports schools, teachers, classrooms and students from CSV or NDJSON files. "
+        "Expected columns: schools (name, municipality), teachers (full_name, school, [municipality]), "
+        "classrooms (classroom_key, teacher, school, [municipality]), students (full_name, classroom_key). "
+        "Rows that already exist are skipped, so an import can safely be re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schools', help="File with schools.")
+        parser.add_argument('--teachers', help="File with teachers.")
+        parser.add_argument('--classrooms', help="File with classrooms.")
+        parser.add_argument('--students', help="File with students.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="File format, guessed from the extension by default.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per bulk_create on non-Postgres databases.")
+        parser.add_argument('--no-copy', action='store_true', help="Use bulk_create even on Postgres.")
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name in ('schools', 'teachers', 'classrooms', 'students')):
+            raise CommandError("Nothing to import, pass at least one of --schools, --teachers, --classrooms or --students.")
+
+        self.using = router.db_for_write(Student)
+        self.connection = connections[self.using]
+        self.use_copy = self.connection.vendor == 'postgresql' and not options['no_copy']
+        self.batch_size = options['batch_size']
+        self.file_format = options['format']
+        self.touched_classroom_keys = set()
+
+        # Parents first, each step resolves its foreign keys against what the previous steps wrote
+        if options['schools']:
+            self.import_schools(options['schools'])
+        if options['teachers']:
+            self.import_teachers(options['teachers'])
+        if options['classrooms']:
+            self.import_classrooms(options['classrooms'])
+        if options['students']:
+            self.import_students(options['students'])
+
+        # New students change the rosters of existing classrooms. bulk_create and COPY send no
+        # signals, so no change rows either: their clients download the full roster again
+        bump_roster_versions(Classroom.objects.using(self.using).filter(classroom_key__in=self.touched_classroom_keys))
+        get_roster_cache().invalidate(*self.touched_classroom_keys)
+        if options['classrooms']:
+            # The API processes only learn about the new keys when their filters are rebuilt
+            get_classroom_key_filter().bump_generation()
+
+    # In-memory lookups of existing rows; these grow with the number of schools, teachers and
+    # classrooms, never with the number of students
+    def school_ids(self):
+        ids = {}
+        by_name = {}
+        for pk, name, municipality in School.objects.using(self.using).values_list('id', 'name', 'municipality'):
+            ids[(name, municipality)] = pk
+            by_name.setdefault(name, set()).add(pk)
+        return ids, by_name
+
+    def teacher_ids(self):
+        ids = {}
+        by_school_name = {}
+        teachers = Teacher.objects.using(self.using).values_list('id', 'full_name', 'school__name', 'school__municipality')
+        for pk, full_name, school_name, municipality in teachers:
+            ids[(full_name, school_name, municipality)] = pk
+            by_school_name.setdefault((full_name, school_name), set()).add(pk)
+        return ids, by_school_name
+
+    def classroom_ids(self):
+        return dict(Classroom.objects.using(self.using).values_list('classroom_key', 'id'))
+
+    def import_schools(self, path):
+        existing, _ = self.school_ids()
+        seen = set(existing)
+
+        def resolve(row):
+            key = (_clean(row, 'name'), _clean(row, 'municipality'))
+            if None in key or key in seen:
+                return None
+            seen.add(key)
+            return key
+
+        self.run_step(
+            'schools', path, School, ['name', 'municipality'], resolve,
+            merge="INSERT INTO {table} (name, municipality) "
+                  "SELECT DISTINCT s.name, s.municipality FROM {staging} s "
+                  "WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.name = s.name AND t.municipality = s.municipality)",
+        )
+
+    def import_teachers(self, path):
+        schools, schools_by_name = self.school_ids()
+        seen = set()
+        for full_name, school_id in Teacher.objects.using(self.using).values_list('full_name', 'school_id'):
+            seen.add((full_name, school_id))
+
+        def resolve(row):
+            full_name, school_name = _clean(row, 'full_name'), _clean(row, 'school')
+            municipality = _clean(row, 'municipality')
+            if municipality:
+                school_id = schools.get((school_name, municipality))
+            else:
+                # Without a municipality the school name has to be unambiguous
+                candidates = schools_by_name.get(school_name, ())
+                school_id = next(iter(candidates)) if len(candidates) == 1 else None
+            if not full_name or school_id is None or (full_name, school_id) in seen:
+                return None
+            seen.add((full_name, school_id))
+            return full_name, school_id
+
+        self.run_step(
+            'teachers', path, Teacher, ['full_name', 'school_id'], resolve,
+            merge="INSERT INTO {table} (full_name, school_id) "
+                  "SELECT DISTINCT s.full_name, s.school_id FROM {staging} s "
+                  "WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.full_name = s.full_name AND t.school_id = s.school_id)",
+        )
+
+    def import_classrooms(self, path):
+        teachers, teachers_by_school_name = self.teacher_ids()
+        existing = set(self.classroom_ids())
+
+        def resolve(row):
+            classroom_key = _clean(row, 'classroom_key')
+            teacher, school_name = _clean(row, 'teacher'), _clean(row, 'school')
+            municipality = _clean(row, 'municipality')
+            if municipality:
+                teacher_id = teachers.get((teacher, school_name, municipality))
+            else:
+                candidates = teachers_by_school_name.get((teacher, school_name), ())
+                teacher_id = next(iter(candidates)) if len(candidates) == 1 else None
+            if not classroom_key or teacher_id is None or classroom_key in existing:
+                return None
+            existing.add(classroom_key)
+            return classroom_key, teacher_id
+
+        self.run_step(
+            'classrooms', path, Classroom, ['classroom_key', 'teacher_id'], resolve,
+            # roster_version has a Django default only, the column itself has none
+            merge="INSERT INTO {table} (classroom_key, teacher_id, roster_version) "
+                  "SELECT DISTINCT ON (s.classroom_key) s.classroom_key, s.teacher_id, 0 FROM {staging} s "
+                  "ON CONFLICT (classroom_key) DO NOTHING",
+        )
+
+    def import_students(self, path):
+        classrooms = self.classroom_ids()
+        keys_by_id = {pk: key for key, pk in classrooms.items()}
+
+        def resolve(row):
+            full_name = _clean(row, 'full_name')
+            classroom_id = classrooms.get(_clean(row, 'classroom_key'))
+            if not full_name or classroom_id is None:
+                return None
+            self.touched_classroom_keys.add(keys_by_id[classroom_id])
+            return full_name, classroom_id
+
+        # Duplicates are left to the unique (classroom, full_name) constraint instead of a set
+        # of every student seen, which would grow with the file
+        self.run_step(
+            'students', path, Student, ['full_name', 'classroom_id'], resolve,
+            merge="INSERT INTO {table} (full_name, classroom_id) "
+                  "SELECT DISTINCT s.full_name, s.classroom_id FROM {staging} s "
+                  "ON CONFLICT (classroom_id, full_name) DO NOTHING",
+            ignore_conflicts=True,
+        )
+
+    def run_step(self, label, path, model, columns, resolve, merge, ignore_conflicts=False):
+        started = time.perf_counter()
+        counts = {'read': 0, 'skipped': 0}
+
+        def resolved_rows():
+            for row in read_rows(path, self.file_format):
+                counts['read'] += 1
+                values = resolve(row)
+                if values is None:
+                    counts['skipped'] += 1
+                else:
+                    yield values
+
+        with transaction.atomic(using=self.using):
+            if self.use_copy:
+                inserted = self.copy_and_merge(model, columns, resolved_rows(), merge)
+            else:
+                inserted = self.bulk_insert(model, columns, resolved_rows(), ignore_conflicts)
+
+        elapsed = time.perf_counter() - started
+        rate = counts['read'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: read {counts['read']}, inserted {inserted}, skipped {counts['skipped']} "
+            f"(existing or unresolved) in {elapsed:.1f}s, {rate:,.0f} rows/sec"
+        ))
+
+    def copy_and_merge(self, model, columns, rows, merge):
+        # Stream the rows into a temporary staging table, then merge them in one statement
+        quote = self.connection.ops.quote_name
+        table = model._meta.db_table
+        staging = f"import_{table}"
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {quote(staging)} ON COMMIT DROP AS "
+                f"SELECT {', '.join(quote(column) for column in columns)} FROM {quote(table)} WITH NO DATA"
+            )
+            copy_rows(self.connection, staging, columns, rows)
+            cursor.execute(merge.format(table=quote(table), staging=quote(staging)))
+            inserted = cursor.rowcount
+            # ON COMMIT DROP only fires on the outermost commit; inside a caller's transaction a
+            # second import would find the table still there
+            cursor.execute(f"DROP TABLE {quote(staging)}")
+            return inserted
+
+    def bulk_insert(self, model, columns, rows, ignore_conflicts):
+        manager = model.objects.using(self.using)
+        before = manager.count()
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            manager.bulk_create(
+                [model(**dict(zip(columns, values))) for values in batch],
+                ignore_conflicts=ignore_conflicts,
+            )
+        return manager.count() - before
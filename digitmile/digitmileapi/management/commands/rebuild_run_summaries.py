@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+from django.db.models import Count, Q, Sum
+
+from digitmileapi.models import ClassroomRunSummary, RunStatistics, StudentDailyAggregate, StudentRunSummary
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts StudentRunSummary and ClassroomRunSummary from RunStatistics and the daily aggregates of compacted runs. "
+        "Run it once after migrating to backfill the counters, and whenever runs were deleted "
+        "or students moved between classrooms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per bulk insert.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        using = router.db_for_write(RunStatistics)
+
+        with transaction.atomic(using=using):
+            connection = connections[using]
+            if connection.vendor == 'postgresql':
+                # Readers keep going, but inserts wait until the new counters are committed,
+                # otherwise runs written during the rebuild would be counted twice or not at all
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"LOCK TABLE {connection.ops.quote_name(RunStatistics._meta.db_table)} IN SHARE MODE"
+                    )
+
+            StudentRunSummary.objects.using(using).all().delete()
+            ClassroomRunSummary.objects.using(using).all().delete()
+
+            # Raw runs plus whatever `compact_runs` has already folded into daily aggregates
+            totals = defaultdict(lambda: [0, 0])
+            raw_totals = (
+                RunStatistics.objects.using(using)
+                .values_list('student_id')
+                .annotate(runs=Count('id'), wins=Count('id', filter=Q(player_won=True)))
+                .order_by()
+            )
+            compacted_totals = (
+                StudentDailyAggregate.objects.using(using)
+                .values_list('student_id')
+                .annotate(runs=Sum('total_runs'), wins=Sum('total_wins'))
+                .order_by()
+            )
+            for rows in (raw_totals, compacted_totals):
+                for student_id, runs, wins in rows.iterator():
+                    totals[student_id][0] += runs
+                    totals[student_id][1] += wins
+            student_summaries = [
+                StudentRunSummary(student_id=student_id, total_runs=runs, total_wins=wins)
+                for student_id, (runs, wins) in totals.items()
+            ]
+            StudentRunSummary.objects.using(using).bulk_create(student_summaries, batch_size=batch_size)
+
+            classroom_totals = (
+                StudentRunSummary.objects.using(using)
+                .values('student__classroom_id')
+                .annotate(runs=Sum('total_runs'), wins=Sum('total_wins'))
+                .order_by()
+            )
+            classroom_summaries = [
+                ClassroomRunSummary(classroom_id=row['student__classroom_id'], total_runs=row['runs'], total_wins=row['wins'])
+                for row in classroom_totals.iterator()
+            ]
+            ClassroomRunSummary.objects.using(using).bulk_create(classroom_summaries, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(student_summaries)} student and {len(classroom_summaries)} classroom summaries."
+        ))
@@ -0,0 +1,25 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from digitmileapi.rollups import OVERLAP, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the daily school and municipality rollups for the days that got new runs since "
+        "the last refresh. Meant to run every few minutes from cron or a systemd timer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild every day from the whole run log.")
+        parser.add_argument(
+            '--overlap', type=int, default=int(OVERLAP.total_seconds()),
+            help="Seconds before the last watermark to re-read, for runs that were committed late.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        days = refresh_rollups(full=options['full'], overlap=datetime.timedelta(seconds=options['overlap']))
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {days} days of rollups in {time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from digitmileapi import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds synthetic schools, teachers, classrooms, students and runs for `manage.py benchmark_api`. "
+        f"Classroom keys start with '{benchmarks.BENCHMARK_PREFIX}'. Only for local databases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schools', type=int, default=10)
+        parser.add_argument('--teachers-per-school', type=int, default=5)
+        parser.add_argument('--classrooms-per-teacher', type=int, default=2)
+        parser.add_argument('--students-per-classroom', type=int, default=25)
+        parser.add_argument('--runs', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed gives the same data.")
+        parser.add_argument('--clear', action='store_true', help="Remove earlier benchmark data first.")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f"Removed {benchmarks.clear()} rows of earlier benchmark data.")
+
+        started = time.perf_counter()
+        created = benchmarks.seed(
+            schools=options['schools'],
+            teachers_per_school=options['teachers_per_school'],
+            classrooms_per_teacher=options['classrooms_per_teacher'],
+            students_per_classroom=options['students_per_classroom'],
+            runs=options['runs'],
+            random_seed=options['seed'],
+        )
+        # The runs were bulk inserted, bring the summary counters in line with them
+        call_command('rebuild_run_summaries', stdout=self.stdout)
+
+        summary = ', '.join(f"{count} {name}" for name, count in created.items())
+        self.stdout.write(self.style.SUCCESS(f"Seeded {summary} in {time.perf_counter() - started:.1f}s."))
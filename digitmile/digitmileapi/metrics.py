@@ -0,0 +1,355 @@
+# myapi/metrics.py
+"""
+Request metrics in the Prometheus text format, served at /metrics.
+
+metrics_middleware times every request and, through a database execute wrapper, how many queries
+it ran and how long they took, so a slow endpoint can be pinned on Postgres or on Python. It
+keeps per-view latency and DB-time histograms and per-status request counters in memory.
+
+Gunicorn and uvicorn run several worker processes and a scrape only reaches one of them. With
+settings.METRICS['DIR'] set, every process writes its numbers to DIR/metrics-<pid>.json every
+FLUSH_INTERVAL seconds (and on exit), and /metrics adds up all files. Empty the directory when
+the service is (re)started, like prometheus_client's PROMETHEUS_MULTIPROC_DIR.
+"""
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+METRICS = {
+    'digitmile_http_requests_total': ('counter', "Requests by view, method and status code."),
+    'digitmile_http_request_duration_seconds': ('histogram', "Time spent handling a request, per view."),
+    'digitmile_db_queries_total': ('counter', "Database queries run while handling requests, per view."),
+    'digitmile_db_request_duration_seconds': ('histogram', "Time spent in database queries per request, per view."),
+    'digitmile_roster_cache_entries': ('gauge', "Rosters held in the in-process roster cache."),
+    'digitmile_roster_cache_lookups_total': ('counter', "Roster cache lookups by result."),
+    'digitmile_ingest_queue_depth': ('gauge', "Results waiting in the write-behind ingestion queue."),
+    'digitmile_ingest_rows_total': ('counter', "Results handled by the write-behind ingestion buffer, by outcome."),
+    'digitmile_ingest_flushes_total': ('counter', "Batches written by the write-behind ingestion buffer."),
+    'digitmile_ingest_flush_seconds_total': ('counter', "Time spent writing batches of the write-behind ingestion buffer."),
+    'digitmile_ingest_last_flush_seconds': ('gauge', "Time the last batch of the write-behind ingestion buffer took to write."),
+    'digitmile_classroom_key_filter_keys': ('gauge', "Classroom keys in the in-process key filter."),
+    'digitmile_classroom_key_filter_checks_total': ('counter', "Classroom key filter checks by result; false_positives are counted on top of passed."),
+    'digitmile_classroom_key_filter_rebuilds_total': ('counter', "Times the classroom key filter was rebuilt from the database."),
+    'digitmile_live_feed_subscribers': ('gauge', "Teachers connected to the live feed of new runs."),
+    'digitmile_live_feed_events_total': ('counter', "Runs published to the live feed."),
+    'digitmile_live_feed_overflows_total': ('counter', "Live feed subscribers cut off after falling too far behind."),
+}
+
+
+class Registry:
+    """
+    Counters, gauges and histograms of one process, keyed by (name, labels).
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                # One count per bucket, then sum and count
+                histogram = self.histograms[(name, labels)] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        # JSON-serializable copy, labels become lists of [key, value] pairs
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+                'gauges': collect_gauges(),
+            }
+
+
+def collect_gauges():
+    # Stats the roster cache, the key filter, the live feed and the ingestion buffer keep themselves, read at snapshot time
+    from .ingest import get_ingestion_stats
+    from .key_filter import get_classroom_key_filter
+    from .live import get_broker
+    from .roster_cache import get_roster_cache
+
+    gauges = []
+    roster_stats = get_roster_cache().stats()
+    gauges.append(['digitmile_roster_cache_entries', [], roster_stats['entries']])
+    for result in ('local_hits', 'shared_hits', 'misses'):
+        gauges.append(['digitmile_roster_cache_lookups_total', [['result', result]], roster_stats[result]])
+
+    key_filter_stats = get_classroom_key_filter().stats()
+    if key_filter_stats is not None:
+        gauges.append(['digitmile_classroom_key_filter_keys', [], key_filter_stats['keys']])
+        gauges.append(['digitmile_classroom_key_filter_rebuilds_total', [], key_filter_stats['rebuilds']])
+        for result in ('passed', 'rejected', 'false_positives'):
+            gauges.append(['digitmile_classroom_key_filter_checks_total', [['result', result]], key_filter_stats[result]])
+
+    live_stats = get_broker().stats()
+    gauges.append(['digitmile_live_feed_subscribers', [], live_stats['subscribers']])
+    gauges.append(['digitmile_live_feed_events_total', [], live_stats['published']])
+    gauges.append(['digitmile_live_feed_overflows_total', [], live_stats['overflows']])
+
+    ingest_stats = get_ingestion_stats()
+    if ingest_stats is not None:
+        gauges.append(['digitmile_ingest_queue_depth', [], ingest_stats['queue_depth']])
+        gauges.append(['digitmile_ingest_flushes_total', [], ingest_stats['flushes']])
+        gauges.append(['digitmile_ingest_flush_seconds_total', [], ingest_stats['total_flush_seconds']])
+        # Per process, adding up the last flush of several workers means nothing
+        gauges.append(['digitmile_ingest_last_flush_seconds', [['pid', str(os.getpid())]], ingest_stats['last_flush_seconds']])
+        for outcome in ('accepted', 'rejected', 'flushed_rows', 'failed_rows'):
+            gauges.append(['digitmile_ingest_rows_total', [['outcome', outcome]], ingest_stats[outcome]])
+    return gauges
+
+
+def merge(snapshots):
+    """
+    Adds up snapshots of several processes.
+    """
+    values = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters'] + snapshot.get('gauges', []):
+            values[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, counts in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], counts)]
+            else:
+                histograms[key] = list(counts)
+    return values, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render(values, histograms, buckets=BUCKETS):
+    """
+    Prometheus text exposition format (version 0.0.4).
+    """
+    by_name = defaultdict(list)
+    for (name, labels), value in values.items():
+        by_name[name].append((labels, value))
+    for (name, labels), counts in histograms.items():
+        by_name[name].append((labels, counts))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in sorted(by_name[name]):
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {cumulative:g}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {value[-1]:g}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value[-1]:g}')
+    return '\n'.join(lines) + '\n'
+
+
+class _FileWriter:
+    """
+    Writes the registry of this process to DIR/metrics-<pid>.json every `interval` seconds.
+    """
+    def __init__(self, registry, directory, interval):
+        self.registry = registry
+        self.path = os.path.join(directory, f'metrics-{registry.pid}.json')
+        self.interval = interval
+        self._stopping = threading.Event()
+        thread = threading.Thread(target=self._run, name='digitmile-metrics', daemon=True)
+        thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.write()
+
+    def write(self):
+        if os.getpid() != self.registry.pid:
+            return  # atexit handler inherited by a forked child, the file belongs to the parent
+        try:
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(self.registry.snapshot(), f)
+            os.replace(temporary, self.path)
+        except Exception:
+            logger.exception("Writing metrics to %s failed", self.path)
+
+    def stop(self):
+        self._stopping.set()
+        self.write()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _options():
+    return getattr(settings, 'METRICS', {})
+
+
+def get_registry():
+    """
+    Returns the Registry of this process. A forked worker starts its own (and its own file)
+    instead of sharing the one it inherited from the parent.
+    """
+    global _registry
+    if _registry is None or _registry.pid != os.getpid():
+        with _registry_lock:
+            if _registry is None or _registry.pid != os.getpid():
+                registry = Registry()
+                directory = _options().get('DIR')
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                    _FileWriter(registry, directory, _options().get('FLUSH_INTERVAL', 5.0))
+                _registry = registry
+    return _registry
+
+
+# Queries and DB time of the request being handled. A context variable rather than a thread
+# local, so it follows async views into the threads sync_to_async runs the ORM on.
+_request_db = contextvars.ContextVar('digitmile_request_db', default=None)
+
+
+class _RequestDB:
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    request_db = _request_db.get()
+    if request_db is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_db.queries += 1
+        request_db.seconds += time.perf_counter() - started
+
+
+def install_db_execute_wrapper(sender, connection, **kwargs):
+    # connection_created handler. Put first: connection.execute_wrapper() pops the last entry.
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, db_execute_wrapper)
+
+
+def _record(request, response, started, request_db):
+    elapsed = time.perf_counter() - started
+    match = getattr(request, 'resolver_match', None)
+    view = (match.view_name or match.route) if match else 'unmatched'
+    registry = get_registry()
+    registry.inc('digitmile_http_requests_total', (('view', view), ('method', request.method), ('status', str(response.status_code))))
+    registry.observe('digitmile_http_request_duration_seconds', (('view', view),), elapsed)
+    registry.inc('digitmile_db_queries_total', (('view', view),), request_db.queries)
+    registry.observe('digitmile_db_request_duration_seconds', (('view', view),), request_db.seconds)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if not _options().get('ENABLED', True):
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            request_db = _RequestDB()
+            token = _request_db.set(request_db)
+            try:
+                response = await get_response(request)
+            finally:
+                _request_db.reset(token)
+            _record(request, response, started, request_db)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            request_db = _RequestDB()
+            token = _request_db.set(request_db)
+            try:
+                response = get_response(request)
+            finally:
+                _request_db.reset(token)
+            _record(request, response, started, request_db)
+            return response
+    return middleware
+
+
+def _is_running(path):
+    pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. With METRICS['TOKEN'] set, asks for `Authorization: Bearer <token>`.
+    """
+    token = _options().get('TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+
+    registry = get_registry()
+    snapshots = [registry.snapshot()]
+    directory = _options().get('DIR')
+    if directory:
+        own_file = f'metrics-{registry.pid}.json'
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if os.path.basename(path) == own_file:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # a worker that is just writing, or gone
+            if not _is_running(path):
+                # Keep the counts of a worker that has exited, but not its point-in-time values
+                # (names it knew and this process does not are taken for gauges)
+                snapshot['gauges'] = [gauge for gauge in snapshot['gauges'] if METRICS.get(gauge[0], ('gauge',))[0] != 'gauge']
+            snapshots.append(snapshot)
+    values, histograms = merge(snapshots)
+    return HttpResponse(render(values, histograms), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:35
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_students(apps, schema_editor):
+    """
+    Existing classrooms can hold several students with the same name, which would make the
+    unique constraint fail. Keep the oldest one as is and suffix the others with " (2)", " (3)", ...
+    so no student (and none of their run statistics) is lost.
+    """
+    Student = apps.get_model('digitmileapi', 'Student')
+    duplicates = (
+        Student.objects.values('classroom_id', 'full_name')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        taken = set(
+            Student.objects.filter(classroom_id=duplicate['classroom_id']).values_list('full_name', flat=True)
+        )
+        students = Student.objects.filter(
+            classroom_id=duplicate['classroom_id'], full_name=duplicate['full_name']
+        ).order_by('id')
+        suffix = 2
+        for student in students[1:]:
+            while f"{student.full_name} ({suffix})" in taken:
+                suffix += 1
+            student.full_name = f"{student.full_name} ({suffix})"
+            taken.add(student.full_name)
+            student.save(update_fields=['full_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0002_teacher_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_students, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='student',
+            constraint=models.UniqueConstraint(fields=('classroom', 'full_name'), name='unique_student_name_per_classroom'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0003_student_unique_name_per_classroom'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassroomRunSummary',
+            fields=[
+                ('classroom', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='run_summary', serialize=False, to='digitmileapi.classroom')),
+                ('total_runs', models.PositiveBigIntegerField(default=0)),
+                ('total_wins', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StudentRunSummary',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='run_summary', serialize=False, to='digitmileapi.student')),
+                ('total_runs', models.PositiveBigIntegerField(default=0)),
+                ('total_wins', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
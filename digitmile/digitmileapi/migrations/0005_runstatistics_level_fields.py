@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0004_run_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runstatistics',
+            name='correct_moves',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='runstatistics',
+            name='created_at',
+            # Existing runs were never timestamped, they all get the time of the migration
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='runstatistics',
+            name='place',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='runstatistics',
+            name='score',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='runstatistics',
+            name='time_elapsed',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='runstatistics',
+            name='wrong_moves',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
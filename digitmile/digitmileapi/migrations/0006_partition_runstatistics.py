@@ -0,0 +1,95 @@
+import datetime
+
+from django.db import migrations
+
+TABLE = 'digitmileapi_runstatistics'
+COLUMNS = 'id, player_won, student_id, place, score, correct_moves, wrong_moves, time_elapsed, created_at'
+
+
+def _months(first, last):
+    month = datetime.date(first.year, first.month, 1)
+    while month <= last:
+        following = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        yield month, following
+        month = following
+
+
+def partition_run_statistics(apps, schema_editor):
+    """
+    Postgres only: rebuilds RunStatistics as a table range-partitioned by month on created_at,
+    with a BRIN index on created_at and a DEFAULT partition, and copies the existing rows over.
+
+    Partitioned tables need the partition key in their primary key, so the Postgres primary key
+    becomes (id, created_at). id still comes from its own identity sequence and stays unique,
+    which is all Django relies on. The copy holds an exclusive lock on the table, so run this
+    migration outside of school hours on large databases.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+
+    execute(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned")
+    execute(
+        f"CREATE TABLE {TABLE} (LIKE {TABLE}_unpartitioned INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) "
+        f"PARTITION BY RANGE (created_at)"
+    )
+    execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_id_created_at_pk PRIMARY KEY (id, created_at)")
+    execute(
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_student_id_fk_partitioned "
+        f"FOREIGN KEY (student_id) REFERENCES digitmileapi_student (id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    execute(f"CREATE INDEX {TABLE}_student_id_created_at ON {TABLE} (student_id, created_at)")
+    execute(f"CREATE INDEX {TABLE}_created_at_brin ON {TABLE} USING brin (created_at)")
+    execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+
+    # One partition per month from the oldest run to three months ahead
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(created_at) FROM {TABLE}_unpartitioned")
+        oldest = cursor.fetchone()[0]
+    today = datetime.date.today()
+    first = oldest.date() if oldest else today
+    last = datetime.date(today.year + (today.month + 2) // 12, (today.month + 2) % 12 + 1, 1)
+    for month, following in _months(first, last):
+        execute(
+            f"CREATE TABLE {TABLE}_y{month.year}m{month.month:02d} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+
+    execute(f"INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}_unpartitioned")
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)"
+    )
+    execute(f"DROP TABLE {TABLE}_unpartitioned")
+
+
+def unpartition_run_statistics(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+
+    execute(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_partitioned")
+    execute(
+        f"CREATE TABLE {TABLE} (LIKE {TABLE}_partitioned INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)"
+    )
+    execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id)")
+    execute(
+        f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_student_id_fk "
+        f"FOREIGN KEY (student_id) REFERENCES digitmileapi_student (id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    execute(f"CREATE INDEX {TABLE}_student_id ON {TABLE} (student_id)")
+    execute(f"INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}_partitioned")
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)"
+    )
+    execute(f"DROP TABLE {TABLE}_partitioned CASCADE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0005_runstatistics_level_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_run_statistics, unpartition_run_statistics),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0006_partition_runstatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refreshed_until', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MunicipalityDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('municipality', models.CharField(max_length=255)),
+                ('day', models.DateField()),
+                ('total_runs', models.PositiveBigIntegerField(default=0)),
+                ('total_wins', models.PositiveBigIntegerField(default=0)),
+                ('active_students', models.PositiveIntegerField(default=0)),
+                ('active_schools', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='municipality_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('municipality', 'day'), name='unique_municipality_rollup_per_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SchoolDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total_runs', models.PositiveBigIntegerField(default=0)),
+                ('total_wins', models.PositiveBigIntegerField(default=0)),
+                ('active_students', models.PositiveIntegerField(default=0)),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='digitmileapi.school')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='school_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('school', 'day'), name='unique_school_rollup_per_day')],
+            },
+        ),
+    ]
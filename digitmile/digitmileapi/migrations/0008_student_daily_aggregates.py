@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0007_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total_runs', models.PositiveBigIntegerField(default=0)),
+                ('total_wins', models.PositiveBigIntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_aggregates', to='digitmileapi.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='student_aggregate_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('student', 'day'), name='unique_student_aggregate_per_day')],
+            },
+        ),
+    ]
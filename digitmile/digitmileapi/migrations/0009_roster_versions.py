@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0008_student_daily_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classroom',
+            name='roster_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='RosterChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField()),
+                ('student_id', models.BigIntegerField()),
+                ('full_name', models.CharField(max_length=255)),
+                ('added', models.BooleanField()),
+                ('classroom', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='digitmileapi.classroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['classroom', 'version'], name='roster_change_version_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+import warnings
+
+from django.db import migrations
+
+# (index name, table, column) of every name and key the admin and the student search look in
+TRIGRAM_INDEXES = [
+    ('digitmileapi_student_full_name_trgm', 'digitmileapi_student', 'full_name'),
+    ('digitmileapi_classroom_key_trgm', 'digitmileapi_classroom', 'classroom_key'),
+    ('digitmileapi_teacher_full_name_trgm', 'digitmileapi_teacher', 'full_name'),
+    ('digitmileapi_school_name_trgm', 'digitmileapi_school', 'name'),
+    ('auth_user_username_trgm', 'auth_user', 'username'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """
+    Postgres only: GIN trigram indexes on UPPER(column::text), which is exactly the expression
+    Django compares for icontains and istartswith, so those lookups can use them (for search
+    terms of 3 characters or more, see search.py).
+
+    Built CONCURRENTLY, so the migration does not block writes but cannot run in a transaction.
+    pg_trgm is a trusted extension from Postgres 13 on, the owner of the database can create it.
+    Servers without the contrib modules get no indexes; search still works, only slower.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            warnings.warn("pg_trgm is not available on this server, skipping the trigram search indexes")
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('digitmileapi', '0009_roster_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
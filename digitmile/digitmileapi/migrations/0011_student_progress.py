@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitmileapi', '0010_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentProgress',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='progress', serialize=False, to='digitmileapi.student')),
+                ('total_runs', models.PositiveBigIntegerField(default=0)),
+                ('total_wins', models.PositiveBigIntegerField(default=0)),
+                ('win_rate', models.FloatField()),
+                ('recent_win_rate', models.FloatField(blank=True, null=True)),
+                ('current_streak', models.IntegerField(default=0)),
+                ('best_win_streak', models.PositiveIntegerField(default=0)),
+                ('rating', models.FloatField(blank=True, null=True)),
+                ('average_score', models.FloatField(blank=True, null=True)),
+                ('accuracy', models.FloatField(blank=True, null=True)),
+                ('average_time', models.FloatField(blank=True, null=True)),
+                ('classroom_percentile', models.FloatField(blank=True, null=True)),
+                ('school_percentile', models.FloatField(blank=True, null=True)),
+                ('municipality_percentile', models.FloatField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
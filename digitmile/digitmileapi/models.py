@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 class School(models.Model):
     # id SERIAL PRIMARY KEY -> Django adds an AutoField 'id' by default
@@ -24,8 +25,21 @@ class Teacher(models.Model):
 
     def __str__(self):
         # Prefer using the user's username or full name if available
+        # (teachers created by import_roster have no user account yet)
+        if self.user is None:
+            return self.full_name
         return self.user.get_full_name() or self.user.username
 
+def get_teacher_profile(user):
+    # The Teacher of a user, or None. Looked up once per user object: for a user without a
+    # profile every hasattr(user, 'teacher_profile') would hit the database again.
+    if not hasattr(user, '_teacher_profile'):
+        user._teacher_profile = (
+            Teacher.objects.select_related('school').filter(user_id=user.pk).first()
+            if user.is_authenticated else None
+        )
+    return user._teacher_profile
+
 class Classroom(models.Model):
     # id SERIAL PRIMARY KEY -> Django adds an AutoField 'id' by default
     classroom_key = models.CharField(max_length=100, unique=True)  # VARCHAR NOT NULL UNIQUE
@@ -35,6 +49,8 @@ class Classroom(models.Model):
                                    # If a Teacher is deleted, their Classrooms are also deleted.
         related_name='classrooms'  # Optional: for easier reverse access from Teacher
     ) # teacher_ref INTEGER NOT NULL
+    # Bumped on every change to what checkClassroomKey returns for this classroom (see rosters.py)
+    roster_version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"{self.classroom_key} (Teacher: {self.teacher.full_name})"
@@ -49,9 +65,45 @@ class Student(models.Model):
         related_name='students'    # Optional: for easier reverse access from Classroom
     ) # classroom_ref INTEGER NOT NULL
 
+    class Meta:
+        constraints = [
+            # Names identify students within a classroom (the game client logs in by name),
+            # and the unique index also covers lookups by (classroom, full_name)
+            models.UniqueConstraint(fields=['classroom', 'full_name'], name='unique_student_name_per_classroom'),
+        ]
+
     def __str__(self):
         return self.full_name
 
+class RosterChange(models.Model):
+    # One student added to or removed from a classroom roster (a rename is both), so clients can
+    # catch up from an older roster_version without downloading the whole roster (see rosters.py).
+    # No database constraints: the rows of deleted students and classrooms are the point.
+    classroom = models.ForeignKey(Classroom, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    version = models.PositiveBigIntegerField()
+    student_id = models.BigIntegerField()
+    full_name = models.CharField(max_length=255)
+    added = models.BooleanField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['classroom', 'version'], name='roster_change_version_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.classroom_id} v{self.version}: {'+' if self.added else '-'}{self.full_name}"
+
+class RunStatisticsQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        # Superusers see every run, teachers only the runs of students in their own classrooms.
+        # Shared by the admin and the exports so both apply the same scoping.
+        if user.is_superuser:
+            return self
+        teacher = get_teacher_profile(user)
+        if teacher is not None:
+            return self.filter(student__classroom__teacher=teacher)
+        return self.none()
+
 class RunStatistics(models.Model):
     # id SERIAL PRIMARY KEY -> Django adds an AutoField 'id' by default
     student = models.ForeignKey(
@@ -62,5 +114,157 @@ class RunStatistics(models.Model):
     ) # student_ref INTEGER NOT NULL
     player_won = models.BooleanField() # BOOLEAN NOT NULL
 
+    # The rest of the levelStatistics payload sent by the game client. Nullable because
+    # older clients (and rows from before these columns existed) do not have them.
+    place = models.SmallIntegerField(null=True, blank=True)
+    score = models.IntegerField(null=True, blank=True)
+    correct_moves = models.PositiveIntegerField(null=True, blank=True)
+    wrong_moves = models.PositiveIntegerField(null=True, blank=True)
+    time_elapsed = models.FloatField(null=True, blank=True)
+    # On Postgres the table is range-partitioned by month on this column (migration 0006)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = RunStatisticsQuerySet.as_manager()
+
+    @classmethod
+    def from_level_statistics(cls, student_id, level_statistics):
+        # Builds an unsaved row from a validated levelStatistics dict (LevelStatisticsInputSerializer)
+        place = level_statistics.get('place')
+        return cls(
+            student_id=student_id,
+            player_won=place == 1,
+            place=place,
+            score=level_statistics.get('score'),
+            correct_moves=level_statistics.get('correctMoves'),
+            wrong_moves=level_statistics.get('wrongMoves'),
+            time_elapsed=level_statistics.get('timeElapsed'),
+        )
+
+    def __str__(self):
+        return f"Run for {self.student.full_name} - Won: {self.player_won}"
+
+class StudentRunSummary(models.Model):
+    # Running totals over RunStatistics, kept up to date by run_summaries.insert_runs()
+    # so "how is this student doing" never has to count the whole log
+    student = models.OneToOneField(
+        Student,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='run_summary'
+    )
+    total_runs = models.PositiveBigIntegerField(default=0)
+    total_wins = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.student_id}: {self.total_wins}/{self.total_runs} won"
+
+class ClassroomRunSummary(models.Model):
+    # Same as StudentRunSummary, summed over every student in the classroom
+    classroom = models.OneToOneField(
+        Classroom,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='run_summary'
+    )
+    total_runs = models.PositiveBigIntegerField(default=0)
+    total_wins = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.classroom_id}: {self.total_wins}/{self.total_runs} won"
+
+class StudentDailyAggregate(models.Model):
+    # What is left of a student's runs on one day (UTC) once `manage.py compact_runs` has moved
+    # them out of RunStatistics into the archive; reports add these to the remaining raw runs
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='daily_aggregates')
+    day = models.DateField()
+    total_runs = models.PositiveBigIntegerField(default=0)
+    total_wins = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'day'], name='unique_student_aggregate_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='student_aggregate_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student_id} on {self.day}: {self.total_wins}/{self.total_runs} won"
+
+class StudentProgress(models.Model):
+    # Nightly analytics per student, written by `manage.py compute_student_progress`
+    # (analytics.py) and read by the teacher dashboard. Percentiles rank the rating against the
+    # other students of the same classroom, school and municipality.
+    student = models.OneToOneField(
+        Student,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='progress'
+    )
+    total_runs = models.PositiveBigIntegerField(default=0)
+    total_wins = models.PositiveBigIntegerField(default=0)
+    win_rate = models.FloatField()
+    # Null for students whose runs have all been compacted (compaction.py)
+    recent_win_rate = models.FloatField(null=True, blank=True)
+    current_streak = models.IntegerField(default=0)  # Wins in a row, negative for losses
+    best_win_streak = models.PositiveIntegerField(default=0)
+    rating = models.FloatField(null=True, blank=True)  # 0-100
+    average_score = models.FloatField(null=True, blank=True)
+    accuracy = models.FloatField(null=True, blank=True)  # Correct moves / all moves
+    average_time = models.FloatField(null=True, blank=True)
+    classroom_percentile = models.FloatField(null=True, blank=True)
+    school_percentile = models.FloatField(null=True, blank=True)
+    municipality_percentile = models.FloatField(null=True, blank=True)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.student_id}: rating {self.rating}"
+
+class SchoolDailyRollup(models.Model):
+    # Runs per school and day (UTC), rebuilt for the touched days by `manage.py refresh_rollups`
+    # so the regional dashboards never have to join the run log
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    total_runs = models.PositiveBigIntegerField(default=0)
+    total_wins = models.PositiveBigIntegerField(default=0)
+    active_students = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['school', 'day'], name='unique_school_rollup_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='school_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.school_id} on {self.day}: {self.total_wins}/{self.total_runs} won"
+
+class MunicipalityDailyRollup(models.Model):
+    # SchoolDailyRollup summed per municipality; a student only ever belongs to one school,
+    # so active_students adds up without double counting
+    municipality = models.CharField(max_length=255)
+    day = models.DateField()
+    total_runs = models.PositiveBigIntegerField(default=0)
+    total_wins = models.PositiveBigIntegerField(default=0)
+    active_students = models.PositiveIntegerField(default=0)
+    active_schools = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['municipality', 'day'], name='unique_municipality_rollup_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='municipality_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.municipality} on {self.day}: {self.total_wins}/{self.total_runs} won"
+
+class RollupWatermark(models.Model):
+    # How far refresh_rollups has read the run log, one row per rollup job
+    name = models.CharField(max_length=100, primary_key=True)
+    refreshed_until = models.DateTimeField()
+
     def __str__(self):
-        return f"Run for {self.student.full_name} - Won: {self.player_won}"
\ No newline at end of file
+        return f"{self.name}: {self.refreshed_until}"
@@ -0,0 +1,137 @@
+# myapi/partitions.py
+"""
+Monthly range partitions of the RunStatistics table on Postgres.
+
+Migration 0006 turns the table into one partitioned by created_at, with a DEFAULT partition
+catching anything that has no month partition yet. `manage.py create_run_partitions` should
+run regularly (e.g. from cron once a week) to create the coming months ahead of time, so that
+the DEFAULT partition stays empty. Months emptied by `manage.py compact_runs` are dropped again.
+"""
+import datetime
+import re
+
+from django.db import OperationalError, transaction
+
+from .models import RunStatistics
+
+PARENT_TABLE = RunStatistics._meta.db_table
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def partition_month(name):
+    """
+    The month a partition created by ensure_month_partitions() holds, None for any other table.
+    """
+    match = re.fullmatch(rf"{re.escape(PARENT_TABLE)}_y(\d{{4}})m(\d{{2}})", name)
+    return datetime.date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND c.relnamespace = to_regnamespace(current_schema())",
+            [PARENT_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def ensure_month_partitions(connection, first_month, last_month):
+    """
+    Creates the monthly partitions from first_month to last_month (both included) that do not
+    exist yet, and returns their names. Rows already sitting in the DEFAULT partition for one of
+    those months are moved into the new partition.
+    """
+    quote = connection.ops.quote_name
+    created = []
+    month = month_start(first_month)
+    with connection.cursor() as cursor:
+        while month <= last_month:
+            name = partition_name(month)
+            bounds = [month.isoformat(), next_month(month).isoformat()]
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is None:
+                cursor.execute(
+                    f"SELECT EXISTS (SELECT 1 FROM {quote(DEFAULT_PARTITION)} "
+                    f"WHERE created_at >= %s AND created_at < %s)",
+                    bounds,
+                )
+                if cursor.fetchone()[0]:
+                    # A partition cannot be created while the DEFAULT one holds rows in its range:
+                    # build it as a plain table, move the rows over, then attach it. Without the
+                    # identity of the parent: a table with an identity column of its own cannot be
+                    # attached, and ids come from the parent's sequence anyway.
+                    cursor.execute(
+                        f"CREATE TABLE {quote(name)} (LIKE {quote(PARENT_TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                    )
+                    cursor.execute(
+                        f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} "
+                        f"WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                        f"INSERT INTO {quote(name)} SELECT * FROM moved",
+                        bounds,
+                    )
+                    cursor.execute(
+                        f"ALTER TABLE {quote(PARENT_TABLE)} ATTACH PARTITION {quote(name)} "
+                        f"FOR VALUES FROM (%s) TO (%s)",
+                        bounds,
+                    )
+                else:
+                    cursor.execute(
+                        f"CREATE TABLE {quote(name)} PARTITION OF {quote(PARENT_TABLE)} "
+                        f"FOR VALUES FROM (%s) TO (%s)",
+                        bounds,
+                    )
+                created.append(name)
+            month = next_month(month)
+    return created
+
+
+def drop_empty_partitions(connection, before, lock_timeout='2s'):
+    """
+    Drops the month partitions that end on or before the date `before` and hold no rows, and
+    returns their names. Dropping a partition briefly locks the whole table, so a partition whose
+    lock is not granted within `lock_timeout` is left for the next time instead of making every
+    insert queue up behind us.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND p.relnamespace = to_regnamespace(current_schema())",
+            [PARENT_TABLE],
+        )
+        names = sorted(name for name, in cursor.fetchall())
+
+    dropped = []
+    for name in names:
+        month = partition_month(name)
+        if month is None or next_month(month) > before:
+            continue
+        try:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{lock_timeout}'")
+                # Locked before looking, so a late run for that month cannot slip in and be dropped
+                cursor.execute(f"LOCK TABLE {quote(PARENT_TABLE)}, {quote(name)} IN ACCESS EXCLUSIVE MODE")
+                cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {quote(name)})")
+                if cursor.fetchone()[0]:
+                    continue
+                cursor.execute(f"DROP TABLE {quote(name)}")
+        except OperationalError:
+            continue
+        dropped.append(name)
+    return dropped
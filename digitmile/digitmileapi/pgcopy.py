@@ -0,0 +1,86 @@
+# myapi/pgcopy.py
+"""
+Bulk loading through Postgres' COPY FROM STDIN, for both psycopg2 and psycopg 3.
+"""
+import io
+
+
+def _text_value(value):
+    # COPY's text format: \N is NULL, and backslash, tab and line breaks must be escaped
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+class _RowReader(io.TextIOBase):
+    """
+    File-like object that renders rows in COPY text format as it is read, so that
+    streaming an arbitrarily long iterator of rows never holds more than one chunk in memory.
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            self._buffer += '\t'.join(_text_value(value) for value in row) + '\n'
+            self.count += 1
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    readline = read
+
+
+def next_ids(connection, table, count, column='id'):
+    """
+    Takes `count` values from the sequence behind `table`.`column`, for rows that are loaded
+    with COPY (which, unlike INSERT, cannot return the ids it assigned).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            [connection.ops.quote_name(table), column, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def copy_rows(connection, table, columns, rows):
+    """
+    Streams an iterable of row tuples into `table` with COPY and returns the number of rows.
+    `connection` is a Django connection to a Postgres database.
+    """
+    quote = connection.ops.quote_name
+    sql = f"COPY {quote(table)} ({', '.join(quote(column) for column in columns)}) FROM STDIN"
+    reader = _RowReader(rows)
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):  # psycopg2
+            raw_cursor.copy_expert(sql, reader, size=65536)
+        else:  # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                while True:
+                    chunk = reader.read(65536)
+                    if not chunk:
+                        break
+                    copy.write(chunk)
+    return reader.count
@@ -0,0 +1,119 @@
+# myapi/renderers.py
+"""
+Renderers and parsers for the game-client endpoints.
+
+ORJSONRenderer is a drop-in for DRF's JSONRenderer that encodes with orjson when it is installed.
+With msgpack installed, clients can also send `Content-Type: application/msgpack` bodies and
+ask for `Accept: application/msgpack` responses, which are noticeably smaller for long rosters.
+Both libraries are optional; without them the endpoints speak plain JSON exactly as before.
+"""
+import json
+
+from django.http import HttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+def _default(value):
+    # Lazy translation strings, Decimals, UUIDs... the same fallbacks DRF's encoder has
+    return JSONEncoder().default(value)
+
+
+def dumps_json(data):
+    """
+    Compact UTF-8 JSON bytes, with orjson when it is available.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Indented output (?indent / browsable API) is rare enough to leave to DRF
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=_default)
+
+
+class ORJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default)
+
+
+class MessagePackParser(BaseParser):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
+
+# For the renderer_classes/parser_classes of the game-client views; JSON stays first, so
+# clients that send no Accept header keep getting JSON
+API_RENDERER_CLASSES = [ORJSONRenderer] + ([MessagePackRenderer] if msgpack is not None else [])
+API_PARSER_CLASSES = [ORJSONParser] + ([MessagePackParser] if msgpack is not None else [])
+
+
+# The async views in async_views.py are plain Django views, these two do the same negotiation there
+
+def parse_body(request):
+    """
+    Decodes a JSON or MessagePack request body; returns None when it is malformed.
+    """
+    body = request.body or b''
+    try:
+        if msgpack is not None and request.content_type == MSGPACK_MEDIA_TYPE:
+            return msgpack.unpackb(body) if body else {}
+        if not body:
+            return {}
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError:
+        return None
+
+
+def api_response(request, data, status=200):
+    """
+    HttpResponse with `data` as MessagePack when the client accepts it, as JSON otherwise.
+    """
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get('Accept', ''):
+        response = HttpResponse(msgpack.packb(data, default=_default), content_type=MSGPACK_MEDIA_TYPE, status=status)
+    else:
+        response = HttpResponse(dumps_json(data), content_type='application/json', status=status)
+    response['Vary'] = 'Accept'
+    return response
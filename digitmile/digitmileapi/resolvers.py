@@ -0,0 +1,87 @@
+# myapi/resolvers.py
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Classroom, Student
+
+ROSTER_FIELDS = ('id', 'teacher__full_name', 'teacher__school__name', 'teacher__school__municipality', 'roster_version')
+
+
+def resolve_student(classroom_key, full_name):
+    """
+    Looks up a student by classroom key and name with a single joined query.
+
+    Returns a (student_id, classroom_id) tuple. Raises Classroom.DoesNotExist or
+    Student.DoesNotExist when nothing matches (one extra query is spent on the miss to tell
+    the two apart), and Student.MultipleObjectsReturned when the name is not unique in the
+    classroom, which can only happen on databases that predate the unique constraint.
+    """
+    rows = list(
+        Student.objects.filter(classroom__classroom_key=classroom_key, full_name=full_name)
+        .values_list('id', 'classroom_id')[:2]
+    )
+    if len(rows) == 1:
+        return rows[0]
+    if rows:
+        raise Student.MultipleObjectsReturned(
+            f"More than one student named '{full_name}' in classroom '{classroom_key}'"
+        )
+    if not Classroom.objects.filter(classroom_key=classroom_key).exists():
+        raise Classroom.DoesNotExist(f"Classroom with key '{classroom_key}' does not exist")
+    raise Student.DoesNotExist(f"No student named '{full_name}' in classroom '{classroom_key}'")
+
+
+async def aresolve_student(classroom_key, full_name):
+    """
+    Async version of resolve_student() for the ASGI views, with the same return value and exceptions.
+    """
+    rows = [
+        row async for row in
+        Student.objects.filter(classroom__classroom_key=classroom_key, full_name=full_name)
+        .values_list('id', 'classroom_id')[:2]
+    ]
+    if len(rows) == 1:
+        return rows[0]
+    if rows:
+        raise Student.MultipleObjectsReturned(
+            f"More than one student named '{full_name}' in classroom '{classroom_key}'"
+        )
+    if not await Classroom.objects.filter(classroom_key=classroom_key).aexists():
+        raise Classroom.DoesNotExist(f"Classroom with key '{classroom_key}' does not exist")
+    raise Student.DoesNotExist(f"No student named '{full_name}' in classroom '{classroom_key}'")
+
+
+def load_classroom(classroom_key):
+    """
+    Reads the classroom part of what checkClassroomKey returns.
+
+    Returns (classroom_id, teacher_name, school_name, municipality, roster_version) or raises
+    Classroom.DoesNotExist. Always from the primary, like load_students(): the roster built
+    from them goes into the roster cache, and signals.py drops cached rosters when a change
+    commits, which can be before a replica has it. A roster read from a lagging replica right
+    after that would stay cached for the whole TTL.
+    """
+    return Classroom.objects.using(DEFAULT_DB_ALIAS).values_list(*ROSTER_FIELDS).get(classroom_key=classroom_key)
+
+
+def load_students(classroom_id):
+    """
+    The (student_id, full_name) pairs of a classroom, from the primary (see load_classroom()).
+    """
+    return list(Student.objects.using(DEFAULT_DB_ALIAS).filter(classroom_id=classroom_id).values_list('id', 'full_name'))
+
+
+async def aload_classroom(classroom_key):
+    """
+    Async version of load_classroom().
+    """
+    return await Classroom.objects.using(DEFAULT_DB_ALIAS).values_list(*ROSTER_FIELDS).aget(classroom_key=classroom_key)
+
+
+async def aload_students(classroom_id):
+    """
+    Async version of load_students().
+    """
+    return [
+        row async for row in
+        Student.objects.using(DEFAULT_DB_ALIAS).filter(classroom_id=classroom_id).values_list('id', 'full_name')
+    ]
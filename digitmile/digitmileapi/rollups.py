@@ -0,0 +1,142 @@
+# myapi/rollups.py
+"""
+Daily school and municipality rollups of RunStatistics (see `manage.py refresh_rollups`).
+
+A refresh only looks at runs created since the previous one. It collects the (school, day)
+buckets those runs fall into and recomputes each of these buckets completely from the run log,
+so re-reading a run twice is harmless. That is why every refresh starts OVERLAP before the
+stored watermark: runs that were committed late (buffered ingestion, long transactions) with
+an older created_at are still picked up. Municipality rows are then rebuilt for the touched
+days from the school rows, which is cheap.
+
+Days whose runs were compacted (see compaction.py) are read from StudentDailyAggregate, together
+with any raw runs that arrived for them later. Compacting does not change any total, so it does
+not need a refresh.
+
+Rows are attributed to the school a student belongs to at refresh time. After moving
+classrooms or teachers between schools, run a full refresh.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import MunicipalityDailyRollup, RollupWatermark, RunStatistics, SchoolDailyRollup, StudentDailyAggregate
+
+WATERMARK_NAME = 'daily_rollups'
+OVERLAP = datetime.timedelta(minutes=10)
+
+SCHOOL = 'student__classroom__teacher__school_id'
+
+
+def _day_bounds(day):
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
+
+
+def touched_buckets(since=None):
+    """
+    {day: {school_id, ...}} of every run created at or after `since`; when None, of all runs
+    and of every compacted day.
+    """
+    runs = RunStatistics.objects.all()
+    if since is not None:
+        runs = runs.filter(created_at__gte=since)
+    buckets = defaultdict(set)
+    rows = runs.annotate(day=TruncDate('created_at', tzinfo=datetime.timezone.utc)).values_list('day', SCHOOL).distinct()
+    for day, school_id in rows:
+        buckets[day].add(school_id)
+    if since is None:
+        # A full refresh also has to rebuild the days that only exist as compacted aggregates
+        compacted = StudentDailyAggregate.objects.order_by().values_list('day', SCHOOL).distinct()
+        for day, school_id in compacted:
+            buckets[day].add(school_id)
+    return buckets
+
+
+def refresh_day(day, school_ids):
+    """
+    Recomputes the rollups of `school_ids` on `day` and the municipality rollups of that day.
+    """
+    start, end = _day_bounds(day)
+    # Per student first, so a student with both compacted and raw runs on that day counts once
+    raw_rows = (
+        RunStatistics.objects.filter(created_at__gte=start, created_at__lt=end, **{f'{SCHOOL}__in': school_ids})
+        .order_by()
+        .values_list(SCHOOL, 'student_id')
+        .annotate(runs=Count('id'), wins=Count('id', filter=Q(player_won=True)))
+    )
+    compacted_rows = (
+        StudentDailyAggregate.objects.filter(day=day, **{f'{SCHOOL}__in': school_ids})
+        .values_list(SCHOOL, 'student_id', 'total_runs', 'total_wins')
+    )
+    schools = defaultdict(lambda: [0, 0, set()])
+    for rows in (raw_rows, compacted_rows):
+        for school_id, student_id, runs, wins in rows:
+            school = schools[school_id]
+            school[0] += runs
+            school[1] += wins
+            school[2].add(student_id)
+
+    with transaction.atomic():
+        SchoolDailyRollup.objects.filter(day=day, school_id__in=school_ids).delete()
+        SchoolDailyRollup.objects.bulk_create([
+            SchoolDailyRollup(
+                school_id=school_id,
+                day=day,
+                total_runs=runs,
+                total_wins=wins,
+                active_students=len(students),
+            )
+            for school_id, (runs, wins, students) in schools.items()
+        ])
+
+        municipality_rows = (
+            SchoolDailyRollup.objects.filter(day=day)
+            .values('school__municipality')
+            .annotate(
+                runs=Sum('total_runs'),
+                wins=Sum('total_wins'),
+                students=Sum('active_students'),
+                schools=Count('school_id'),
+            )
+        )
+        MunicipalityDailyRollup.objects.filter(day=day).delete()
+        MunicipalityDailyRollup.objects.bulk_create([
+            MunicipalityDailyRollup(
+                municipality=row['school__municipality'],
+                day=day,
+                total_runs=row['runs'],
+                total_wins=row['wins'],
+                active_students=row['students'],
+                active_schools=row['schools'],
+            )
+            for row in municipality_rows
+        ])
+
+
+def refresh_rollups(full=False, overlap=OVERLAP):
+    """
+    Brings the rollups up to date and returns the number of days that were refreshed.
+    `full` drops everything and rebuilds from the whole run log.
+    """
+    # Taken before reading, so runs created while this refresh is running are read next time
+    started = timezone.now()
+    watermark = RollupWatermark.objects.filter(name=WATERMARK_NAME).first()
+
+    if full or watermark is None:
+        with transaction.atomic():
+            SchoolDailyRollup.objects.all().delete()
+            MunicipalityDailyRollup.objects.all().delete()
+        buckets = touched_buckets()
+    else:
+        buckets = touched_buckets(watermark.refreshed_until - overlap)
+
+    for day in sorted(buckets):
+        refresh_day(day, buckets[day])
+
+    RollupWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={'refreshed_until': started})
+    return len(buckets)
@@ -0,0 +1,157 @@
+# myapi/roster_cache.py
+"""
+Cache for the /api/checkClassroomKey response, keyed by classroom_key.
+
+There are two tiers:
+  * an in-process LRU with a TTL and a maximum number of entries, answered without any I/O
+  * an optional shared tier on one of the Django cache backends (settings.CACHES), so that
+    every worker process benefits from a roster that one of them already built
+
+Entries are dropped by the signal handlers in signals.py whenever a Student, Classroom,
+Teacher or School changes. The shared tier is cleared for every process, but the in-process
+tier of *other* processes only expires through its TTL, so keep ROSTER_CACHE['TTL'] short.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU mapping with a per-entry time to live.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)  # Evict the least recently used entry
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RosterCache:
+    """
+    Two-tier cache of serialized roster payloads.
+    """
+    key_prefix = 'digitmile:roster:'
+
+    def __init__(self, ttl=60, max_entries=1024, backend=None):
+        self.ttl = ttl
+        self.local = LRUCache(max_entries=max_entries, ttl=ttl)
+        # Name of a Django cache alias, or None to only use the in-process tier
+        self.shared = caches[backend] if backend else None
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _shared_key(self, classroom_key):
+        return f"{self.key_prefix}{classroom_key}"
+
+    def get(self, classroom_key):
+        payload = self.local.get(classroom_key)
+        if payload is not None:
+            self.local_hits += 1
+            return payload
+        if self.shared is not None:
+            payload = self.shared.get(self._shared_key(classroom_key))
+            if payload is not None:
+                self.shared_hits += 1
+                self.local.set(classroom_key, payload)
+                return payload
+        self.misses += 1
+        return None
+
+    def set(self, classroom_key, payload):
+        self.local.set(classroom_key, payload)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(classroom_key), payload, self.ttl)
+
+    async def aget(self, classroom_key):
+        payload = self.local.get(classroom_key)
+        if payload is not None:
+            self.local_hits += 1
+            return payload
+        if self.shared is not None:
+            payload = await self.shared.aget(self._shared_key(classroom_key))
+            if payload is not None:
+                self.shared_hits += 1
+                self.local.set(classroom_key, payload)
+                return payload
+        self.misses += 1
+        return None
+
+    async def aset(self, classroom_key, payload):
+        self.local.set(classroom_key, payload)
+        if self.shared is not None:
+            await self.shared.aset(self._shared_key(classroom_key), payload, self.ttl)
+
+    def invalidate(self, *classroom_keys):
+        classroom_keys = [key for key in classroom_keys if key]
+        for key in classroom_keys:
+            self.local.delete(key)
+        if self.shared is not None and classroom_keys:
+            self.shared.delete_many([self._shared_key(key) for key in classroom_keys])
+
+    def clear(self):
+        # Only the in-process tier; entries in the shared tier run out through their TTL
+        self.local.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self.local),
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+        }
+
+
+_roster_cache = None
+_roster_cache_lock = threading.Lock()
+
+
+def get_roster_cache():
+    """
+    Returns the process-wide RosterCache, built from settings.ROSTER_CACHE on first use.
+    """
+    global _roster_cache
+    if _roster_cache is None:
+        with _roster_cache_lock:
+            if _roster_cache is None:
+                options = getattr(settings, 'ROSTER_CACHE', {})
+                _roster_cache = RosterCache(
+                    ttl=options.get('TTL', 60),
+                    max_entries=options.get('MAX_ENTRIES', 1024),
+                    backend=options.get('BACKEND'),
+                )
+    return _roster_cache
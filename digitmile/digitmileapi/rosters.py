@@ -0,0 +1,162 @@
+# myapi/rosters.py
+"""
+Roster versions for /api/checkClassroomKey/.
+
+Classroom.roster_version goes up whenever anything in that classroom's response changes. The
+student signal handlers (signals.py) also write a RosterChange row per added or removed name
+(a rename is both). Changes without such rows bump the version only, which forces clients to
+download the full roster again:
+  * teacher and school saves
+  * bulk imports (import_roster)
+  * QuerySet.update() on students, which sends no signals: call bump_roster_versions() after it
+
+Clients send back what they got last time in two ways:
+  * If-None-Match with the ETag: 304 and no body when nothing changed
+  * sinceVersion: only the names added and removed since that version (and tokens for the added
+    ones), when the change rows cover every version in between; otherwise the full roster
+
+The ETag also changes every STUDENT_TOKEN_MAX_AGE / 2 seconds, so a 304 never leaves a client
+with student tokens that are about to expire. Tokens of students that did not change are not
+sent again with a delta; clients keep sending the name next to the token, so an expired one
+only costs a name lookup.
+"""
+import time
+import zlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models import F
+
+from .models import Classroom, RosterChange
+from .routers import read_alias
+from .tokens import make_student_token
+
+
+def roster_etag(classroom_key, version):
+    epoch = int(time.time()) // max(1, settings.STUDENT_TOKEN_MAX_AGE // 2)
+    return f'"{zlib.crc32(classroom_key.encode()):08x}-{version}-{epoch}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def parse_since_version(value):
+    """
+    sinceVersion from a request body: None when it was not sent, otherwise a non-negative int.
+    Raises ValueError for anything else.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    value = int(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
+
+
+def record_roster_change(classroom_id, added=(), removed=()):
+    """
+    Bumps the roster version of a classroom and records which (student_id, full_name) pairs were
+    added to and removed from it. The version update locks the classroom row until the
+    surrounding transaction ends, so concurrent changes get consecutive versions.
+    """
+    using = router.db_for_write(RosterChange)
+    with transaction.atomic(using=using):
+        if not Classroom.objects.using(using).filter(pk=classroom_id).update(roster_version=F('roster_version') + 1):
+            return  # The classroom itself is being deleted
+        version = Classroom.objects.using(using).filter(pk=classroom_id).values_list('roster_version', flat=True).get()
+        RosterChange.objects.using(using).bulk_create(
+            [
+                RosterChange(classroom_id=classroom_id, version=version, student_id=student_id, full_name=full_name, added=False)
+                for student_id, full_name in removed
+            ] + [
+                RosterChange(classroom_id=classroom_id, version=version, student_id=student_id, full_name=full_name, added=True)
+                for student_id, full_name in added
+            ]
+        )
+
+
+def bump_roster_versions(classrooms):
+    """
+    Bumps the roster version of every classroom in the `classrooms` queryset without recording
+    what changed, so their clients get the full roster next time.
+    """
+    classrooms.update(roster_version=F('roster_version') + 1)
+
+
+def net_changes(changes):
+    """
+    Folds (student_id, full_name, added) rows, oldest first, into what a client has to apply:
+    ({student_id: full_name} added, [full_name, ...] removed). A student who came and went
+    within the range does not show up at all.
+    """
+    added = {}
+    removed = []
+    for student_id, full_name, was_added in changes:
+        if was_added:
+            added[student_id] = full_name
+        elif student_id in added and added[student_id] == full_name:
+            del added[student_id]
+        else:
+            removed.append(full_name)
+    return added, removed
+
+
+def _delta_rows(alias, classroom_key, since_version, version):
+    return (
+        RosterChange.objects.using(alias)
+        .filter(classroom__classroom_key=classroom_key, version__gt=since_version, version__lte=version)
+        .order_by('version', 'id')
+        .values_list('classroom_id', 'version', 'student_id', 'full_name', 'added')
+    )
+
+
+def _delta_payload(rows, since_version, version):
+    if len({row[1] for row in rows}) != version - since_version:
+        return None  # Some of the versions in between have no change rows
+    classroom_id = rows[0][0] if rows else None
+    added, removed = net_changes(row[2:] for row in rows)
+    return {
+        'version': version,
+        'added': list(added.values()),
+        'removed': removed,
+        'studentTokens': {full_name: make_student_token(classroom_id, student_id) for student_id, full_name in added.items()},
+    }
+
+
+def roster_delta(classroom_key, since_version, version, alias=None):
+    """
+    The checkClassroomKey delta from `since_version` up to `version`, or None when the client
+    needs the full roster.
+    """
+    if since_version > version:
+        return None
+    if since_version == version:
+        return _delta_payload([], since_version, version)
+    alias = alias or read_alias()
+    payload = _delta_payload(list(_delta_rows(alias, classroom_key, since_version, version)), since_version, version)
+    if payload is None and alias != DEFAULT_DB_ALIAS:
+        # The replica may not have the newest change rows yet
+        payload = _delta_payload(list(_delta_rows(DEFAULT_DB_ALIAS, classroom_key, since_version, version)), since_version, version)
+    return payload
+
+
+async def aroster_delta(classroom_key, since_version, version, alias=None):
+    """
+    Async version of roster_delta().
+    """
+    if since_version > version:
+        return None
+    if since_version == version:
+        return _delta_payload([], since_version, version)
+    alias = alias or read_alias()
+    rows = [row async for row in _delta_rows(alias, classroom_key, since_version, version)]
+    payload = _delta_payload(rows, since_version, version)
+    if payload is None and alias != DEFAULT_DB_ALIAS:
+        rows = [row async for row in _delta_rows(DEFAULT_DB_ALIAS, classroom_key, since_version, version)]
+        payload = _delta_payload(rows, since_version, version)
+    return payload
@@ -0,0 +1,132 @@
+# myapi/routers.py
+"""
+Read-replica routing (settings.DATABASE_ROUTERS, replicas configured with DB_REPLICAS).
+
+Nothing goes to a replica by default. Code that can live with a little replication lag opts in,
+either with `with replica_reads():` (the RunStatistics admin changelist) or by picking an alias
+with read_alias() and passing it to `.using()` (checkClassroomKey roster deltas, the streaming
+exports, whose querysets are read after the view has returned, and the student search).
+Everything else, and every write, uses 'default'. Full checkClassroomKey rosters are not read
+from replicas: they are cached, and a roster from a lagging replica would outlive the
+invalidation in signals.py.
+
+A request stays on the primary once it has written anything: pin_primary_middleware gives each
+request a RoutingState, and db_for_write marks it. Reads inside a transaction on 'default' also
+stay there. So that a teacher who just saved something in the admin sees it on the next page,
+the middleware also sets a short-lived cookie after a write (settings.DB_REPLICA_PIN_SECONDS)
+and requests carrying it read from the primary as well.
+"""
+import contextlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_COOKIE = 'digitmile_primary'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_routing_state = ContextVar('routing_state', default=None)
+
+
+class RoutingState:
+    # One per request; mutated in place so that writes made in a sync_to_async thread count too
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_aliases():
+    return getattr(settings, 'DB_REPLICA_ALIASES', [])
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """
+    Reads made inside this block may go to a replica.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _primary_required():
+    state = _routing_state.get()
+    if state is not None and (state.pinned or state.wrote):
+        return True
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+def read_alias():
+    """
+    A replica alias when there are replicas and the current request has not written, else 'default'.
+    """
+    aliases = replica_aliases()
+    if not aliases or _primary_required():
+        return DEFAULT_DB_ALIAS
+    return random.choice(aliases)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in replica_aliases():
+            return False
+        return None
+
+
+def _pin(response, state):
+    pin_seconds = getattr(settings, 'DB_REPLICA_PIN_SECONDS', 0)
+    if state.wrote and pin_seconds:
+        response.set_cookie(PIN_COOKIE, '1', max_age=pin_seconds, httponly=True, samesite='Lax')
+
+
+@sync_and_async_middleware
+def pin_primary_middleware(get_response):
+    if not replica_aliases():
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+            token = _routing_state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                _routing_state.reset(token)
+            _pin(response, state)
+            return response
+    else:
+        def middleware(request):
+            state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+            token = _routing_state.set(state)
+            try:
+                response = get_response(request)
+            finally:
+                _routing_state.reset(token)
+            _pin(response, state)
+            return response
+    return middleware
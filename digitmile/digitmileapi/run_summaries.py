@@ -0,0 +1,72 @@
+# myapi/run_summaries.py
+"""
+Per-student and per-classroom run/win counters (StudentRunSummary, ClassroomRunSummary).
+
+Every RunStatistics insert goes through insert_runs(), which bumps the counters in the same
+transaction, so the summary rows always match the log. Deleting runs or moving a student to
+another classroom does not touch them; `manage.py rebuild_run_summaries` recounts from the log.
+"""
+from collections import defaultdict
+
+from django.db import connections, router, transaction
+
+from .live import announce_runs
+from .models import ClassroomRunSummary, RunStatistics, StudentRunSummary
+
+
+def _increment_counters(connection, model, counts):
+    """
+    Adds {pk: (runs, wins)} to the counters of `model` with a single upsert.
+    INSERT ... ON CONFLICT DO UPDATE is understood by both Postgres and SQLite.
+    """
+    if not counts:
+        return
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    pk_column = quote(model._meta.pk.column)
+    # Sorted so concurrent transactions lock the rows in the same order and cannot deadlock
+    rows = sorted(counts.items())
+    values = ', '.join(['(%s, %s, %s)'] * len(rows))
+    params = [value for pk, (runs, wins) in rows for value in (pk, runs, wins)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({pk_column}, total_runs, total_wins) VALUES {values} "
+            f"ON CONFLICT ({pk_column}) DO UPDATE SET "
+            f"total_runs = {table}.total_runs + EXCLUDED.total_runs, "
+            f"total_wins = {table}.total_wins + EXCLUDED.total_wins",
+            params,
+        )
+
+
+def record_runs(runs):
+    """
+    Bumps the counters for an iterable of (student_id, classroom_id, player_won) tuples.
+    Has to run inside the transaction that inserts the matching RunStatistics rows.
+    """
+    per_student = defaultdict(lambda: [0, 0])
+    per_classroom = defaultdict(lambda: [0, 0])
+    for student_id, classroom_id, player_won in runs:
+        for counts in (per_student[student_id], per_classroom[classroom_id]):
+            counts[0] += 1
+            counts[1] += int(player_won)
+
+    connection = connections[router.db_for_write(RunStatistics)]
+    _increment_counters(connection, StudentRunSummary, per_student)
+    _increment_counters(connection, ClassroomRunSummary, per_classroom)
+
+
+def insert_runs(runs):
+    """
+    Saves a list of (RunStatistics, classroom_id) pairs with one bulk insert and updates
+    the summary counters in the same transaction, then hands them to the live feed.
+    Returns the saved RunStatistics objects.
+    """
+    run_stats = [run_stat for run_stat, _ in runs]
+    using = router.db_for_write(RunStatistics)
+    with transaction.atomic(using=using):
+        RunStatistics.objects.bulk_create(run_stats)
+        record_runs(
+            (run_stat.student_id, classroom_id, run_stat.player_won) for run_stat, classroom_id in runs
+        )
+        announce_runs(using, runs)
+    return run_stats
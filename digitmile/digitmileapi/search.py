@@ -0,0 +1,100 @@
+# myapi/search.py
+"""
+Name and key search that uses the trigram indexes of migration 0010 (admin search boxes and
+StudentSearchView).
+
+Django's own admin search ORs `icontains` over every search field across joins, which Postgres
+can only answer by scanning the table being searched. Here every relation in a search field
+becomes a subquery on the related table instead, so each condition is checked against the
+index of the table that holds the column, and the fields are combined with a UNION of primary
+keys rather than an OR. Words shorter than TRIGRAM_MIN_LENGTH have no complete trigram and
+would read the whole index, so they are matched like Django does, on the rows the longer words
+of the search already narrowed down (or on the whole table when every word is that short).
+
+Other databases have no such indexes and keep Django's plain search.
+"""
+from django.db import connections
+from django.db.models import Q
+
+# pg_trgm splits text into three-character groups, shorter terms cannot be looked up in the index
+TRIGRAM_MIN_LENGTH = 3
+
+# Same prefixes as ModelAdmin.search_fields, '@' (full-text search) is not supported
+FIELD_LOOKUPS = {'^': 'istartswith', '=': 'iexact'}
+
+
+def uses_trigram_indexes(using):
+    return connections[using].vendor == 'postgresql'
+
+
+def field_condition(model, field_path, lookup, term, using):
+    """
+    Q matching the rows of `model` whose `field_path` matches `term`, with one subquery per
+    relation on the way, e.g. student__classroom__classroom_key on RunStatistics becomes
+    student IN (students whose classroom IN (classrooms whose key matches)). The subqueries
+    are bound to `using`, the outer query has to be bound to the same alias.
+    """
+    name, _, rest = field_path.partition('__')
+    if not rest:
+        return Q(**{f'{name}__{lookup}': term})
+    related_model = model._meta.get_field(name).related_model
+    matching = related_model._default_manager.using(using).filter(field_condition(related_model, rest, lookup, term, using))
+    return Q(**{f'{name}__in': matching.values('pk')})
+
+
+def _split_field(field, default_lookup):
+    lookup = FIELD_LOOKUPS.get(field[:1])
+    return (field[1:], lookup) if lookup else (field, default_lookup)
+
+
+def plain_condition(search_fields, term):
+    # What ModelAdmin.get_search_results() filters on for one word
+    condition = Q()
+    for field in search_fields:
+        field, lookup = _split_field(field, 'icontains')
+        condition |= Q(**{f'{field}__{lookup}': term})
+    return condition
+
+
+def search_queryset(queryset, search_fields, search_term):
+    """
+    `queryset` narrowed down to rows that match every whitespace-separated word of
+    `search_term` in at least one of `search_fields`, like ModelAdmin.get_search_results().
+    Never returns duplicate rows as long as the search fields only follow forward relations.
+    """
+    model = queryset.model
+    using = queryset.db
+    terms = search_term.split()
+    if not uses_trigram_indexes(using):
+        for term in terms:
+            queryset = queryset.filter(plain_condition(search_fields, term))
+        return queryset
+
+    # queryset.db asks the router again every time, and under replica_reads() that is a random
+    # replica: pin the outer query to the alias the subqueries are bound to
+    queryset = queryset.using(using)
+
+    for term in terms:
+        if len(term) < TRIGRAM_MIN_LENGTH:
+            queryset = queryset.filter(plain_condition(search_fields, term))
+            continue
+        conditions = [field_condition(model, *_split_field(field, 'icontains'), term, using) for field in search_fields]
+        if len(conditions) == 1:
+            queryset = queryset.filter(conditions[0])
+            continue
+        matching = [model._default_manager.using(using).filter(condition).values('pk') for condition in conditions]
+        queryset = queryset.filter(pk__in=matching[0].union(*matching[1:]))
+    return queryset
+
+
+class IndexedSearchMixin:
+    """
+    ModelAdmin mixin: search_fields are looked up with search_queryset() on Postgres.
+    """
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        if not (search_term and search_fields) or not uses_trigram_indexes(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        if any(field.startswith('@') for field in search_fields):
+            return super().get_search_results(request, queryset, search_term)
+        return search_queryset(queryset, search_fields, search_term), False
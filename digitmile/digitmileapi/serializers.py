@@ -1,6 +1,8 @@
 # myapi/serializers.py
+from django.core import signing
 from rest_framework import serializers
 from .models import School, Teacher, Student, Classroom, RunStatistics
+from .tokens import make_student_token, read_student_token
 
 class SchoolSerializer(serializers.ModelSerializer):
     class Meta:
@@ -22,21 +24,81 @@ class CheckClassroomResponseSerializer(serializers.Serializer):
     school = SchoolSerializer()
     teacher = serializers.CharField(source='teacher_data') # Expecting a string here based on your Flask code
     students = serializers.ListField(child=serializers.CharField())
+    studentTokens = serializers.DictField(child=serializers.CharField(), required=False) # name -> token, see tokens.py
+    version = serializers.IntegerField(required=False) # Classroom.roster_version, see rosters.py
+
+# Output of /api/checkClassroomKey when the client sent a sinceVersion the server can catch up from
+class CheckClassroomDeltaSerializer(serializers.Serializer):
+    version = serializers.IntegerField()
+    added = serializers.ListField(child=serializers.CharField())
+    removed = serializers.ListField(child=serializers.CharField())
+    studentTokens = serializers.DictField(child=serializers.CharField()) # Only for the added students
+
+
+def check_classroom_payload(school_name, municipality, teacher_name, students, classroom_id, version=0):
+    # Same output as CheckClassroomResponseSerializer, built directly for the hot path.
+    # Keep the two in sync when the response changes. `students` are (id, full_name) pairs.
+    students = list(students)
+    return {
+        'school': {'name': school_name, 'municipality': municipality},
+        'teacher': teacher_name,
+        'students': [full_name for _, full_name in students],
+        'studentTokens': {full_name: make_student_token(classroom_id, student_id) for student_id, full_name in students},
+        'version': version,
+    }
 
 # Serializer for the input of /api/insertLevelStatistics
 class LevelStatisticsInputSerializer(serializers.Serializer):
-    classroomKey = serializers.CharField(max_length=100)
-    user = serializers.CharField(max_length=255) # This is student's full_name
+    # Either a student token from /api/checkClassroomKey/, or classroomKey and user
+    token = serializers.CharField(max_length=200, required=False)
+    classroomKey = serializers.CharField(max_length=100, required=False)
+    user = serializers.CharField(max_length=255, required=False) # This is student's full_name
     levelStatistics = serializers.DictField()
 
+    def validate(self, attrs):
+        # validated_data['student'] is (student_id, classroom_id) when a valid token was sent
+        attrs['student'] = None
+        if attrs.get('token'):
+            try:
+                attrs['student'] = read_student_token(attrs['token'])
+            except signing.BadSignature:
+                # An expired token is no problem for clients that also send the names
+                if not (attrs.get('classroomKey') and attrs.get('user')):
+                    raise serializers.ValidationError({'token': ["Invalid or expired token."]})
+            return attrs
+        missing = {name: ["This field is required."] for name in ('classroomKey', 'user') if not attrs.get(name)}
+        if missing:
+            raise serializers.ValidationError(missing)
+        return attrs
+
+    # Optional numeric keys of levelStatistics and the range of the RunStatistics column they go to
+    INTEGER_STATISTICS = {
+        'score': (-2**31, 2**31 - 1),
+        'correctMoves': (0, 2**31 - 1),
+        'wrongMoves': (0, 2**31 - 1),
+    }
+    NUMBER_STATISTICS = ('timeElapsed',)
+
     def validate_levelStatistics(self, value):
         # Example validation: ensure 'place' exists and is an integer
         if 'place' not in value:
             raise serializers.ValidationError("The 'place' key is required in levelStatistics.")
         if not isinstance(value['place'], int):
             raise serializers.ValidationError("The 'place' for levelStatistics must be an integer.")
-        # Add more validation for other expected keys in levelStatistics if needed
-        # e.g., score, correctMoves, wrongMoves, timeElapsed
+        if not -2**15 <= value['place'] < 2**15:
+            raise serializers.ValidationError("The 'place' for levelStatistics is out of range.")
+        for key, (minimum, maximum) in self.INTEGER_STATISTICS.items():
+            if value.get(key) is None:
+                continue
+            if not isinstance(value[key], int) or isinstance(value[key], bool):
+                raise serializers.ValidationError(f"The '{key}' for levelStatistics must be an integer.")
+            if not minimum <= value[key] <= maximum:
+                raise serializers.ValidationError(f"The '{key}' for levelStatistics is out of range.")
+        for key in self.NUMBER_STATISTICS:
+            if value.get(key) is None:
+                continue
+            if not isinstance(value[key], (int, float)) or isinstance(value[key], bool):
+                raise serializers.ValidationError(f"The '{key}' for levelStatistics must be a number.")
         return value
 
 class RunStatisticsSerializer(serializers.ModelSerializer):
@@ -44,5 +106,8 @@ class RunStatisticsSerializer(serializers.ModelSerializer):
         model = RunStatistics
         # If you want to return the created object, specify fields
         # otherwise, for just a success message, this might not be strictly needed for the response
-        fields = ['id', 'student', 'player_won']
-        read_only_fields = ['id']
\ No newline at end of file
+        fields = [
+            'id', 'student', 'player_won', 'place', 'score',
+            'correct_moves', 'wrong_moves', 'time_elapsed', 'created_at',
+        ]
+        read_only_fields = ['id', 'created_at']
\ No newline at end of file
@@ -0,0 +1,108 @@
+# myapi/signals.py
+"""
+Signal handlers that keep the cached roster payloads (roster_cache.py), the classroom key
+filter (key_filter.py) and the roster versions (rosters.py) in sync with the database.
+
+Invalidation runs on transaction commit, so a request that reads the old rows while the
+write is still in flight cannot put a stale roster back into the cache afterwards.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .key_filter import get_classroom_key_filter
+from .models import Classroom, RosterChange, School, Student, Teacher
+from .roster_cache import get_roster_cache
+from .rosters import bump_roster_versions, record_roster_change
+
+
+def _invalidate_on_commit(classroom_keys):
+    classroom_keys = [key for key in classroom_keys if key]
+    if classroom_keys:
+        transaction.on_commit(lambda: get_roster_cache().invalidate(*classroom_keys))
+
+
+def _classroom_keys(**filters):
+    return list(Classroom.objects.filter(**filters).values_list('classroom_key', flat=True))
+
+
+# Remember the values a save is about to overwrite, so the roster they belonged to is dropped too
+@receiver(pre_save, sender=Classroom)
+def remember_previous_classroom_key(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_classroom_key = (
+            Classroom.objects.filter(pk=instance.pk).values_list('classroom_key', flat=True).first()
+        )
+
+@receiver(pre_save, sender=Student)
+def remember_previous_student_classroom(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_classroom_id, instance._previous_full_name = (
+            Student.objects.filter(pk=instance.pk).values_list('classroom_id', 'full_name').first() or (None, None)
+        )
+
+
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def invalidate_classroom_roster(sender, instance, **kwargs):
+    _invalidate_on_commit([instance.classroom_key, getattr(instance, '_previous_classroom_key', None)])
+
+@receiver(post_save, sender=Classroom)
+def add_classroom_key(sender, instance, **kwargs):
+    # Right away rather than on commit: until then the key is only a false positive, while
+    # adding it late would reject the new classroom for a moment
+    if instance.classroom_key != getattr(instance, '_previous_classroom_key', None):
+        key_filter = get_classroom_key_filter()
+        key_filter.add(instance.classroom_key)
+        transaction.on_commit(key_filter.bump_generation)
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_student_roster(sender, instance, **kwargs):
+    classroom_ids = {instance.classroom_id, getattr(instance, '_previous_classroom_id', None)}
+    _invalidate_on_commit(_classroom_keys(pk__in=[pk for pk in classroom_ids if pk]))
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+def invalidate_teacher_rosters(sender, instance, **kwargs):
+    _invalidate_on_commit(_classroom_keys(teacher_id=instance.pk))
+
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+def invalidate_school_rosters(sender, instance, **kwargs):
+    _invalidate_on_commit(_classroom_keys(teacher__school_id=instance.pk))
+
+
+@receiver(post_save, sender=Student)
+def record_student_roster_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = (getattr(instance, '_previous_classroom_id', None), getattr(instance, '_previous_full_name', None))
+    current = (instance.classroom_id, instance.full_name)
+    if created or previous[0] is None:
+        record_roster_change(instance.classroom_id, added=[(instance.pk, instance.full_name)])
+    elif previous[0] != current[0]:
+        record_roster_change(previous[0], removed=[(instance.pk, previous[1])])
+        record_roster_change(current[0], added=[(instance.pk, instance.full_name)])
+    elif previous[1] != current[1]:
+        record_roster_change(current[0], added=[(instance.pk, instance.full_name)], removed=[(instance.pk, previous[1])])
+
+@receiver(post_delete, sender=Student)
+def record_student_roster_removal(sender, instance, **kwargs):
+    record_roster_change(instance.classroom_id, removed=[(instance.pk, instance.full_name)])
+
+@receiver(post_delete, sender=Classroom)
+def drop_roster_changes(sender, instance, **kwargs):
+    RosterChange.objects.filter(classroom_id=instance.pk).delete()
+
+# The teacher and school names are part of the roster too, but there is nothing to send as a
+# delta for them: clients of these classrooms get the full roster again
+@receiver(post_save, sender=Teacher)
+def bump_teacher_roster_versions(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        bump_roster_versions(Classroom.objects.filter(teacher_id=instance.pk))
+
+@receiver(post_save, sender=School)
+def bump_school_roster_versions(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        bump_roster_versions(Classroom.objects.filter(teacher__school_id=instance.pk))
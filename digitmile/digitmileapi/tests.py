@@ -1,3 +1,1896 @@
-from django.test import TestCase
+"""
+Query budgets for the API endpoints and the admin pages, then behaviour tests for the paths
+that can lose, misfile or wrongly reject data: write-behind ingestion, the classroom key filter,
+student tokens, run compaction and the indexed search, plus the /metrics scrape of exited workers.
 
-# Create your tests here.
+Every query budget test states how many queries a request may run, so an N+1 or a stray
+COUNT(*) fails the build instead of showing up in production. The fixtures are big enough that
+a query per row would blow every budget, and the admin pages are checked both as a superuser
+and as a teacher.
+
+Budgets count what runs inside the request. TestCase wraps each test in a transaction, so the
+atomic blocks of the write paths show up as a SAVEPOINT and a RELEASE SAVEPOINT each.
+"""
+import contextlib
+import csv
+import datetime
+import itertools
+import gzip
+import importlib
+import json
+import os
+import runpy
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipIf
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, router, transaction
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmarks
+from .analytics import analyze_school, compute_student_progress, np, rank_within, student_metrics
+from .async_views import AsyncCheckClassroomKeyView, AsyncInsertLevelStatisticsView
+from .compaction import ARCHIVE_COLUMNS, compact_runs, compaction_cutoff
+from .export import EXPORT_COLUMNS, export_lines, export_queryset
+from .ingest import BufferFull, IngestionBuffer
+from .key_filter import ClassroomKeyFilter, get_classroom_key_filter
+from .live import Broker
+from .metrics import Registry
+from .pagination import EstimatedCountPaginator
+from .partitions import ensure_month_partitions, is_partitioned, next_month, partition_month, partition_name
+from .search import field_condition, search_queryset
+from .models import (
+    Classroom, ClassroomRunSummary, MunicipalityDailyRollup, RollupWatermark, RunStatistics, School, SchoolDailyRollup, Student,
+    StudentDailyAggregate, StudentRunSummary, Teacher, get_teacher_profile,
+)
+from .renderers import MSGPACK_MEDIA_TYPE, dumps_json, msgpack, parse_body
+from .resolvers import aresolve_student, resolve_student
+from .rollups import OVERLAP, WATERMARK_NAME, refresh_rollups
+from .rosters import bump_roster_versions, etag_matches, net_changes, parse_since_version, roster_etag
+from .routers import PIN_COOKIE, ReplicaRouter, pin_primary_middleware, read_alias, replica_reads
+from .roster_cache import LRUCache, RosterCache, get_roster_cache
+from .run_summaries import insert_runs
+from .serializers import CheckClassroomResponseSerializer, check_classroom_payload
+from .tokens import make_student_token
+
+# Small enough to seed quickly, big enough that a query per row blows every budget
+FIXTURE = {
+    'schools': 2,
+    'teachers_per_school': 2,
+    'classrooms_per_teacher': 3,
+    'students_per_classroom': 10,
+    'runs': 500,
+}
+
+# What a teacher account gets in the admin
+TEACHER_PERMISSIONS = [
+    'view_school', 'view_classroom', 'view_runstatistics',
+    'view_student', 'add_student', 'change_student', 'delete_student',
+]
+
+
+class QueryBudgetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(**FIXTURE)
+        call_command('rebuild_run_summaries', stdout=StringIO())
+        today = timezone.now().date()
+        SchoolDailyRollup.objects.bulk_create(
+            SchoolDailyRollup(school=school, day=today - timedelta(days=day), total_runs=10, total_wins=5, active_students=3)
+            for school in School.objects.all()
+            for day in range(7)
+        )
+
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        cls.teacher = Teacher.objects.select_related('school').order_by('pk').first()
+        cls.teacher.user = User.objects.create_user('teacher', password='x', is_staff=True)
+        cls.teacher.save()
+        cls.teacher.user.user_permissions.set(
+            Permission.objects.filter(content_type__app_label='digitmileapi', codename__in=TEACHER_PERMISSIONS)
+        )
+        cls.classroom = Classroom.objects.filter(teacher=cls.teacher).order_by('pk').first()
+        cls.student = Student.objects.filter(classroom=cls.classroom).order_by('pk').first()
+
+    def setUp(self):
+        # The key filter is off without a shared cache, these tests run in one process and get
+        # one of their own. Built now so it is not part of any budget, next to an empty roster cache.
+        patcher = mock.patch('digitmileapi.key_filter._filter', ClassroomKeyFilter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_classroom_key_filter().rebuild()
+        get_roster_cache().clear()
+
+    @contextlib.contextmanager
+    def assertMaxQueries(self, budget, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context)
+        if executed > budget:
+            queries = '\n'.join(f"{number}. {query['sql']}" for number, query in enumerate(context.captured_queries, start=1))
+            self.fail(f"{executed} queries executed, the budget is {budget}\nCaptured queries were:\n{queries}")
+
+    def post_json(self, path, data, **extra):
+        return self.client.post(path, data, content_type='application/json', **extra)
+
+
+class CheckClassroomKeyQueryTests(QueryBudgetTestCase):
+    path = '/api/checkClassroomKey/'
+
+    def test_uncached_roster(self):
+        # The classroom with its teacher and school, then its students
+        with self.assertNumQueries(2):
+            response = self.post_json(self.path, {'classroomKey': self.classroom.classroom_key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['students']), FIXTURE['students_per_classroom'])
+
+    def test_cached_roster(self):
+        self.post_json(self.path, {'classroomKey': self.classroom.classroom_key})
+        with self.assertNumQueries(0):
+            response = self.post_json(self.path, {'classroomKey': self.classroom.classroom_key})
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_key(self):
+        # Turned away by the key filter
+        with self.assertNumQueries(0):
+            response = self.post_json(self.path, {'classroomKey': 'NO-SUCH-KEY'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_modified(self):
+        etag = self.post_json(self.path, {'classroomKey': self.classroom.classroom_key})['ETag']
+        get_roster_cache().clear()
+        with self.assertNumQueries(1):
+            response = self.post_json(self.path, {'classroomKey': self.classroom.classroom_key}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_delta(self):
+        version = self.post_json(self.path, {'classroomKey': self.classroom.classroom_key}).json()['version']
+        Student.objects.create(full_name="New student", classroom=self.classroom)
+        get_roster_cache().clear()
+        # The classroom, then the roster changes since `version`
+        with self.assertNumQueries(2):
+            response = self.post_json(self.path, {'classroomKey': self.classroom.classroom_key, 'sinceVersion': version})
+        self.assertEqual(response.json()['added'], ["New student"])
+
+
+class InsertLevelStatisticsQueryTests(QueryBudgetTestCase):
+    # SAVEPOINT, the insert, the student and classroom counter upserts, RELEASE SAVEPOINT
+    insert_queries = 5
+
+    def test_insert_by_name(self):
+        # One joined lookup of the student, then the insert
+        with self.assertNumQueries(1 + self.insert_queries):
+            response = self.post_json('/api/insertLevelStatistics/', {
+                'classroomKey': self.classroom.classroom_key,
+                'user': self.student.full_name,
+                'levelStatistics': {'place': 1, 'score': 500},
+            })
+        self.assertEqual(response.status_code, 201)
+
+    def test_insert_with_token(self):
+        token = self.post_json('/api/checkClassroomKey/', {'classroomKey': self.classroom.classroom_key}).json()['studentTokens'][self.student.full_name]
+        with self.assertNumQueries(self.insert_queries):
+            response = self.post_json('/api/insertLevelStatistics/', {'token': token, 'levelStatistics': {'place': 2}})
+        self.assertEqual(response.status_code, 201)
+
+    def test_unknown_student(self):
+        # The joined lookup finds nothing, one more query tells a missing classroom from a missing student
+        with self.assertNumQueries(2):
+            response = self.post_json('/api/insertLevelStatistics/', {
+                'classroomKey': self.classroom.classroom_key,
+                'user': "Nobody",
+                'levelStatistics': {'place': 1},
+            })
+        self.assertEqual(response.status_code, 404)
+
+    def test_batch_does_not_grow_with_its_size(self):
+        students = list(Student.objects.filter(classroom__teacher=self.teacher).select_related('classroom'))
+        items = [
+            {'classroomKey': student.classroom.classroom_key, 'user': student.full_name, 'levelStatistics': {'place': 1}}
+            for student in students
+        ]
+        # The classrooms, the students, then one insert for the whole batch
+        with self.assertNumQueries(2 + self.insert_queries):
+            response = self.post_json('/api/insertLevelStatisticsBatch/', items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['results']), len(students))
+
+
+class TeacherEndpointQueryTests(QueryBudgetTestCase):
+    # Loading the session and its user
+    session_queries = 2
+    # Every teacher-facing view looks up the teacher profile of a non-superuser
+    profile_queries = 1
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.teacher.user
+        self.client.force_login(self.user)
+
+    def test_leaderboard(self):
+        # The classroom with its summary, then the students with theirs
+        with self.assertNumQueries(self.session_queries + self.profile_queries + 2):
+            response = self.client.get(f'/api/classrooms/{self.classroom.classroom_key}/leaderboard/')
+        self.assertEqual(len(response.json()['students']), FIXTURE['students_per_classroom'])
+
+    def test_progress(self):
+        compute_student_progress(workers=1)
+        # The classroom, then the progress of its students
+        with self.assertNumQueries(self.session_queries + self.profile_queries + 2):
+            response = self.client.get(f'/api/classrooms/{self.classroom.classroom_key}/progress/')
+        self.assertEqual(len(response.json()['students']), self.classroom.students.filter(progress__isnull=False).count())
+
+    def test_export(self):
+        with self.assertNumQueries(self.session_queries + self.profile_queries + 1):
+            response = self.client.get('/api/export/runStatistics/', {'output': 'ndjson'})
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), RunStatistics.objects.visible_to(self.user).count())
+
+    def test_school_rollups(self):
+        # The teacher's school is a query of its own
+        with self.assertNumQueries(self.session_queries + 2 * self.profile_queries + 1):
+            response = self.client.get('/api/rollups/schools/')
+        self.assertEqual(len(response.json()['rollups']), 7 * (School.objects.count() if self.user.is_superuser else 1))
+
+    def test_municipality_rollups(self):
+        with self.assertNumQueries(self.session_queries + 2 * self.profile_queries + 1):
+            response = self.client.get('/api/rollups/municipalities/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_student_search(self):
+        with self.assertNumQueries(self.session_queries + self.profile_queries + 1):
+            response = self.client.get('/api/students/search/', {'q': 'student'})
+        self.assertEqual(len(response.json()['students']), 20)
+
+
+class SuperuserEndpointQueryTests(TeacherEndpointQueryTests):
+    profile_queries = 0
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.superuser
+        self.client.force_login(self.user)
+
+
+class AdminQueryTests(QueryBudgetTestCase):
+    """
+    Every changelist, change form and add form of digitmileapi/admin.py, plus a changelist
+    search. The budgets are maxima because the estimated-count paginator asks Postgres for a
+    table estimate before it counts, where other databases count right away.
+    """
+    # Model name: (changelist, change form, add form) budgets for a superuser
+    superuser_budgets = {
+        'school': (5, 5, 3),
+        'teacher': (5, 7, 3),
+        'classroom': (6, 7, 4),
+        'student': (6, 6, 4),
+        'runstatistics': (6, 6, 2),
+    }
+    # Same for a teacher, who also loads their permissions and profile. None: the page is
+    # forbidden to teachers
+    teacher_budgets = {
+        'school': (9, 7, None),
+        'teacher': (None, None, None),
+        'classroom': (9, 9, None),
+        'student': (9, 9, 7),
+        'runstatistics': (10, 9, None),
+    }
+
+    def check_pages(self, budgets):
+        objects = {
+            'school': self.teacher.school,
+            'teacher': self.teacher,
+            'classroom': self.classroom,
+            'student': self.student,
+            'runstatistics': RunStatistics.objects.filter(student=self.student).first(),
+        }
+        for model_name, (changelist, change, add) in budgets.items():
+            pages = [
+                (reverse(f'admin:digitmileapi_{model_name}_changelist'), {}, changelist),
+                (reverse(f'admin:digitmileapi_{model_name}_changelist'), {'q': 'student 1'}, changelist),
+                (reverse(f'admin:digitmileapi_{model_name}_change', args=[objects[model_name].pk]), {}, change),
+                (reverse(f'admin:digitmileapi_{model_name}_add'), {}, add),
+            ]
+            for url, params, budget in pages:
+                with self.subTest(url=url, **params):
+                    if budget is None:
+                        self.assertEqual(self.client.get(url, params).status_code, 403)
+                        continue
+                    with self.assertMaxQueries(budget):
+                        response = self.client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+
+    def test_superuser_pages(self):
+        self.client.force_login(self.superuser)
+        self.check_pages(self.superuser_budgets)
+
+    def test_teacher_pages(self):
+        self.client.force_login(self.teacher.user)
+        self.check_pages(self.teacher_budgets)
+
+    def test_visible_to_reuses_the_teacher_profile(self):
+        # The permission hooks have looked the teacher up already; get_queryset() must not again
+        user = User.objects.get(pk=self.teacher.user.pk)
+        self.assertEqual(get_teacher_profile(user), self.teacher)
+        with self.assertNumQueries(0):
+            queryset = RunStatistics.objects.visible_to(user)
+        self.assertEqual(queryset.count(), RunStatistics.objects.filter(student__classroom__teacher=self.teacher).count())
+
+        without_profile = User.objects.create_user('helper', password='x', is_staff=True)
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                self.assertFalse(RunStatistics.objects.visible_to(without_profile).exists())
+
+    def test_changelists_do_not_grow_with_the_rows(self):
+        # An N+1 on a changelist shows up as more queries for a longer page
+        self.client.force_login(self.superuser)
+        for model_name, search_term in [('classroom', 'bench-1-0'), ('student', 'student 1'), ('runstatistics', 'student 1')]:
+            url = reverse(f'admin:digitmileapi_{model_name}_changelist')
+            with self.subTest(model=model_name):
+                with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as short_page:
+                    self.client.get(url, {'q': search_term})
+                with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as long_page:
+                    self.client.get(url)
+                self.assertEqual(len(short_page), len(long_page))
+
+
+class IngestionBufferTests(TransactionTestCase):
+    """
+    The flusher writes from its own thread and connection, so these tests commit their data.
+    """
+    def setUp(self):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=5, runs=0)
+        self.classroom = Classroom.objects.get()
+        self.students = list(Student.objects.order_by('pk'))
+        get_roster_cache().clear()
+
+    def runs(self, count, students=None):
+        students = students or self.students
+        return [
+            (RunStatistics.from_level_statistics(students[i % len(students)].pk, {'place': 1 + i % 3}), self.classroom.pk)
+            for i in range(count)
+        ]
+
+    def test_full_queue(self):
+        # With the flusher held back the queue fills up, then the view answers 503
+        with mock.patch.object(IngestionBuffer, 'start'), mock.patch('digitmileapi.ingest._buffer', None), \
+                override_settings(INGEST={'MODE': 'buffered', 'MAX_QUEUE': 2}):
+            statuses = [
+                self.client.post('/api/insertLevelStatistics/', {
+                    'classroomKey': self.classroom.classroom_key,
+                    'user': self.students[0].full_name,
+                    'levelStatistics': {'place': 1},
+                }, content_type='application/json')
+                for _ in range(3)
+            ]
+        self.assertEqual([response.status_code for response in statuses], [202, 202, 503])
+        self.assertEqual(statuses[-1]['Retry-After'], '1')
+
+        buffer = IngestionBuffer(max_size=1)
+        with mock.patch.object(IngestionBuffer, 'start'):
+            buffer.submit(*self.runs(1)[0])
+            with self.assertRaises(BufferFull):
+                buffer.submit(*self.runs(1)[0])
+        self.assertEqual((buffer.accepted, buffer.rejected), (1, 1))
+
+    def test_flush_writes_every_row(self):
+        buffer = IngestionBuffer(flush_size=7, flush_interval=0.05)
+        for run in self.runs(50):
+            buffer.submit(*run)
+        buffer.stop()
+        self.assertEqual(RunStatistics.objects.count(), 50)
+        self.assertEqual(buffer.stats()['flushed_rows'], 50)
+        self.assertEqual(buffer.stats()['queue_depth'], 0)
+        self.assertEqual(sum(Student.objects.values_list('run_summary__total_runs', flat=True)), 50)
+
+    def test_deleted_student_does_not_lose_the_batch(self):
+        buffer = IngestionBuffer()
+        with mock.patch.object(IngestionBuffer, 'start'):
+            for run in self.runs(10):
+                buffer.submit(*run)
+        deleted = self.students[0]
+        deleted.delete()
+        with self.assertLogs('digitmileapi.ingest', 'WARNING'):
+            buffer.flush()
+        self.assertEqual(RunStatistics.objects.count(), 8)
+        self.assertFalse(RunStatistics.objects.filter(student_id=deleted.pk).exists())
+        self.assertEqual((buffer.flushed_rows, buffer.failed_rows), (8, 2))
+
+    def test_stop_drains_the_queue(self):
+        # What atexit runs: the rows the flusher already took and the ones still queued are written,
+        # although the flush interval is far longer than stop() waits for the thread
+        buffer = IngestionBuffer(flush_size=1000, flush_interval=60)
+        runs = self.runs(20)
+        for run in runs[:10]:
+            buffer.submit(*run)
+        time.sleep(0.3)
+        for run in runs[10:]:
+            buffer.submit(*run)
+        started = time.monotonic()
+        buffer.stop(timeout=5)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(RunStatistics.objects.count(), 20)
+        self.assertEqual(buffer.stats()['queue_depth'], 0)
+
+    def test_live_feed_gets_the_saved_ids(self):
+        # COPY on Postgres, bulk_create elsewhere: either way every run reaches the feed with its own id
+        broker = Broker()
+        with mock.patch('digitmileapi.live._broker', broker), \
+                mock.patch.object(broker, 'has_subscribers', return_value=True), \
+                mock.patch.object(broker, 'publish') as publish:
+            buffer = IngestionBuffer(flush_size=7)
+            with mock.patch.object(IngestionBuffer, 'start'):
+                for run in self.runs(20):
+                    buffer.submit(*run)
+            buffer.flush()
+        ids = [event['id'] for call in publish.call_args_list for event in call.args[0]]
+        self.assertEqual(len(ids), 20)
+        self.assertEqual(set(ids), set(RunStatistics.objects.values_list('id', flat=True)))
+
+
+class StudentTokenTests(TransactionTestCase):
+    """
+    Tokens of students deleted since are only caught by the foreign keys when the insert
+    commits, so these tests commit their data.
+    """
+    path = '/api/insertLevelStatistics/'
+
+    def setUp(self):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        self.classroom = Classroom.objects.get()
+        self.student, self.other_student = Student.objects.order_by('pk')[:2]
+        get_roster_cache().clear()
+
+    def token(self, student):
+        return make_student_token(student.classroom_id, student.pk)
+
+    def expired_token(self, student):
+        with mock.patch('django.core.signing.time.time', return_value=time.time() - 2 * settings.STUDENT_TOKEN_MAX_AGE):
+            return self.token(student)
+
+    def tampered_token(self, student):
+        # The payload of another student's token with the timestamp and signature of this one
+        payload = self.token(self.other_student).split(':', 1)[0]
+        return f"{payload}:{self.token(student).split(':', 1)[1]}"
+
+    def insert(self, **data):
+        return self.client.post(self.path, {'levelStatistics': {'place': 1}, **data}, content_type='application/json')
+
+    def test_valid_token(self):
+        response = self.insert(token=self.token(self.student))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RunStatistics.objects.get().student_id, self.student.pk)
+
+    def test_bad_token_without_names(self):
+        for token in (self.expired_token(self.student), self.tampered_token(self.student), 'not-a-token'):
+            with self.subTest(token=token):
+                response = self.insert(token=token)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('token', response.json())
+        self.assertFalse(RunStatistics.objects.exists())
+
+    def test_bad_token_falls_back_to_names(self):
+        names = {'classroomKey': self.classroom.classroom_key, 'user': self.student.full_name}
+        for token in (self.expired_token(self.student), self.tampered_token(self.student)):
+            with self.subTest(token=token):
+                self.assertEqual(self.insert(token=token, **names).status_code, 201)
+        # Never the student a tampered token points at
+        self.assertEqual(list(RunStatistics.objects.values_list('student_id', flat=True)), [self.student.pk] * 2)
+
+    def test_renamed_student(self):
+        # The token carries ids, the run still goes to the same student
+        token = self.token(self.student)
+        Student.objects.filter(pk=self.student.pk).update(full_name="Renamed student")
+        self.assertEqual(self.insert(token=token).status_code, 201)
+        self.assertEqual(RunStatistics.objects.get().student_id, self.student.pk)
+
+    def test_deleted_student(self):
+        token = self.token(self.student)
+        self.student.delete()
+        response = self.insert(token=token)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(RunStatistics.objects.exists())
+
+    def test_deleted_student_in_a_batch(self):
+        token = self.token(self.student)
+        self.student.delete()
+        response = self.client.post('/api/insertLevelStatisticsBatch/', [
+            {'token': token, 'levelStatistics': {'place': 1}},
+            {'token': self.token(self.other_student), 'levelStatistics': {'place': 2}},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [404, 201])
+        self.assertEqual(RunStatistics.objects.get().student_id, self.other_student.pk)
+
+
+class ClassroomKeyFilterTests(TransactionTestCase):
+    """
+    Two filters on one shared cache stand for two processes. The filters rebuild in a thread
+    of their own, so these tests commit their data.
+    """
+    def setUp(self):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=2, students_per_classroom=1, runs=0)
+        # This process, where signals.py adds the keys saved here, and another one
+        self.local = ClassroomKeyFilter(backend='default')
+        self.other = ClassroomKeyFilter(backend='default')
+        filter_patcher = mock.patch('digitmileapi.key_filter._filter', self.local)
+        filter_patcher.start()
+        self.addCleanup(filter_patcher.stop)
+        self.local.rebuild()
+        self.other.rebuild()
+
+    def wait_for_rebuilds(self, key_filter, rebuilds):
+        deadline = time.monotonic() + 5
+        while key_filter.rebuilds < rebuilds and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(key_filter.rebuilds, rebuilds)
+
+    def test_classroom_saved_in_another_process(self):
+        teacher = Teacher.objects.get()
+        Classroom.objects.create(classroom_key='NEW-KEY', teacher=teacher)
+        self.assertTrue(self.local.might_contain('NEW-KEY'))
+        # The other process has never seen the key, but the generation moved: ask the database
+        rebuilds = self.other.rebuilds
+        self.assertTrue(self.other.might_contain('NEW-KEY'))
+        self.wait_for_rebuilds(self.other, rebuilds + 1)
+        self.assertTrue(self.other.might_contain('NEW-KEY'))
+        self.assertFalse(self.other.might_contain('NO-SUCH-KEY'))
+
+    def test_key_saved_elsewhere_right_after_a_miss(self):
+        # The other process has just read the generation for a miss; the next miss reads it again
+        self.assertFalse(self.other.might_contain('NEW-KEY'))
+        Classroom.objects.create(classroom_key='NEW-KEY', teacher=Teacher.objects.get())
+        self.assertTrue(self.other.might_contain('NEW-KEY'))
+
+    def test_rebuild_happens_in_the_background(self):
+        self.other.max_age = 0
+        rebuilds = self.other.rebuilds
+        # Answered from the old filter, without a query on the request's connection
+        with self.assertNumQueries(0):
+            self.assertFalse(self.other.might_contain('NO-SUCH-KEY'))
+        self.wait_for_rebuilds(self.other, rebuilds + 1)
+
+    def test_misses_go_to_the_database_until_the_first_build(self):
+        key_filter = ClassroomKeyFilter()
+        with self.assertNumQueries(0):
+            self.assertTrue(key_filter.might_contain('NO-SUCH-KEY'))
+        self.wait_for_rebuilds(key_filter, 1)
+        self.assertFalse(key_filter.might_contain('NO-SUCH-KEY'))
+
+
+class CompactionTests(TestCase):
+    keep_days = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=2, students_per_classroom=5, runs=400)
+        call_command('rebuild_run_summaries', stdout=StringIO())
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = archive_dir.name
+
+    def compact(self):
+        return compact_runs(keep_days=self.keep_days, archive_dir=self.archive_dir, batch_size=37)
+
+    def archived_rows(self):
+        rows = []
+        for path in sorted(Path(self.archive_dir).rglob('*.ndjson.gz')):
+            with gzip.open(path, 'rt') as archive:
+                rows.extend(json.loads(line) for line in archive)
+        return rows
+
+    def test_totals_survive_compaction(self):
+        cutoff = compaction_cutoff(self.keep_days)
+        old_runs = list(RunStatistics.objects.filter(created_at__lt=cutoff).order_by('id').values(*ARCHIVE_COLUMNS))
+        self.assertTrue(old_runs)
+        summaries = dict(StudentRunSummary.objects.values_list('student_id', 'total_runs'))
+
+        result = self.compact()
+        self.assertEqual(result['runs'], len(old_runs))
+        self.assertFalse(RunStatistics.objects.filter(created_at__lt=cutoff).exists())
+
+        # One aggregate per student and day, with the runs and wins of the deleted rows
+        expected_runs, expected_wins = Counter(), Counter()
+        for run in old_runs:
+            key = (run['student_id'], run['created_at'].date())
+            expected_runs[key] += 1
+            expected_wins[key] += run['player_won']
+        aggregates = StudentDailyAggregate.objects.values_list('student_id', 'day', 'total_runs', 'total_wins')
+        self.assertEqual({(student_id, day): runs for student_id, day, runs, _ in aggregates}, dict(expected_runs))
+        self.assertEqual({(student_id, day): wins for student_id, day, _, wins in aggregates}, dict(expected_wins))
+
+        # The archive holds every deleted row as it was
+        archived = sorted(self.archived_rows(), key=lambda row: row['id'])
+        self.assertEqual(archived, [json.loads(json.dumps(run, default=lambda value: value.isoformat())) for run in old_runs])
+
+        # The student counters already count the compacted runs
+        self.assertEqual(dict(StudentRunSummary.objects.values_list('student_id', 'total_runs')), summaries)
+
+    def test_second_run_changes_nothing(self):
+        self.compact()
+        aggregates = list(StudentDailyAggregate.objects.order_by('student_id', 'day').values_list())
+        archive = {path: path.read_bytes() for path in Path(self.archive_dir).rglob('*.ndjson.gz')}
+        runs = RunStatistics.objects.count()
+
+        result = self.compact()
+        self.assertEqual((result['runs'], result['batches']), (0, 0))
+        self.assertEqual(list(StudentDailyAggregate.objects.order_by('student_id', 'day').values_list()), aggregates)
+        self.assertEqual({path: path.read_bytes() for path in Path(self.archive_dir).rglob('*.ndjson.gz')}, archive)
+        self.assertEqual(RunStatistics.objects.count(), runs)
+
+
+class MetricsScrapeTests(SimpleTestCase):
+    def test_exited_worker(self):
+        # What an exited worker left behind in METRICS['DIR'], including a name this process does not know
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(Path(directory.name) / 'metrics-999999999.json', 'w') as f:
+            json.dump({'counters': [], 'histograms': [], 'gauges': [
+                ['digitmile_live_feed_subscribers', [], 4],
+                ['digitmile_live_feed_events_total', [], 10],
+                ['digitmile_retired_gauge', [], 1],
+            ]}, f)
+
+        # A registry of our own keeps this process from writing into the directory
+        with override_settings(METRICS={'DIR': directory.name}), mock.patch('digitmileapi.metrics._registry', Registry()):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        # Counts of the exited worker are kept, its point-in-time values are not
+        self.assertIn('# TYPE digitmile_live_feed_events_total counter', lines)
+        self.assertIn('digitmile_live_feed_events_total 10', lines)
+        self.assertIn('digitmile_live_feed_subscribers 0', lines)
+        self.assertFalse(any(line.startswith('digitmile_retired_gauge') for line in lines))
+
+
+class IndexedSearchTests(TestCase):
+    """
+    The indexed path is what Postgres runs; it is forced here so it also runs on other databases,
+    and has to find the same rows as Django's plain search.
+    """
+    queries = ['student', 'student 1', 'Stu 1', 'nt 1', '1', 'udent 12', 'bench student', 'no such name']
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=2, classrooms_per_teacher=2, students_per_classroom=12, runs=100)
+
+    def search(self, queryset, search_fields, search_term, indexed):
+        with mock.patch('digitmileapi.search.uses_trigram_indexes', return_value=indexed):
+            return set(search_queryset(queryset, search_fields, search_term).values_list('pk', flat=True))
+
+    def test_same_rows_as_plain_search(self):
+        cases = [
+            (Student.objects.all(), ['full_name']),
+            (Student.objects.all(), ['full_name', 'classroom__classroom_key', 'classroom__teacher__full_name']),
+            (RunStatistics.objects.all(), ['student__full_name', '^student__classroom__classroom_key']),
+        ]
+        for queryset, search_fields in cases:
+            for search_term in self.queries:
+                with self.subTest(model=queryset.model.__name__, fields=search_fields, q=search_term):
+                    self.assertEqual(
+                        self.search(queryset, search_fields, search_term, indexed=True),
+                        self.search(queryset, search_fields, search_term, indexed=False),
+                    )
+
+    def test_subqueries_stay_on_the_alias(self):
+        # Under replica_reads the changelist reads from a replica, every subquery has to as well
+        (lookup, classrooms), = field_condition(Student, 'classroom__teacher__full_name', 'icontains', 'bench', 'replica').children
+        self.assertEqual((lookup, classrooms.db), ('classroom__in', 'replica'))
+        # Moved to the default database, the teachers subquery inside is still on the replica
+        with self.assertRaisesMessage(ValueError, "Subqueries aren't allowed across different databases"):
+            list(classrooms.using(DEFAULT_DB_ALIAS))
+
+    def test_router_picks_a_replica_per_query(self):
+        # replica_reads() routes every read to a random replica; the subqueries have to run
+        # where the outer query runs, whichever alias comes up first
+        search_fields = ['full_name', 'classroom__classroom_key']
+        expected = self.search(Student.objects.all(), search_fields, 'student 1', indexed=False)
+        aliases = itertools.cycle([DEFAULT_DB_ALIAS, 'replica'])
+        with mock.patch('digitmileapi.search.uses_trigram_indexes', return_value=True), \
+                mock.patch.object(router, 'db_for_read', side_effect=lambda model, **hints: next(aliases)):
+            queryset = search_queryset(Student.objects.all(), search_fields, 'student 1')
+            self.assertEqual(queryset.db, DEFAULT_DB_ALIAS)
+            self.assertEqual({student.pk for student in queryset}, expected)
+
+    def test_short_word(self):
+        # "1" has no trigram, it narrows down what "student" found
+        found = self.search(Student.objects.all(), ['full_name'], 'student 1', indexed=True)
+        self.assertEqual(found, set(Student.objects.filter(full_name__contains='1').values_list('pk', flat=True)))
+        self.assertEqual(len(found), 4 * 3)  # Student 1, 10 and 11 in each classroom
+
+
+class _RecordingCursor:
+    # Records the SQL of ensure_month_partitions() and answers its lookups from `answers`
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def fetchone(self):
+        return self.answers.pop(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class MonthPartitionTests(TestCase):
+    month = datetime.date(2031, 5, 1)
+
+    def test_partition_built_next_to_rows_in_the_default_one(self):
+        # No partition yet, rows for the month in the DEFAULT partition
+        cursor = _RecordingCursor([(None,), (True,)])
+        connection = mock.Mock(ops=connections[DEFAULT_DB_ALIAS].ops, cursor=lambda: cursor)
+        self.assertEqual(ensure_month_partitions(connection, self.month, self.month), [partition_name(self.month)])
+        create, move, attach = cursor.statements[2:]
+        self.assertIn('INCLUDING DEFAULTS INCLUDING CONSTRAINTS', create)
+        # A table with an identity column of its own cannot be attached as a partition
+        self.assertNotIn('IDENTITY', create)
+        self.assertIn('DELETE FROM', move)
+        self.assertIn('ATTACH PARTITION', attach)
+
+    def test_rows_in_the_default_partition_move_over(self):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not is_partitioned(connection):
+            self.skipTest("RunStatistics is only partitioned on Postgres")
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=1, runs=0)
+        student = Student.objects.get()
+        created_at = timezone.make_aware(datetime.datetime(2031, 5, 3))
+        moved = RunStatistics.objects.create(student=student, created_at=created_at, player_won=True)
+
+        ensure_month_partitions(connection, self.month, self.month)
+        later = RunStatistics.objects.create(student=student, created_at=created_at, player_won=False)
+        self.assertGreater(later.pk, moved.pk)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {partition_name(self.month)} ORDER BY id")
+            self.assertEqual([row[0] for row in cursor.fetchall()], [moved.pk, later.pk])
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    read_alias() hands out 'replica', which is not configured: any query sent there fails. It
+    would stay on the primary inside the transaction of TestCase, so that is switched off too.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        cls.classroom = Classroom.objects.get()
+
+    def setUp(self):
+        for patcher in (
+            mock.patch('digitmileapi.routers.replica_aliases', return_value=['replica']),
+            mock.patch('digitmileapi.routers._primary_required', return_value=False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        get_roster_cache().clear()
+
+    def test_cached_roster_comes_from_the_primary(self):
+        # What goes into the roster cache must not come from a replica that lags behind the
+        # invalidation in signals.py
+        response = self.client.post('/api/checkClassroomKey/', {'classroomKey': self.classroom.classroom_key}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_roster_cache().get(self.classroom.classroom_key)['students'], response.json()['students'])
+
+    async def test_cached_roster_comes_from_the_primary_async(self):
+        request = AsyncRequestFactory().post(
+            '/api/checkClassroomKey/', {'classroomKey': self.classroom.classroom_key}, content_type='application/json',
+        )
+        response = await AsyncCheckClassroomKeyView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(await get_roster_cache().aget(self.classroom.classroom_key))
+
+
+@override_settings(DB_REPLICA_ALIASES=['replica'], DB_REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+    """
+    Only decides aliases, nothing here runs a query.
+    """
+    def middleware(self, write=False):
+        # A view that optionally writes and reports where a replica read would have gone
+        def view(request):
+            if write:
+                ReplicaRouter().db_for_write(Classroom)
+            return HttpResponse(read_alias())
+        return pin_primary_middleware(view)
+
+    def test_reads_opt_in(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Classroom), DEFAULT_DB_ALIAS)
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Classroom), 'replica')
+        self.assertEqual(router.db_for_read(Classroom), DEFAULT_DB_ALIAS)
+        with override_settings(DB_REPLICA_ALIASES=[]), replica_reads():
+            self.assertEqual(router.db_for_read(Classroom), DEFAULT_DB_ALIAS)
+
+    def test_migrations_and_relations(self):
+        router = ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'digitmileapi'))
+        self.assertIsNone(router.allow_migrate(DEFAULT_DB_ALIAS, 'digitmileapi'))
+        replica_obj, primary_obj = Classroom(), Classroom()
+        replica_obj._state.db, primary_obj._state.db = 'replica', DEFAULT_DB_ALIAS
+        self.assertTrue(router.allow_relation(replica_obj, primary_obj))
+
+    def test_transactions_stay_on_the_primary(self):
+        with mock.patch.object(connections[DEFAULT_DB_ALIAS], 'in_atomic_block', True):
+            self.assertEqual(read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_writing_pins_the_request_and_the_next_ones(self):
+        request = RequestFactory().get('/')
+        self.assertEqual(self.middleware()(request).content, b'replica')
+
+        response = self.middleware(write=True)(request)
+        self.assertEqual(response.content, DEFAULT_DB_ALIAS.encode())
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+        request.COOKIES[PIN_COOKIE] = '1'
+        response = self.middleware()(request)
+        self.assertEqual(response.content, DEFAULT_DB_ALIAS.encode())
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        with override_settings(DB_REPLICA_PIN_SECONDS=0):
+            self.assertNotIn(PIN_COOKIE, self.middleware(write=True)(RequestFactory().get('/')).cookies)
+
+    async def test_async_writes_pin_the_request(self):
+        async def view(request):
+            # The write happens on a thread, the state is shared through the context
+            await sync_to_async(ReplicaRouter().db_for_write)(Classroom)
+            return HttpResponse(read_alias())
+
+        response = await pin_primary_middleware(view)(AsyncRequestFactory().get('/'))
+        self.assertEqual(response.content, DEFAULT_DB_ALIAS.encode())
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_unused_without_replicas(self):
+        with override_settings(DB_REPLICA_ALIASES=[]), self.assertRaises(MiddlewareNotUsed):
+            self.middleware()
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=2, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=60)
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def test_sync_export_streams_a_sync_iterator(self):
+        self.client.force_login(self.superuser)
+        response = self.client.get('/api/export/runStatistics/', {'output': 'ndjson'})
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 60)
+
+    def export(self, user=None, **params):
+        self.client.force_login(user or self.superuser)
+        response = self.client.get('/api/export/runStatistics/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_columns(self):
+        rows = list(csv.reader(StringIO(self.export(output='csv'))))
+        self.assertEqual(rows[0], [name for name, _ in EXPORT_COLUMNS])
+        run = RunStatistics.objects.select_related('student__classroom__teacher__school').get(pk=int(rows[1][0]))
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(
+            (row['student'], row['classroom_key'], row['school'], row['municipality'], row['place']),
+            (run.student.full_name, run.student.classroom.classroom_key, run.student.classroom.teacher.school.name,
+             run.student.classroom.teacher.school.municipality, str(run.place)),
+        )
+
+    def test_filters(self):
+        school = School.objects.order_by('pk').first()
+        middle = RunStatistics.objects.order_by('created_at').values_list('created_at', flat=True)[30]
+        runs = RunStatistics.objects.all()
+        for params, expected in [
+            ({'school': school.pk}, runs.filter(student__classroom__teacher__school=school)),
+            ({'teacher': school.teachers.get().pk}, runs.filter(student__classroom__teacher__school=school)),
+            ({'municipality': school.municipality}, runs.filter(student__classroom__teacher__school__municipality=school.municipality)),
+            ({'since': middle.isoformat()}, runs.filter(created_at__gte=middle)),
+            ({'until': middle.isoformat()}, runs.filter(created_at__lt=middle)),
+        ]:
+            with self.subTest(params=params):
+                lines = self.export(output='ndjson', **params).splitlines()
+                self.assertEqual(sorted(json.loads(line)['run_id'] for line in lines), sorted(expected.values_list('id', flat=True)))
+
+    def test_teacher_gets_their_own_classrooms(self):
+        teacher = Teacher.objects.order_by('pk').first()
+        teacher.user = User.objects.create_user('teacher', password='x')
+        teacher.save()
+        lines = self.export(teacher.user, output='ndjson').splitlines()
+        self.assertEqual(
+            sorted(json.loads(line)['run_id'] for line in lines),
+            sorted(RunStatistics.objects.filter(student__classroom__teacher=teacher).values_list('id', flat=True)),
+        )
+        # Without a teacher profile there is nothing to export
+        self.assertEqual(self.export(User.objects.create_user('nobody', password='x'), output='ndjson'), '')
+
+    def test_invalid_parameters(self):
+        self.client.force_login(self.superuser)
+        for params in ({'output': 'xml'}, {'school': 'north'}, {'since': 'yesterday'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/export/runStatistics/', params).status_code, 400)
+
+    def test_management_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'runs.ndjson'
+            call_command('export_run_statistics', '--format', 'ndjson', '--output', str(path), stderr=StringIO())
+            lines = path.read_text(encoding='utf-8').splitlines()
+        self.assertEqual(len(lines), 60)
+        self.assertEqual(list(json.loads(lines[0])), [name for name, _ in EXPORT_COLUMNS])
+
+    async def test_asgi_export_streams_an_async_iterator(self):
+        # A sync iterator would be read into memory by the ASGI handler before anything is sent
+        await self.async_client.aforce_login(self.superuser)
+        for output in ('csv', 'ndjson'):
+            with self.subTest(output=output):
+                response = await self.async_client.get('/api/export/runStatistics/', {'output': output})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.is_async)
+                content = b''.join([chunk async for chunk in response.streaming_content])
+                expected = await sync_to_async(lambda: ''.join(export_lines(export_queryset(), output)).encode())()
+                self.assertEqual(sorted(content.splitlines()), sorted(expected.splitlines()))
+
+
+def _runs(*outcomes):
+    # load_runs() arrays from (student_id, won) pairs, oldest run of each student first
+    student_ids, won = zip(*outcomes)
+    nan = np.full(len(outcomes), np.nan)
+    return {
+        'student_id': np.array(student_ids, dtype=np.int64), 'player_won': np.array(won, dtype=bool),
+        'place': nan, 'score': nan, 'correct_moves': nan, 'wrong_moves': nan, 'time_elapsed': nan,
+    }
+
+
+@skipIf(np is None, "NumPy is not installed")
+class StudentProgressTests(TestCase):
+    """
+    The metrics against a dataset small enough to work out by hand.
+    """
+    def test_student_metrics(self):
+        # 1: won, lost, won, won   2: lost, lost   3: won
+        runs = _runs((1, True), (1, False), (1, True), (1, True), (2, False), (2, False), (3, True))
+        metrics = student_metrics(runs, recent_runs=2, half_life=1.0, prior_runs=2.0, prior_win_rate=0.5)
+        self.assertEqual(metrics['student_id'].tolist(), [1, 2, 3])
+        self.assertEqual(metrics['total_runs'].tolist(), [4, 2, 1])
+        self.assertEqual(metrics['total_wins'].tolist(), [3, 0, 1])
+        self.assertEqual(metrics['current_streak'].tolist(), [2, -2, 1])
+        self.assertEqual(metrics['best_win_streak'].tolist(), [2, 0, 1])
+        self.assertEqual(metrics['recent_win_rate'].tolist(), [1.0, 0.0, 1.0])
+        # Weights halve with every run back: 1/8, 1/4, 1/2, 1 for the four runs of student 1,
+        # plus two prior runs at a 50% win rate
+        expected = [
+            100 * (1 / 8 + 1 / 2 + 1 + 1) / (1 / 8 + 1 / 4 + 1 / 2 + 1 + 2),
+            100 * 1 / (1 / 2 + 1 + 2),
+            100 * (1 + 1) / (1 + 2),
+        ]
+        np.testing.assert_allclose(metrics['rating'], expected)
+
+    def test_rank_within(self):
+        groups = np.array([1, 1, 1, 2, 2, 3])
+        values = np.array([10.0, 20.0, 20.0, 5.0, np.nan, 7.0])
+        # Ties share a rank; no rating and being alone in the group (after dropping NaN) rank NaN
+        np.testing.assert_array_equal(rank_within(groups, values), [0.0, 50.0, 50.0, np.nan, np.nan, np.nan])
+
+    def test_student_missing_from_the_school(self):
+        # Runs of a student that was deleted or moved away after the runs were read
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=2, runs=0)
+        school = School.objects.get()
+        first, second = Student.objects.order_by('pk')
+        gone = second.pk + 1000
+        runs = _runs((first.pk, True), (second.pk, False), (gone, True))
+        with mock.patch('digitmileapi.analytics.load_runs', return_value=runs):
+            result = analyze_school(school.pk, DEFAULT_DB_ALIAS, {}, 0.25)
+        self.assertEqual(result['student_id'].tolist(), [first.pk, second.pk])
+        self.assertEqual(result['classroom_id'].tolist(), [first.classroom_id, second.classroom_id])
+        self.assertEqual(result['total_wins'].tolist(), [1, 0])
+
+
+class BatchInsertTests(TestCase):
+    path = '/api/insertLevelStatisticsBatch/'
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=2, students_per_classroom=2, runs=0)
+        cls.first, cls.second = Classroom.objects.order_by('pk')
+        cls.students = list(Student.objects.filter(classroom=cls.first).order_by('pk'))
+
+    def setUp(self):
+        get_roster_cache().clear()
+
+    def item(self, student=None, classroom_key=None, user=None, place=1):
+        return {
+            'classroomKey': classroom_key or (student.classroom.classroom_key if student else None),
+            'user': user or (student.full_name if student else None),
+            'levelStatistics': {'place': place},
+        }
+
+    def post(self, items):
+        return self.client.post(self.path, items, content_type='application/json')
+
+    def test_every_item_inserted(self):
+        items = [self.item(student, place=place) for student in self.students for place in (1, 2)]
+        response = self.post(items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.json()['results']], [201] * 4)
+        self.assertEqual(
+            Counter(RunStatistics.objects.values_list('student_id', flat=True)),
+            {student.pk: 2 for student in self.students},
+        )
+        # The counters of the summary tables go up with the same insert
+        self.assertEqual(ClassroomRunSummary.objects.get(classroom=self.first).total_runs, 4)
+
+    def test_one_result_per_item_in_order(self):
+        student = self.students[0]
+        response = self.post([
+            self.item(student),
+            self.item(classroom_key='NO-SUCH-KEY', user=student.full_name),
+            {'classroomKey': self.first.classroom_key, 'user': student.full_name, 'levelStatistics': {}},
+            self.item(classroom_key=self.second.classroom_key, user='Nobody'),
+            {'token': make_student_token(student.classroom_id, student.pk), 'levelStatistics': {'place': 3}},
+        ])
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 404, 400, 404, 201])
+        self.assertEqual(results[1]['error'], "Classroom not found")
+        self.assertEqual(results[3]['error'], "User (Student) not found in this classroom")
+        self.assertIn('levelStatistics', results[2]['errors'])
+        self.assertEqual(sorted(RunStatistics.objects.values_list('place', flat=True)), [1, 3])
+
+    def test_rejected_requests(self):
+        for body in ([], {'classroomKey': self.first.classroom_key}):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        with override_settings(LEVEL_STATISTICS_BATCH_MAX_ITEMS=2):
+            response = self.post([self.item(self.students[0])] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RunStatistics.objects.exists())
+
+
+class RosterCacheTests(TestCase):
+    """
+    The in-process tier on its own, then two caches on one shared backend standing for two
+    processes, then the invalidation in signals.py.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=2, students_per_classroom=2, runs=0)
+        cls.classroom, cls.other_classroom = Classroom.objects.order_by('pk')
+
+    def setUp(self):
+        get_roster_cache().clear()
+
+    def check_classroom_key(self, classroom):
+        response = self.client.post('/api/checkClassroomKey/', {'classroomKey': classroom.classroom_key}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_lru_evicts_and_expires(self):
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')  # now 'b' is the least recently used
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        with mock.patch('digitmileapi.roster_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru), 1)
+
+    def test_shared_tier(self):
+        one, two = RosterCache(backend='default'), RosterCache(backend='default')
+        one.set('KEY', {'students': ['a']})
+        self.assertEqual(two.get('KEY'), {'students': ['a']})
+        self.assertEqual(two.stats()['shared_hits'], 1)
+        self.assertEqual(two.get('KEY'), {'students': ['a']})
+        self.assertEqual(two.stats()['local_hits'], 1)
+        one.invalidate('KEY')
+        two.local.clear()
+        self.assertIsNone(two.get('KEY'))
+
+    def test_changes_drop_the_cached_roster(self):
+        roster_cache = get_roster_cache()
+        student = Student.objects.filter(classroom=self.classroom).first()
+        changes = [
+            lambda: Student.objects.create(classroom=self.classroom, full_name='New student'),
+            lambda: Student.objects.filter(pk=student.pk).get().save(),
+            lambda: self.classroom.teacher.save(),
+            lambda: self.classroom.teacher.school.save(),
+        ]
+        for change in changes:
+            with self.subTest(change=change):
+                self.check_classroom_key(self.classroom)
+                self.assertIsNotNone(roster_cache.get(self.classroom.classroom_key))
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                self.assertIsNone(roster_cache.get(self.classroom.classroom_key))
+        self.assertIn('New student', self.check_classroom_key(self.classroom)['students'])
+
+    def test_student_moved_to_another_classroom(self):
+        student = Student.objects.filter(classroom=self.classroom).first()
+        for classroom in (self.classroom, self.other_classroom):
+            self.check_classroom_key(classroom)
+        with self.captureOnCommitCallbacks(execute=True):
+            student.classroom, student.full_name = self.other_classroom, 'Moved student'
+            student.save()
+        for classroom in (self.classroom, self.other_classroom):
+            self.assertIsNone(get_roster_cache().get(classroom.classroom_key))
+        self.assertIn('Moved student', self.check_classroom_key(self.other_classroom)['students'])
+
+
+class ResolveStudentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=2, students_per_classroom=2, runs=0)
+        cls.classroom = Classroom.objects.order_by('pk').first()
+        cls.student = Student.objects.filter(classroom=cls.classroom).order_by('pk').first()
+
+    def test_found_with_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                resolve_student(self.classroom.classroom_key, self.student.full_name), (self.student.pk, self.classroom.pk),
+            )
+
+    def test_misses_tell_classroom_and_student_apart(self):
+        with self.assertNumQueries(2), self.assertRaises(Classroom.DoesNotExist):
+            resolve_student('NO-SUCH-KEY', self.student.full_name)
+        with self.assertNumQueries(2), self.assertRaises(Student.DoesNotExist):
+            resolve_student(self.classroom.classroom_key, 'Nobody')
+
+    async def test_async_version(self):
+        self.assertEqual(
+            await aresolve_student(self.classroom.classroom_key, self.student.full_name), (self.student.pk, self.classroom.pk),
+        )
+        with self.assertRaises(Classroom.DoesNotExist):
+            await aresolve_student('NO-SUCH-KEY', self.student.full_name)
+        with self.assertRaises(Student.DoesNotExist):
+            await aresolve_student(self.classroom.classroom_key, 'Nobody')
+
+    def test_names_are_unique_per_classroom(self):
+        other_classroom = Classroom.objects.exclude(pk=self.classroom.pk).get()
+        # The same name in another classroom is fine, twice in one classroom is not
+        Student.objects.create(classroom=other_classroom, full_name='Same name')
+        Student.objects.create(classroom=self.classroom, full_name='Same name')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Student.objects.create(classroom=self.classroom, full_name='Same name')
+
+    def test_duplicate_name_is_a_conflict(self):
+        # Only possible on data that predates the unique constraint
+        with mock.patch('digitmileapi.views.resolve_student', side_effect=Student.MultipleObjectsReturned):
+            response = self.client.post('/api/insertLevelStatistics/', {
+                'classroomKey': self.classroom.classroom_key, 'user': self.student.full_name, 'levelStatistics': {'place': 1},
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(RunStatistics.objects.exists())
+
+
+class AsyncGameClientViewTests(TestCase):
+    """
+    The async views answer like the DRF ones in views.py.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        cls.classroom = Classroom.objects.get()
+        cls.student = Student.objects.order_by('pk').first()
+
+    def setUp(self):
+        get_roster_cache().clear()
+
+    async def post(self, view, data, **extra):
+        request = AsyncRequestFactory().post('/', data, content_type='application/json', **extra)
+        return await view.as_view()(request)
+
+    async def test_check_classroom_key_matches_the_sync_view(self):
+        sync_response = await sync_to_async(self.client.post)(
+            '/api/checkClassroomKey/', {'classroomKey': self.classroom.classroom_key}, content_type='application/json',
+        )
+        await sync_to_async(get_roster_cache().clear)()
+        for _ in range(2):  # from the database, then from the roster cache
+            response = await self.post(AsyncCheckClassroomKeyView, {'classroomKey': self.classroom.classroom_key})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), sync_response.json())
+            self.assertEqual(response['ETag'], sync_response['ETag'])
+        response = await self.post(
+            AsyncCheckClassroomKeyView, {'classroomKey': self.classroom.classroom_key}, headers={'If-None-Match': sync_response['ETag']},
+        )
+        self.assertEqual(response.status_code, 304)
+
+    async def test_check_classroom_key_errors(self):
+        self.assertEqual((await self.post(AsyncCheckClassroomKeyView, {})).status_code, 400)
+        self.assertEqual((await self.post(AsyncCheckClassroomKeyView, {'classroomKey': 'NO-SUCH-KEY'})).status_code, 404)
+
+    async def test_insert(self):
+        by_name = {'classroomKey': self.classroom.classroom_key, 'user': self.student.full_name, 'levelStatistics': {'place': 1}}
+        by_token = {'token': make_student_token(self.classroom.pk, self.student.pk), 'levelStatistics': {'place': 2}}
+        for data in (by_name, by_token):
+            with self.subTest(data=data):
+                self.assertEqual((await self.post(AsyncInsertLevelStatisticsView, data)).status_code, 201)
+        self.assertEqual(
+            sorted([row async for row in RunStatistics.objects.values_list('student_id', 'place')]),
+            [(self.student.pk, 1), (self.student.pk, 2)],
+        )
+
+    async def test_insert_errors(self):
+        request = AsyncRequestFactory().post('/', b'{not json', content_type='application/json')
+        self.assertEqual((await AsyncInsertLevelStatisticsView.as_view()(request)).status_code, 400)
+        for data, expected in [
+            ({'classroomKey': self.classroom.classroom_key, 'levelStatistics': {'place': 1}}, 400),
+            ({'classroomKey': 'NO-SUCH-KEY', 'user': self.student.full_name, 'levelStatistics': {'place': 1}}, 404),
+            ({'classroomKey': self.classroom.classroom_key, 'user': 'Nobody', 'levelStatistics': {'place': 1}}, 404),
+        ]:
+            with self.subTest(data=data):
+                self.assertEqual((await self.post(AsyncInsertLevelStatisticsView, data)).status_code, expected)
+        self.assertFalse(await RunStatistics.objects.aexists())
+
+    async def test_buffered_insert(self):
+        buffer = IngestionBuffer()
+        with mock.patch.object(IngestionBuffer, 'start'), mock.patch('digitmileapi.ingest._buffer', buffer), \
+                override_settings(INGEST={'MODE': 'buffered'}):
+            response = await self.post(AsyncInsertLevelStatisticsView, {
+                'token': make_student_token(self.classroom.pk, self.student.pk), 'levelStatistics': {'place': 1},
+            })
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(buffer.stats()['queue_depth'], 1)
+
+
+class RunSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=2, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        cls.classroom = Classroom.objects.order_by('pk').first()
+        cls.students = list(Student.objects.filter(classroom=cls.classroom).order_by('pk'))
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def insert(self, student, *outcomes):
+        # place 1 is a win
+        insert_runs([
+            (RunStatistics.from_level_statistics(student.pk, {'place': 1 if won else 2}), student.classroom_id)
+            for won in outcomes
+        ])
+
+    def summaries(self):
+        return (
+            {student_id: (runs, wins) for student_id, runs, wins in StudentRunSummary.objects.values_list('student_id', 'total_runs', 'total_wins')},
+            ClassroomRunSummary.objects.values_list('total_runs', 'total_wins').get(classroom=self.classroom),
+        )
+
+    def test_counters_follow_the_inserts(self):
+        first, second, _ = self.students
+        self.insert(first, True, False, True)
+        self.insert(second, False)
+        self.insert(first, True)
+        self.assertEqual(self.summaries(), ({first.pk: (4, 3), second.pk: (1, 0)}, (5, 3)))
+
+    def test_leaderboard(self):
+        first, second, third = self.students
+        self.insert(first, True, False)
+        self.insert(second, True, True, False)
+        self.client.force_login(self.superuser)
+        response = self.client.get(f'/api/classrooms/{self.classroom.classroom_key}/leaderboard/')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['totalRuns'], body['totalWins']), (5, 3))
+        self.assertEqual(body['students'], [
+            {'name': second.full_name, 'runs': 3, 'wins': 2, 'winRate': 0.6667},
+            {'name': first.full_name, 'runs': 2, 'wins': 1, 'winRate': 0.5},
+            {'name': third.full_name, 'runs': 0, 'wins': 0, 'winRate': None},  # no runs yet
+        ])
+
+    def test_leaderboard_of_another_teacher(self):
+        teacher = Teacher.objects.exclude(pk=self.classroom.teacher_id).get()
+        teacher.user = User.objects.create_user('teacher', password='x')
+        teacher.save()
+        self.client.force_login(teacher.user)
+        self.assertEqual(self.client.get(f'/api/classrooms/{self.classroom.classroom_key}/leaderboard/').status_code, 404)
+
+    def test_rebuild_recounts_from_the_log(self):
+        first, second, _ = self.students
+        self.insert(first, True, True)
+        self.insert(second, False)
+        RunStatistics.objects.filter(student=first, player_won=True).first().delete()
+        call_command('rebuild_run_summaries', stdout=StringIO())
+        self.assertEqual(self.summaries(), ({first.pk: (1, 1), second.pk: (1, 0)}, (2, 1)))
+
+
+class LevelStatisticsStoreTests(TestCase):
+    path = '/api/insertLevelStatistics/'
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=1, runs=0)
+        cls.student = Student.objects.get()
+
+    def insert(self, level_statistics):
+        return self.client.post(self.path, {
+            'token': make_student_token(self.student.classroom_id, self.student.pk), 'levelStatistics': level_statistics,
+        }, content_type='application/json')
+
+    def test_every_field_is_stored(self):
+        response = self.insert({'place': 2, 'score': -5, 'correctMoves': 12, 'wrongMoves': 3, 'timeElapsed': 41.5})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            RunStatistics.objects.values_list('player_won', 'place', 'score', 'correct_moves', 'wrong_moves', 'time_elapsed').get(),
+            (False, 2, -5, 12, 3, 41.5),
+        )
+
+    def test_older_clients_only_send_the_place(self):
+        self.assertEqual(self.insert({'place': 1}).status_code, 201)
+        self.assertEqual(
+            RunStatistics.objects.values_list('player_won', 'place', 'score', 'correct_moves', 'wrong_moves', 'time_elapsed').get(),
+            (True, 1, None, None, None, None),
+        )
+
+    def test_values_that_do_not_fit_the_columns(self):
+        for level_statistics in [
+            {'place': 2**15},
+            {'place': 1, 'score': 2**31},
+            {'place': 1, 'correctMoves': -1},
+            {'place': 1, 'wrongMoves': True},
+            {'place': 1, 'timeElapsed': '41.5'},
+        ]:
+            with self.subTest(level_statistics=level_statistics):
+                response = self.insert(level_statistics)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('levelStatistics', response.json())
+        self.assertFalse(RunStatistics.objects.exists())
+
+    def test_partition_names(self):
+        month = datetime.date(2031, 12, 1)
+        self.assertEqual(partition_month(partition_name(month)), month)
+        self.assertEqual(next_month(month), datetime.date(2032, 1, 1))
+        self.assertIsNone(partition_month(f"{RunStatistics._meta.db_table}_default"))
+
+
+class ImportRosterTests(TestCase):
+    """
+    On Postgres the files go in with COPY, and with bulk_create under --no-copy.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.write('schools.csv', 'name,municipality\nNorth School,Oulu\nSouth School,Oulu\nNorth School,Oulu\n')
+        self.write('teachers.ndjson', '\n'.join(json.dumps(row) for row in [
+            {'full_name': 'Ann Teacher', 'school': 'North School'},
+            {'full_name': 'Bob Teacher', 'school': 'South School', 'municipality': 'Oulu'},
+            {'full_name': 'Nobody', 'school': 'No School'},  # unresolved
+        ]) + '\n')
+        self.write('classrooms.csv', 'classroom_key,teacher,school\nKEY-A,Ann Teacher,North School\nKEY-B,Bob Teacher,South School\n')
+        self.write('students.csv', 'full_name,classroom_key\nAlice,KEY-A\nBert,KEY-A\nAlice,KEY-B\nAlice,KEY-A\nCarl,NO-KEY\n')
+
+    def write(self, name, content):
+        (self.directory / name).write_text(content, encoding='utf-8')
+
+    def import_roster(self, *extra):
+        call_command(
+            'import_roster',
+            '--schools', str(self.directory / 'schools.csv'),
+            '--teachers', str(self.directory / 'teachers.ndjson'),
+            '--classrooms', str(self.directory / 'classrooms.csv'),
+            '--students', str(self.directory / 'students.csv'),
+            *extra, stdout=StringIO(),
+        )
+
+    def assertImported(self):
+        self.assertEqual(sorted(School.objects.values_list('name', flat=True)), ['North School', 'South School'])
+        self.assertEqual(
+            sorted(Classroom.objects.values_list('classroom_key', 'teacher__full_name')),
+            [('KEY-A', 'Ann Teacher'), ('KEY-B', 'Bob Teacher')],
+        )
+        self.assertEqual(
+            sorted(Student.objects.values_list('classroom__classroom_key', 'full_name')),
+            [('KEY-A', 'Alice'), ('KEY-A', 'Bert'), ('KEY-B', 'Alice')],
+        )
+
+    def test_import_and_reimport(self):
+        for extra in ([], ['--no-copy']):
+            with self.subTest(extra=extra):
+                self.import_roster(*extra)
+                self.assertImported()
+                # Running it again changes nothing
+                self.import_roster(*extra)
+                self.assertImported()
+
+    def test_new_students_bump_the_roster_version(self):
+        self.import_roster('--no-copy')
+        versions = dict(Classroom.objects.values_list('classroom_key', 'roster_version'))
+        self.write('students.csv', 'full_name,classroom_key\nDora,KEY-B\n')
+        call_command('import_roster', '--students', str(self.directory / 'students.csv'), stdout=StringIO())
+        self.assertEqual(
+            dict(Classroom.objects.values_list('classroom_key', 'roster_version')),
+            {'KEY-A': versions['KEY-A'], 'KEY-B': versions['KEY-B'] + 1},
+        )
+
+    def test_nothing_to_import(self):
+        with self.assertRaises(CommandError):
+            call_command('import_roster', stdout=StringIO())
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=2, runs=30)
+
+    def count_queries(self, threshold):
+        paginator = EstimatedCountPaginator(RunStatistics.objects.order_by('pk'), 10)
+        with override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=threshold), \
+                CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as context:
+            count = paginator.count
+        return count, [query['sql'].split()[0].upper() for query in context.captured_queries]
+
+    def test_small_tables_are_counted(self):
+        count, queries = self.count_queries(threshold=100000)
+        self.assertEqual(count, 30)
+        self.assertIn('SELECT', queries)
+
+    def test_big_tables_use_the_estimate(self):
+        count, queries = self.count_queries(threshold=0)
+        if connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+            # No planner estimate to ask for elsewhere
+            self.assertEqual((count, queries), (30, ['SELECT']))
+            return
+        self.assertEqual(queries, ['EXPLAIN'])
+        self.assertGreaterEqual(count, 0)
+
+    def test_lists_are_counted(self):
+        self.assertEqual(EstimatedCountPaginator(list(range(25)), 10).num_pages, 3)
+
+
+class BenchmarkTests(TransactionTestCase):
+    """
+    run() sends its requests from worker threads, so the seeded data is committed.
+    """
+    def report(self, p95=10.0, requests_per_second=100.0, max_queries=2):
+        return {
+            'latency_ms': {'p95': p95},
+            'requests_per_second': requests_per_second,
+            'queries_per_request': {'mean': max_queries, 'max': max_queries},
+        }
+
+    def test_seed_and_clear(self):
+        School.objects.create(name='Real school', municipality='Oulu')
+        counts = benchmarks.seed(schools=2, teachers_per_school=1, classrooms_per_teacher=2, students_per_classroom=3, runs=50, batch_size=7)
+        self.assertEqual(counts, {'schools': 2, 'teachers': 2, 'classrooms': 4, 'students': 12, 'runs': 50})
+        self.assertEqual(RunStatistics.objects.count(), 50)
+        self.assertEqual(len(benchmarks.targets()), 12)
+        benchmarks.clear()
+        self.assertEqual(list(School.objects.values_list('name', flat=True)), ['Real school'])
+        self.assertFalse(RunStatistics.objects.exists())
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_run_through_the_test_client(self):
+        with self.assertRaises(ValueError):
+            benchmarks.run('checkClassroomKey', requests=1)
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        get_roster_cache().clear()
+        # SQLite lets one writer in at a time and fails the others with "database is locked"
+        write_concurrency = 1 if connections[DEFAULT_DB_ALIAS].vendor == 'sqlite' else 3
+        for endpoint, use_tokens, concurrency, status_code in [
+            ('checkClassroomKey', False, 3, '200'),
+            ('insertLevelStatistics', False, write_concurrency, '201'),
+            ('insertLevelStatistics', True, write_concurrency, '201'),
+        ]:
+            with self.subTest(endpoint=endpoint, use_tokens=use_tokens):
+                report = benchmarks.run(endpoint, requests=12, concurrency=concurrency, use_tokens=use_tokens)
+                self.assertEqual(report['status_counts'], {status_code: 12})
+                self.assertEqual(report['transport'], 'test_client')
+                self.assertGreaterEqual(report['queries_per_request']['max'], 1)
+        self.assertEqual(RunStatistics.objects.count(), 24)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(
+            [benchmarks.percentile(values, fraction) for fraction in (0.5, 0.95, 0.99, 1.0)], [50, 95, 99, 100],
+        )
+        self.assertIsNone(benchmarks.percentile([], 0.5))
+
+    def test_regressions(self):
+        baseline = self.report()
+        self.assertEqual(benchmarks.regressions(self.report(p95=11.9, requests_per_second=81), baseline), [])
+        found = benchmarks.regressions(self.report(p95=12.5, requests_per_second=70, max_queries=3), baseline)
+        self.assertEqual(len(found), 3)
+        self.assertTrue(found[0].startswith('p95 latency'))
+
+
+class ConnectionSettingsTests(SimpleTestCase):
+    """
+    settings.py read again under different DB_* environment variables.
+    """
+    variables = (
+        'DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_CONN_MAX_AGE', 'DB_CONN_HEALTH_CHECKS',
+        'DB_POOL', 'DB_POOL_MIN_SIZE', 'DB_POOL_MAX_SIZE', 'DB_POOL_TIMEOUT', 'DB_PGBOUNCER', 'DB_REPLICAS',
+    )
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ), mock.patch('dotenv.load_dotenv'):
+            for name in set(self.variables) - environ.keys():
+                os.environ.pop(name, None)
+            return runpy.run_path(str(settings.BASE_DIR / 'digitmile' / 'settings.py'))
+
+    def test_persistent_connections_by_default(self):
+        database = self.load_settings()['DATABASES']['default']
+        self.assertEqual((database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS']), (60, True))
+        self.assertNotIn('pool', database['OPTIONS'])
+        self.assertEqual(self.load_settings(DB_CONN_MAX_AGE='0', DB_CONN_HEALTH_CHECKS='0')['DATABASES']['default']['CONN_MAX_AGE'], 0)
+
+    def test_pool(self):
+        database = self.load_settings(DB_POOL='1', DB_POOL_MAX_SIZE='20')['DATABASES']['default']
+        # Django refuses persistent connections next to a pool
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 20, 'timeout': 10.0})
+
+    def test_pgbouncer_transaction_mode(self):
+        database = self.load_settings(DB_PGBOUNCER='transaction')['DATABASES']['default']
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
+        try:
+            import psycopg  # noqa: F401
+        except ImportError:
+            self.assertNotIn('prepare_threshold', database['OPTIONS'])
+        else:
+            self.assertIsNone(database['OPTIONS']['prepare_threshold'])
+
+    def test_replicas(self):
+        loaded = self.load_settings(DB_HOST='primary', DB_NAME='digitmile', DB_POOL='1', DB_REPLICAS='replica-a, :5433/other')
+        self.assertEqual(loaded['DB_REPLICA_ALIASES'], ['replica1', 'replica2'])
+        databases = loaded['DATABASES']
+        self.assertEqual(
+            [(databases[alias]['HOST'], databases[alias]['PORT'], databases[alias]['NAME']) for alias in loaded['DB_REPLICA_ALIASES']],
+            [('replica-a', '5432', 'digitmile'), ('primary', '5433', 'other')],
+        )
+        self.assertEqual(databases['replica1']['OPTIONS'], databases['default']['OPTIONS'])
+        self.assertIsNot(databases['replica1']['OPTIONS'], databases['default']['OPTIONS'])
+        self.assertEqual(databases['replica1']['TEST'], {'MIRROR': 'default'})
+
+
+class ContentNegotiationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        cls.classroom = Classroom.objects.select_related('teacher__school').get()
+        cls.student = Student.objects.order_by('pk').first()
+
+    def setUp(self):
+        get_roster_cache().clear()
+
+    def test_payload_matches_the_serializer(self):
+        school = self.classroom.teacher.school
+        students = list(Student.objects.order_by('pk').values_list('id', 'full_name'))
+        payload = check_classroom_payload(school.name, school.municipality, 'Teacher', students, self.classroom.pk, 4)
+        serialized = CheckClassroomResponseSerializer({
+            'school': school,
+            'teacher_data': 'Teacher',
+            'students': [full_name for _, full_name in students],
+            'studentTokens': payload['studentTokens'],
+            'version': 4,
+        }).data
+        self.assertEqual(json.loads(json.dumps(serialized)), payload)
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_messagepack_both_ways(self):
+        path = '/api/checkClassroomKey/'
+        body = msgpack.packb({'classroomKey': self.classroom.classroom_key})
+        for async_views in (False, True):
+            with self.subTest(async_views=async_views):
+                get_roster_cache().clear()
+                if async_views:
+                    request = RequestFactory().post(path, body, content_type=MSGPACK_MEDIA_TYPE, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)
+                    response = async_to_sync(AsyncCheckClassroomKeyView.as_view())(request)
+                else:
+                    response = self.client.post(path, body, content_type=MSGPACK_MEDIA_TYPE, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], MSGPACK_MEDIA_TYPE)
+                self.assertEqual(len(msgpack.unpackb(response.content)['students']), 3)
+
+        body = msgpack.packb({'classroomKey': self.classroom.classroom_key, 'user': self.student.full_name, 'levelStatistics': {'place': 1}})
+        response = self.client.post('/api/insertLevelStatistics/', body, content_type=MSGPACK_MEDIA_TYPE)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RunStatistics.objects.get().student_id, self.student.pk)
+
+    def test_json_by_default(self):
+        response = self.client.post('/api/checkClassroomKey/', {'classroomKey': self.classroom.classroom_key}, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        # Without orjson the same document comes out of the standard library
+        with mock.patch('digitmileapi.renderers.orjson', None):
+            self.assertEqual(json.loads(dumps_json(response.json())), response.json())
+            self.assertEqual(parse_body(RequestFactory().post('/', b'{"a": 1}', content_type='application/json')), {'a': 1})
+        self.assertIsNone(parse_body(RequestFactory().post('/', b'{not json', content_type='application/json')))
+
+
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=3, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=2, runs=0)
+        cls.schools = list(School.objects.order_by('pk'))
+        # Two schools in one municipality, the third on its own
+        cls.schools[2].municipality = 'Elsewhere'
+        cls.schools[2].save()
+        cls.students = [list(Student.objects.filter(classroom__teacher__school=school).order_by('pk')) for school in cls.schools]
+        cls.today = timezone.now().astimezone(datetime.timezone.utc).date()
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def day(self, days_ago):
+        return self.today - timedelta(days=days_ago)
+
+    def insert(self, student, days_ago, *outcomes):
+        created_at = datetime.datetime.combine(self.day(days_ago), datetime.time(12), tzinfo=datetime.timezone.utc)
+        RunStatistics.objects.bulk_create([
+            RunStatistics(student=student, player_won=won, place=1 if won else 2, created_at=created_at)
+            for won in outcomes
+        ])
+
+    def school_rollups(self):
+        rows = SchoolDailyRollup.objects.values_list('school_id', 'day', 'total_runs', 'total_wins', 'active_students')
+        return {(school_id, day): counts for school_id, day, *counts in rows}
+
+    def municipality_rollups(self):
+        rows = MunicipalityDailyRollup.objects.values_list(
+            'municipality', 'day', 'total_runs', 'total_wins', 'active_students', 'active_schools'
+        )
+        return {(municipality, day): counts for municipality, day, *counts in rows}
+
+    def insert_two_days(self):
+        (a0, a1), (b0, _), (c0, _) = self.students
+        self.insert(a0, 1, True, False)
+        self.insert(a1, 1, False)
+        self.insert(b0, 1, True)
+        self.insert(a0, 2, False)
+        self.insert(c0, 2, True, True)
+
+    def test_full_refresh(self):
+        self.insert_two_days()
+        first, second, third = [school.pk for school in self.schools]
+        municipality = self.schools[0].municipality
+        self.assertEqual(refresh_rollups(full=True), 2)
+        self.assertEqual(self.school_rollups(), {
+            (first, self.day(1)): [3, 1, 2],
+            (second, self.day(1)): [1, 1, 1],
+            (first, self.day(2)): [1, 0, 1],
+            (third, self.day(2)): [2, 2, 1],
+        })
+        self.assertEqual(self.municipality_rollups(), {
+            (municipality, self.day(1)): [4, 2, 3, 2],
+            (municipality, self.day(2)): [1, 0, 1, 1],
+            ('Elsewhere', self.day(2)): [2, 2, 1, 1],
+        })
+
+    def test_incremental_refresh_reads_from_the_watermark(self):
+        (a0, a1), (b0, _), _ = self.students
+        self.insert(a0, 1, True)
+        self.assertEqual(refresh_rollups(), 1)  # no watermark yet, so everything
+        watermark = RollupWatermark.objects.get(name=WATERMARK_NAME).refreshed_until
+
+        # Committed late but within the overlap, so still read
+        late = RunStatistics.objects.create(student=b0, player_won=True, place=1, created_at=watermark - OVERLAP / 2)
+        # Older than the overlap: only a full refresh sees it
+        self.insert(a1, 1, False)
+        self.assertEqual(refresh_rollups(), 1)
+        late_day = late.created_at.astimezone(datetime.timezone.utc).date()
+        rollups = self.school_rollups()
+        self.assertEqual(rollups[self.schools[1].pk, late_day], [1, 1, 1])
+        self.assertEqual(rollups[self.schools[0].pk, self.day(1)], [1, 1, 1])
+        self.assertGreater(RollupWatermark.objects.get(name=WATERMARK_NAME).refreshed_until, watermark)
+
+        refresh_rollups(full=True)
+        self.assertEqual(self.school_rollups()[self.schools[0].pk, self.day(1)], [2, 1, 2])
+
+    def test_compacted_runs_count_once_per_student(self):
+        a0, a1 = self.students[0]
+        StudentDailyAggregate.objects.create(student=a0, day=self.day(3), total_runs=5, total_wins=2)
+        # Raw runs that arrived for the compacted day afterwards
+        self.insert(a0, 3, True)
+        self.insert(a1, 3, False)
+        # Compacted days only exist as aggregates, a full refresh still has to find them
+        StudentDailyAggregate.objects.create(student=a1, day=self.day(4), total_runs=3, total_wins=3)
+        refresh_rollups(full=True)
+        self.assertEqual(self.school_rollups(), {
+            (self.schools[0].pk, self.day(3)): [7, 3, 2],
+            (self.schools[0].pk, self.day(4)): [3, 3, 1],
+        })
+
+    def test_command(self):
+        self.insert_two_days()
+        out = StringIO()
+        call_command('refresh_rollups', '--full', stdout=out)
+        self.assertIn("Refreshed 2 days", out.getvalue())
+        self.assertEqual(SchoolDailyRollup.objects.count(), 4)
+
+    def test_views(self):
+        self.insert_two_days()
+        refresh_rollups(full=True)
+        since, until = self.day(2).isoformat(), self.day(1).isoformat()
+        self.client.force_login(self.superuser)
+        body = self.client.get('/api/rollups/schools/', {'since': since, 'until': until, 'school': self.schools[0].pk}).json()
+        self.assertEqual(body['rollups'], [
+            {'day': since, 'school': self.schools[0].pk, 'schoolName': self.schools[0].name,
+             'municipality': self.schools[0].municipality, 'runs': 1, 'wins': 0, 'winRate': 0.0, 'activeStudents': 1},
+            {'day': until, 'school': self.schools[0].pk, 'schoolName': self.schools[0].name,
+             'municipality': self.schools[0].municipality, 'runs': 3, 'wins': 1, 'winRate': 0.3333, 'activeStudents': 2},
+        ])
+        body = self.client.get('/api/rollups/municipalities/', {'since': since, 'until': until, 'municipality': 'Elsewhere'}).json()
+        self.assertEqual(body['rollups'], [
+            {'day': since, 'municipality': 'Elsewhere', 'runs': 2, 'wins': 2, 'winRate': 1.0, 'activeStudents': 1, 'activeSchools': 1},
+        ])
+
+        # A teacher only sees their own school and municipality
+        teacher = Teacher.objects.get(school=self.schools[2])
+        teacher.user = User.objects.create_user('teacher', password='x')
+        teacher.save()
+        self.client.force_login(teacher.user)
+        schools = self.client.get('/api/rollups/schools/', {'since': since, 'until': until}).json()['rollups']
+        self.assertEqual({row['school'] for row in schools}, {self.schools[2].pk})
+        municipalities = self.client.get('/api/rollups/municipalities/', {'since': since, 'until': until}).json()['rollups']
+        self.assertEqual({row['municipality'] for row in municipalities}, {'Elsewhere'})
+
+    def test_invalid_parameters(self):
+        self.client.force_login(self.superuser)
+        for params in (
+            {'since': 'yesterday'},
+            {'since': self.day(0).isoformat(), 'until': self.day(1).isoformat()},
+            {'since': self.day(400).isoformat()},
+            {'school': 'first'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/rollups/schools/', params).status_code, 400)
+
+
+class ApiSettingsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=2, runs=0)
+        cls.classroom = Classroom.objects.get()
+        cls.student = Student.objects.order_by('pk').first()
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+
+    def setUp(self):
+        get_roster_cache().clear()
+        # INSTALLED_APPS stays as it is, the test database was created for the full app list
+        self.api_settings = importlib.import_module('digitmile.settings_api')
+        override = override_settings(
+            ROOT_URLCONF=self.api_settings.ROOT_URLCONF,
+            MIDDLEWARE=self.api_settings.MIDDLEWARE,
+            REST_FRAMEWORK=self.api_settings.REST_FRAMEWORK,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_drops_what_the_game_clients_never_use(self):
+        self.assertNotIn('django.contrib.admin', self.api_settings.INSTALLED_APPS)
+        self.assertNotIn('django.contrib.sessions', self.api_settings.INSTALLED_APPS)
+        self.assertNotIn('django.contrib.sessions.middleware.SessionMiddleware', self.api_settings.MIDDLEWARE)
+        self.assertNotIn('django.middleware.csrf.CsrfViewMiddleware', self.api_settings.MIDDLEWARE)
+
+    def test_game_client_endpoints(self):
+        response = self.client.post('/api/checkClassroomKey/', {'classroomKey': self.classroom.classroom_key}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['students']), 2)
+        response = self.client.post('/api/insertLevelStatistics/', {
+            'classroomKey': self.classroom.classroom_key,
+            'user': self.student.full_name,
+            'levelStatistics': {'place': 1},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RunStatistics.objects.get().student_id, self.student.pk)
+
+    def test_no_admin_or_teacher_endpoints(self):
+        # Not even with a session cookie: there is no session middleware to read it
+        self.client.force_login(self.superuser)
+        for path in ('/admin/', '/api/rollups/schools/', f'/api/classrooms/{self.classroom.classroom_key}/leaderboard/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class RosterVersionTests(TestCase):
+    path = '/api/checkClassroomKey/'
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(schools=1, teachers_per_school=1, classrooms_per_teacher=1, students_per_classroom=3, runs=0)
+        cls.classroom = Classroom.objects.get()
+
+    def setUp(self):
+        get_roster_cache().clear()
+
+    def check(self, headers=None, **data):
+        return self.client.post(
+            self.path, {'classroomKey': self.classroom.classroom_key, **data}, content_type='application/json', headers=headers,
+        )
+
+    def test_net_changes(self):
+        self.assertEqual(net_changes([
+            (1, 'Ann', True),
+            (2, 'Bob', False),
+            (1, 'Ann', False),  # came and went
+            (3, 'Cid', True),
+            (3, 'Cid', False),
+            (3, 'Cy', True),  # renamed before the client saw the first name
+            (4, 'Dan', False),
+            (4, 'Dave', True),  # renamed
+        ]), ({3: 'Cy', 4: 'Dave'}, ['Bob', 'Dan']))
+
+    def test_parse_since_version(self):
+        self.assertIsNone(parse_since_version(None))
+        self.assertEqual(parse_since_version(3), 3)
+        self.assertEqual(parse_since_version('3'), 3)
+        for value in (-1, '-1', 'three', True, 1.5, [3]):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_since_version(value)
+
+    @override_settings(STUDENT_TOKEN_MAX_AGE=100)
+    def test_etag(self):
+        with mock.patch('digitmileapi.rosters.time.time', return_value=0):
+            etag = roster_etag('KEY', 1)
+            self.assertNotEqual(roster_etag('KEY', 2), etag)
+            self.assertNotEqual(roster_etag('OTHER', 1), etag)
+        # Changes halfway through the token lifetime
+        with mock.patch('digitmileapi.rosters.time.time', return_value=49):
+            self.assertEqual(roster_etag('KEY', 1), etag)
+        with mock.patch('digitmileapi.rosters.time.time', return_value=50):
+            self.assertNotEqual(roster_etag('KEY', 1), etag)
+
+        self.assertTrue(etag_matches(f'"other", W/{etag}', etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(None, etag))
+
+    def test_delta(self):
+        first = self.check()
+        version = first.json()['version']
+        renamed, deleted, _ = Student.objects.filter(classroom=self.classroom).order_by('pk')
+        old_name = renamed.full_name
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.create(full_name="New student", classroom=self.classroom)
+            renamed.full_name = "Renamed"
+            renamed.save()
+            deleted.delete()
+
+        response = self.check(sinceVersion=version)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        delta = response.json()
+        self.assertEqual(delta['version'], version + 3)
+        self.assertNotIn('students', delta)
+        self.assertEqual(delta['added'], ["New student", "Renamed"])
+        self.assertEqual(delta['removed'], [old_name, deleted.full_name])
+        self.assertEqual(set(delta['studentTokens']), {"New student", "Renamed"})
+
+        # Up to date, from the cache and from the database
+        for clear_cache in (False, True):
+            with self.subTest(clear_cache=clear_cache):
+                if clear_cache:
+                    get_roster_cache().clear()
+                self.assertEqual(self.check(sinceVersion=delta['version']).json()['added'], [])
+                self.assertEqual(self.check(headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+    def test_full_roster_when_no_delta_is_possible(self):
+        version = self.check().json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_roster_versions(Classroom.objects.filter(pk=self.classroom.pk))
+        get_roster_cache().clear()
+        # The bump left no change rows to build a delta from
+        body = self.check(sinceVersion=version).json()
+        self.assertEqual((body['version'], len(body['students'])), (version + 1, 3))
+        # A version from the future, e.g. after the classroom was recreated
+        self.assertEqual(len(self.check(sinceVersion=version + 10).json()['students']), 3)
+
+    def test_invalid_since_version(self):
+        for value in (-1, 'latest', True):
+            with self.subTest(value=value):
+                self.assertEqual(self.check(sinceVersion=value).status_code, 400)
+                request = RequestFactory().post(
+                    self.path, {'classroomKey': self.classroom.classroom_key, 'sinceVersion': value}, content_type='application/json',
+                )
+                self.assertEqual(async_to_sync(AsyncCheckClassroomKeyView.as_view())(request).status_code, 400)
@@ -0,0 +1,27 @@
+# myapi/tokens.py
+"""
+Signed student tokens handed out by /api/checkClassroomKey/ ("studentTokens", one per student).
+
+A token carries the classroom and student ids and when it was issued, signed with SECRET_KEY.
+The game client sends it back with each result instead of classroomKey + user, so the insert
+endpoints can write the run straight away without looking the student up. Tokens expire after
+settings.STUDENT_TOKEN_MAX_AGE seconds; clients that still send names keep working.
+"""
+from django.conf import settings
+from django.core import signing
+
+SALT = 'digitmileapi.student-token'
+
+
+def make_student_token(classroom_id, student_id):
+    return signing.dumps([classroom_id, student_id], salt=SALT)
+
+
+def read_student_token(token):
+    """
+    Returns (student_id, classroom_id), the same order as resolvers.resolve_student().
+    Raises signing.BadSignature (or its subclass SignatureExpired) for tokens that are forged,
+    damaged or too old.
+    """
+    classroom_id, student_id = signing.loads(token, salt=SALT, max_age=getattr(settings, 'STUDENT_TOKEN_MAX_AGE', 6 * 3600))
+    return student_id, classroom_id
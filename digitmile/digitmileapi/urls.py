@@ -1,8 +1,41 @@
 # myapi/urls.py
+from django.conf import settings
 from django.urls import path
-from .views import CheckClassroomKeyView, InsertLevelStatisticsView
+from .views import (
+    CheckClassroomKeyView,
+    InsertLevelStatisticsView,
+    InsertLevelStatisticsBatchView,
+    ClassroomLeaderboardView,
+    ClassroomProgressView,
+    ExportRunStatisticsView,
+    SchoolRollupView,
+    MunicipalityRollupView,
+    StudentSearchView,
+)
+from .async_views import AsyncCheckClassroomKeyView, AsyncInsertLevelStatisticsView, LiveRunStatisticsView
 
-urlpatterns = [
-    path('checkClassroomKey/', CheckClassroomKeyView.as_view(), name='check_classroom_key'),
-    path('insertLevelStatistics/', InsertLevelStatisticsView.as_view(), name='insert_level_statistics'),
-]
\ No newline at end of file
+# Under ASGI (see digitmile/asgi.py) the game-client endpoints are served by the native async views
+if settings.ASYNC_API_VIEWS:
+    check_classroom_key_view = AsyncCheckClassroomKeyView.as_view()
+    insert_level_statistics_view = AsyncInsertLevelStatisticsView.as_view()
+else:
+    check_classroom_key_view = CheckClassroomKeyView.as_view()
+    insert_level_statistics_view = InsertLevelStatisticsView.as_view()
+
+# What the game clients call; also everything the API-only deployment serves (digitmile/urls_api.py)
+game_client_urlpatterns = [
+    path('checkClassroomKey/', check_classroom_key_view, name='check_classroom_key'),
+    path('insertLevelStatistics/', insert_level_statistics_view, name='insert_level_statistics'),
+    path('insertLevelStatisticsBatch/', InsertLevelStatisticsBatchView.as_view(), name='insert_level_statistics_batch'),
+]
+
+# Teacher-facing endpoints, these need a logged-in user
+urlpatterns = game_client_urlpatterns + [
+    path('classrooms/<str:classroom_key>/leaderboard/', ClassroomLeaderboardView.as_view(), name='classroom_leaderboard'),
+    path('classrooms/<str:classroom_key>/progress/', ClassroomProgressView.as_view(), name='classroom_progress'),
+    path('export/runStatistics/', ExportRunStatisticsView.as_view(), name='export_run_statistics'),
+    path('live/runStatistics/', LiveRunStatisticsView.as_view(), name='live_run_statistics'),
+    path('rollups/schools/', SchoolRollupView.as_view(), name='school_rollups'),
+    path('rollups/municipalities/', MunicipalityRollupView.as_view(), name='municipality_rollups'),
+    path('students/search/', StudentSearchView.as_view(), name='student_search'),
+]
@@ -1,96 +1,579 @@
 # myapi/views.py
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError
+from django.db.models import Case, F, Value, When
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Classroom, Student, Teacher, School, RunStatistics
+from rest_framework.permissions import IsAuthenticated
+from .models import Classroom, Student, Teacher, School, RunStatistics, SchoolDailyRollup, MunicipalityDailyRollup, StudentProgress
 from .serializers import (
-    CheckClassroomResponseSerializer,
     LevelStatisticsInputSerializer,
+    check_classroom_payload,
     RunStatisticsSerializer # Import if you use it for creation validation/response
 )
+from .export import EXPORT_FORMATS, aexport_lines, export_lines, export_queryset, filter_run_statistics
+from .renderers import API_PARSER_CLASSES, API_RENDERER_CLASSES
+from .ingest import BufferFull, get_ingestion_buffer, is_buffered
+from .key_filter import get_classroom_key_filter
+from .logs import sampled
+from .resolvers import load_classroom, load_students, resolve_student
+from .roster_cache import get_roster_cache
+from .rosters import etag_matches, parse_since_version, roster_delta, roster_etag
+from .routers import read_alias
+from .run_summaries import insert_runs
+from .search import search_queryset
+
+logger = logging.getLogger(__name__)
+
+def not_modified(etag):
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
 class CheckClassroomKeyView(APIView):
     """
     Checks if a classroom key exists and returns classroom, teacher, and student data.
+
+    Every response carries the roster version and an ETag. Clients that send the ETag back in
+    If-None-Match get a 304 when nothing changed, clients that send the version back as
+    sinceVersion get only the students added and removed since (see rosters.py).
     """
+    renderer_classes = API_RENDERER_CLASSES
+    parser_classes = API_PARSER_CLASSES
+
     def post(self, request, *args, **kwargs):
         classroom_key_from_request = request.data.get("classroomKey")
 
         if not classroom_key_from_request:
             return Response({"error": "Invalid input: classroomKey missing"}, status=status.HTTP_400_BAD_REQUEST)
-
         try:
-            # Fetch the classroom using its unique classroom_key
-            # select_related fetches related Teacher and School objects in the same DB query
-            print(Classroom.objects.count())
+            since_version = parse_since_version(request.data.get("sinceVersion"))
+        except ValueError:
+            return Response({"error": "Invalid input: sinceVersion must be a non-negative integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if_none_match = request.headers.get('If-None-Match')
 
-            classroom = Classroom.objects.select_related('teacher', 'teacher__school').get(classroom_key=classroom_key_from_request)
+        # Most roster requests at the start of a lesson are for the same few classrooms
+        roster_cache = get_roster_cache()
+        cached_payload = roster_cache.get(classroom_key_from_request)
+        if cached_payload is not None:
+            etag = roster_etag(classroom_key_from_request, cached_payload['version'])
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            if since_version is not None:
+                delta = roster_delta(classroom_key_from_request, since_version, cached_payload['version'])
+                if delta is not None:
+                    return Response(delta, status=status.HTTP_200_OK, headers={'ETag': etag})
+            return Response(cached_payload, status=status.HTTP_200_OK, headers={'ETag': etag})
 
-            # Now you can safely access classroom attributes
-            print(f"Found classroom: ID={classroom.id}, Key={classroom.classroom_key}, Teacher={classroom.teacher.full_name}")
+        # Mistyped keys are turned away here without a query
+        key_filter = get_classroom_key_filter()
+        if not key_filter.might_contain(classroom_key_from_request):
+            return Response({"message": "Classroom key verification failed or classroom not found"}, status=status.HTTP_404_NOT_FOUND)
 
-            # ... (rest of your logic to prepare response_data)
-            students_queryset = Student.objects.filter(classroom=classroom)
-            student_names = [student.full_name for student in students_queryset]
+        try:
+            # Only the values the response needs, no model instances are built
+            classroom_id, teacher_name, school_name, municipality, version = load_classroom(classroom_key_from_request)
+            etag = roster_etag(classroom_key_from_request, version)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            if since_version is not None:
+                # Deltas are not cached, they can come from a replica
+                delta = roster_delta(classroom_key_from_request, since_version, version)
+                if delta is not None:
+                    return Response(delta, status=status.HTTP_200_OK, headers={'ETag': etag})
+            students = load_students(classroom_id)
 
-            response_data = {
-                'school': classroom.teacher.school,
-                'teacher_data': classroom.teacher.full_name,
-                'students': student_names
-            }
-            serializer = CheckClassroomResponseSerializer(response_data) # Ensure this serializer is defined
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # Built as a plain dict rather than through CheckClassroomResponseSerializer, this is the hottest path
+            response_data = check_classroom_payload(school_name, municipality, teacher_name, students, classroom_id, version)
+            roster_cache.set(classroom_key_from_request, response_data)
+            if sampled():
+                logger.info("classroom found", extra={
+                    'classroom_id': classroom_id,
+                    'classroom_key': classroom_key_from_request,
+                    'students': len(response_data['students']),
+                })
+            return Response(response_data, status=status.HTTP_200_OK, headers={'ETag': etag})
 
         except Classroom.DoesNotExist:
-            print(f"Classroom with key '{classroom_key_from_request}' does not exist.") # More informative print
+            key_filter.record_false_positive()
+            if sampled():
+                logger.info("classroom not found", extra={'classroom_key': classroom_key_from_request})
             return Response({"message": "Classroom key verification failed or classroom not found"}, status=status.HTTP_404_NOT_FOUND) # 404 is often more appropriate here
-        except Exception as e:
+        except Exception:
             # Catch any other unexpected errors
-            print(f"An unexpected error occurred: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("checking classroom key failed", extra={'classroom_key': classroom_key_from_request})
             return Response({"error": "An internal server error occurred"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class InsertLevelStatisticsView(APIView):
     """
     Inserts run statistics for a student in a given classroom.
     """
+    renderer_classes = API_RENDERER_CLASSES
+    parser_classes = API_PARSER_CLASSES
+
     def post(self, request, *args, **kwargs):
         input_serializer = LevelStatisticsInputSerializer(data=request.data)
         if not input_serializer.is_valid():
             return Response(input_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         data = input_serializer.validated_data
-        classroom_key = data["classroomKey"]
-        user_full_name = data["user"]
+        classroom_key = data.get("classroomKey")
+        user_full_name = data.get("user")
         level_statistics = data['levelStatistics']
 
-        try:
-            classroom = Classroom.objects.get(classroom_key=classroom_key)
-        except Classroom.DoesNotExist:
-            return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+        if data['student'] is not None:
+            # Signed student token from checkClassroomKey: the ids are used as they are, no lookups
+            student_id, classroom_id = data['student']
+        else:
+            key_filter = get_classroom_key_filter()
+            if not key_filter.might_contain(classroom_key):
+                return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        try:
-            student = Student.objects.get(full_name=user_full_name, classroom=classroom)
-        except Student.DoesNotExist:
-            return Response({"error": "User (Student) not found in this classroom"}, status=status.HTTP_404_NOT_FOUND)
+            # Classroom and student are resolved together with one joined query
+            try:
+                student_id, classroom_id = resolve_student(classroom_key, user_full_name)
+            except Classroom.DoesNotExist:
+                key_filter.record_false_positive()
+                return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+            except Student.DoesNotExist:
+                return Response({"error": "User (Student) not found in this classroom"}, status=status.HTTP_404_NOT_FOUND)
+            except Student.MultipleObjectsReturned:
+                return Response({"error": "More than one student with this name in this classroom"}, status=status.HTTP_409_CONFLICT)
+
+        run_stat = RunStatistics.from_level_statistics(student_id, level_statistics)
 
-        player_won = level_statistics.get('place') == 1
+        # Write-behind mode: queue the row for the background flusher and answer right away
+        if is_buffered():
+            try:
+                get_ingestion_buffer().submit(run_stat, classroom_id)
+            except BufferFull:
+                return Response({"error": "Server busy, please retry"}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+            return Response({"message": "Data accepted"}, status=status.HTTP_202_ACCEPTED)
 
         try:
-            # Create RunStatistics instance using Django ORM
-            run_stat = RunStatistics.objects.create(
-                student=student,
-                player_won=player_won
-            )
+            # Create the RunStatistics row and bump the student/classroom counters in one transaction
+            insert_runs([(run_stat, classroom_id)])
             # Optionally, serialize and return the created object if needed by the frontend
             # run_stat_serializer = RunStatisticsSerializer(run_stat)
             # return Response(run_stat_serializer.data, status=status.HTTP_201_CREATED)
             return Response({"message": "Data inserted successfully"}, status=status.HTTP_201_CREATED)
 
-        except Exception as e:
+        except IntegrityError:
+            # The student of a token was deleted after the token was handed out
+            return Response({"error": "User (Student) not found in this classroom"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception:
             # Log the exception for server-side debugging
-            print(f"Error inserting run statistics: {e}")
-            import traceback
-            traceback.print_exc()
-            return Response({"error": "Internal server error while saving statistics"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            logger.exception("inserting run statistics failed", extra={'classroom_key': classroom_key, 'student_id': student_id})
+            return Response({"error": "Internal server error while saving statistics"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class InsertLevelStatisticsBatchView(APIView):
+    """
+    Inserts run statistics for many students in one request.
+
+    Expects a JSON array of {classroomKey, user, levelStatistics} (or {token, levelStatistics})
+    items and returns one result per item, in the same order. Classrooms and students are
+    resolved with one query each no matter how many items are sent, and all rows go in with a
+    single bulk insert.
+    """
+    renderer_classes = API_RENDERER_CLASSES
+    parser_classes = API_PARSER_CLASSES
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Invalid input: expected a non-empty list of results"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_items = getattr(settings, 'LEVEL_STATISTICS_BATCH_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            return Response({"error": f"Invalid input: at most {max_items} results per batch"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate every item on its own, so a single malformed result does not reject the rest
+        results = [None] * len(items)
+        valid = []  # (index, validated_data)
+        for index, item in enumerate(items):
+            input_serializer = LevelStatisticsInputSerializer(data=item)
+            if input_serializer.is_valid():
+                valid.append((index, input_serializer.validated_data))
+            else:
+                results[index] = {"status": status.HTTP_400_BAD_REQUEST, "errors": input_serializer.errors}
+
+        # Items with a student token need no lookups at all
+        by_name = [(index, data) for index, data in valid if data['student'] is None]
+
+        # One query for all distinct classrooms that can exist...
+        key_filter = get_classroom_key_filter()
+        classroom_keys = {data["classroomKey"] for _, data in by_name}
+        classroom_keys = {key for key in classroom_keys if key_filter.might_contain(key)}
+        classroom_ids = dict(
+            Classroom.objects.filter(classroom_key__in=classroom_keys).values_list('classroom_key', 'id')
+        ) if classroom_keys else {}
+        for _ in classroom_keys - classroom_ids.keys():
+            key_filter.record_false_positive()
+
+        # ...and one for all students in them. The IN lists can match a few extra
+        # (classroom, name) pairs, which are simply never looked up.
+        user_names = {data["user"] for _, data in by_name if data["classroomKey"] in classroom_ids}
+        student_ids = {}
+        ambiguous = set()  # Duplicate names, only possible on data that predates the unique constraint
+        if user_names:
+            students = Student.objects.filter(
+                classroom_id__in=classroom_ids.values(),
+                full_name__in=user_names,
+            ).values_list('classroom_id', 'full_name', 'id')
+            for classroom_id, full_name, student_id in students:
+                if (classroom_id, full_name) in student_ids:
+                    ambiguous.add((classroom_id, full_name))
+                student_ids[(classroom_id, full_name)] = student_id
+
+        run_stats = []
+        inserted_indexes = []
+        for index, data in valid:
+            if data['student'] is not None:
+                student_id, classroom_id = data['student']
+                run_stats.append((RunStatistics.from_level_statistics(student_id, data['levelStatistics']), classroom_id))
+                inserted_indexes.append(index)
+                continue
+            classroom_id = classroom_ids.get(data["classroomKey"])
+            if classroom_id is None:
+                results[index] = {"status": status.HTTP_404_NOT_FOUND, "error": "Classroom not found"}
+                continue
+            if (classroom_id, data["user"]) in ambiguous:
+                results[index] = {"status": status.HTTP_409_CONFLICT, "error": "More than one student with this name in this classroom"}
+                continue
+            student_id = student_ids.get((classroom_id, data["user"]))
+            if student_id is None:
+                results[index] = {"status": status.HTTP_404_NOT_FOUND, "error": "User (Student) not found in this classroom"}
+                continue
+            run_stats.append((RunStatistics.from_level_statistics(student_id, data['levelStatistics']), classroom_id))
+            inserted_indexes.append(index)
+
+        if run_stats:
+            try:
+                try:
+                    insert_runs(run_stats)
+                except IntegrityError:
+                    # Some token was for a student deleted since it was handed out: drop those items and retry once
+                    existing = set(Student.objects.filter(
+                        id__in={run_stat.student_id for run_stat, _ in run_stats}
+                    ).values_list('id', flat=True))
+                    for index, (run_stat, _) in zip(inserted_indexes, run_stats):
+                        if run_stat.student_id not in existing:
+                            results[index] = {"status": status.HTTP_404_NOT_FOUND, "error": "User (Student) not found in this classroom"}
+                    kept = [(index, pair) for index, pair in zip(inserted_indexes, run_stats) if pair[0].student_id in existing]
+                    inserted_indexes = [index for index, _ in kept]
+                    run_stats = [pair for _, pair in kept]
+                    for run_stat, _ in run_stats:
+                        run_stat.pk = None  # assigned by the insert that was rolled back
+                    if run_stats:
+                        insert_runs(run_stats)
+            except Exception:
+                logger.exception("bulk inserting run statistics failed", extra={'rows': len(run_stats)})
+                return Response({"error": "Internal server error while saving statistics"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        for index in inserted_indexes:
+            results[index] = {"status": status.HTTP_201_CREATED, "message": "Data inserted successfully"}
+
+        # 201 when every item went in, 207 (Multi-Status) when some of them were rejected
+        response_status = status.HTTP_201_CREATED if len(inserted_indexes) == len(items) else status.HTTP_207_MULTI_STATUS
+        return Response({"results": results}, status=response_status)
+
+class ClassroomLeaderboardView(APIView):
+    """
+    Returns run and win totals for every student of a classroom, best first.
+
+    Only reads the summary rows (run_summaries.py), so the cost grows with the number of
+    students and not with the number of runs. Teachers only see their own classrooms.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, classroom_key, *args, **kwargs):
+        classrooms = Classroom.objects.select_related('run_summary')
+        if not request.user.is_superuser:
+            if not hasattr(request.user, 'teacher_profile'):
+                return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+            classrooms = classrooms.filter(teacher=request.user.teacher_profile)
+
+        try:
+            classroom = classrooms.get(classroom_key=classroom_key)
+        except Classroom.DoesNotExist:
+            return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Students without any runs have no summary row yet and come last
+        students = (
+            Student.objects.filter(classroom=classroom)
+            .order_by(F('run_summary__total_wins').desc(nulls_last=True), 'run_summary__total_runs', 'full_name')
+            .values_list('full_name', 'run_summary__total_runs', 'run_summary__total_wins')
+        )
+        classroom_summary = getattr(classroom, 'run_summary', None)
+
+        return Response({
+            'classroom': classroom.classroom_key,
+            'totalRuns': classroom_summary.total_runs if classroom_summary else 0,
+            'totalWins': classroom_summary.total_wins if classroom_summary else 0,
+            'students': [
+                {
+                    'name': full_name,
+                    'runs': runs or 0,
+                    'wins': wins or 0,
+                    'winRate': round(wins / runs, 4) if runs else None,
+                }
+                for full_name, runs, wins in students
+            ],
+        }, status=status.HTTP_200_OK)
+
+class ClassroomProgressView(APIView):
+    """
+    Returns the nightly progress analytics (analytics.py) of every student of a classroom,
+    highest rating first. Students without runs, or added since the last computation, have
+    no progress yet and are left out. Teachers only see their own classrooms.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, classroom_key, *args, **kwargs):
+        classrooms = Classroom.objects.all()
+        if not request.user.is_superuser:
+            if not hasattr(request.user, 'teacher_profile'):
+                return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+            classrooms = classrooms.filter(teacher=request.user.teacher_profile)
+
+        try:
+            classroom = classrooms.get(classroom_key=classroom_key)
+        except Classroom.DoesNotExist:
+            return Response({"error": "Classroom not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        rows = (
+            StudentProgress.objects.filter(student__classroom=classroom)
+            .order_by(F('rating').desc(nulls_last=True), 'student__full_name')
+            .values_list(
+                'student__full_name', 'total_runs', 'total_wins', 'win_rate', 'recent_win_rate', 'current_streak',
+                'best_win_streak', 'rating', 'average_score', 'accuracy', 'average_time',
+                'classroom_percentile', 'school_percentile', 'municipality_percentile', 'computed_at',
+            )
+        )
+        students = []
+        computed_at = None
+        for (full_name, runs, wins, win_rate, recent_win_rate, current_streak, best_win_streak, rating,
+             average_score, accuracy, average_time, classroom_percentile, school_percentile,
+             municipality_percentile, computed_at) in rows:
+            students.append({
+                'name': full_name,
+                'runs': runs,
+                'wins': wins,
+                'winRate': round(win_rate, 4),
+                'recentWinRate': round(recent_win_rate, 4) if recent_win_rate is not None else None,
+                'currentStreak': current_streak,
+                'bestWinStreak': best_win_streak,
+                'rating': round(rating, 1) if rating is not None else None,
+                'averageScore': average_score,
+                'accuracy': round(accuracy, 4) if accuracy is not None else None,
+                'averageTime': average_time,
+                'classroomPercentile': classroom_percentile,
+                'schoolPercentile': school_percentile,
+                'municipalityPercentile': municipality_percentile,
+            })
+
+        return Response({
+            'classroom': classroom.classroom_key,
+            'computedAt': computed_at,
+            'students': students,
+        }, status=status.HTTP_200_OK)
+
+class ExportRunStatisticsView(APIView):
+    """
+    Streams run statistics as CSV or NDJSON.
+
+    Query parameters: output (csv or ndjson, default csv), teacher and school (ids),
+    municipality, since and until (ISO 8601 datetimes). Teachers only get their own
+    classrooms, same as in the admin.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        # Not called "format", DRF reserves that query parameter for content negotiation
+        export_format = request.query_params.get('output', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": f"Invalid output, expected one of: {', '.join(EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = {}
+        for name in ('teacher', 'school'):
+            value = request.query_params.get(name)
+            if value:
+                if not value.isdigit():
+                    return Response({"error": f"Invalid {name}: expected an id"}, status=status.HTTP_400_BAD_REQUEST)
+                filters[name] = int(value)
+        filters['municipality'] = request.query_params.get('municipality')
+        for name in ('since', 'until'):
+            value = request.query_params.get(name)
+            if value:
+                parsed = parse_datetime(value)
+                if parsed is None:
+                    return Response({"error": f"Invalid {name}: expected an ISO 8601 datetime"}, status=status.HTTP_400_BAD_REQUEST)
+                filters[name] = parsed
+
+        # Read lazily while the response streams, so bind the replica now rather than in a `with` block
+        queryset = filter_run_statistics(export_queryset(request.user), **filters).using(read_alias())
+        # An iterator of the handler's kind, anything else is read into memory before it is sent
+        lines = aexport_lines if isinstance(request._request, ASGIRequest) else export_lines
+        response = StreamingHttpResponse(lines(queryset, export_format), content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="run_statistics.{export_format}"'
+        return response
+
+class RollupView(APIView):
+    """
+    Base for the read-only rollup endpoints (rollups.py).
+
+    Query parameters: since and until (ISO dates, inclusive, default the last 7 days, at most
+    ROLLUP_MAX_DAYS apart) and municipality. Teachers only get their own school and municipality.
+    """
+    permission_classes = [IsAuthenticated]
+    ROLLUP_MAX_DAYS = 366
+
+    def get_day_range(self, request):
+        today = timezone.now().date()
+        days = {}
+        for name, default in (('since', today - datetime.timedelta(days=6)), ('until', today)):
+            value = request.query_params.get(name)
+            days[name] = parse_date(value) if value else default
+            if days[name] is None:
+                return None, Response({"error": f"Invalid {name}: expected an ISO 8601 date"}, status=status.HTTP_400_BAD_REQUEST)
+        if days['since'] > days['until']:
+            return None, Response({"error": "Invalid range: since is after until"}, status=status.HTTP_400_BAD_REQUEST)
+        if (days['until'] - days['since']).days >= self.ROLLUP_MAX_DAYS:
+            return None, Response({"error": f"Invalid range: at most {self.ROLLUP_MAX_DAYS} days"}, status=status.HTTP_400_BAD_REQUEST)
+        return (days['since'], days['until']), None
+
+    def get_teacher_school(self, request):
+        # None for superusers (no restriction); teachers without a school see nothing
+        if request.user.is_superuser:
+            return None
+        teacher = getattr(request.user, 'teacher_profile', None)
+        return teacher.school if teacher else False
+
+class SchoolRollupView(RollupView):
+    """
+    Runs, wins and active students per school and day.
+    """
+    def get(self, request, *args, **kwargs):
+        day_range, error = self.get_day_range(request)
+        if error:
+            return error
+
+        rollups = SchoolDailyRollup.objects.filter(day__range=day_range)
+        school = self.get_teacher_school(request)
+        if school is False:
+            rollups = rollups.none()
+        elif school is not None:
+            rollups = rollups.filter(school=school)
+        if request.query_params.get('municipality'):
+            rollups = rollups.filter(school__municipality=request.query_params['municipality'])
+        school_id = request.query_params.get('school')
+        if school_id:
+            if not school_id.isdigit():
+                return Response({"error": "Invalid school: expected an id"}, status=status.HTTP_400_BAD_REQUEST)
+            rollups = rollups.filter(school_id=int(school_id))
+
+        rows = rollups.order_by('day', 'school_id').values_list(
+            'day', 'school_id', 'school__name', 'school__municipality', 'total_runs', 'total_wins', 'active_students'
+        )
+        return Response({
+            'since': day_range[0],
+            'until': day_range[1],
+            'rollups': [
+                {
+                    'day': day,
+                    'school': school_id,
+                    'schoolName': school_name,
+                    'municipality': municipality,
+                    'runs': runs,
+                    'wins': wins,
+                    'winRate': round(wins / runs, 4) if runs else None,
+                    'activeStudents': active_students,
+                }
+                for day, school_id, school_name, municipality, runs, wins, active_students in rows
+            ],
+        }, status=status.HTTP_200_OK)
+
+class MunicipalityRollupView(RollupView):
+    """
+    Runs, wins, active students and active schools per municipality and day.
+    """
+    def get(self, request, *args, **kwargs):
+        day_range, error = self.get_day_range(request)
+        if error:
+            return error
+
+        rollups = MunicipalityDailyRollup.objects.filter(day__range=day_range)
+        school = self.get_teacher_school(request)
+        if school is False:
+            rollups = rollups.none()
+        elif school is not None:
+            rollups = rollups.filter(municipality=school.municipality)
+        if request.query_params.get('municipality'):
+            rollups = rollups.filter(municipality=request.query_params['municipality'])
+
+        rows = rollups.order_by('day', 'municipality').values_list(
+            'day', 'municipality', 'total_runs', 'total_wins', 'active_students', 'active_schools'
+        )
+        return Response({
+            'since': day_range[0],
+            'until': day_range[1],
+            'rollups': [
+                {
+                    'day': day,
+                    'municipality': municipality,
+                    'runs': runs,
+                    'wins': wins,
+                    'winRate': round(wins / runs, 4) if runs else None,
+                    'activeStudents': active_students,
+                    'activeSchools': active_schools,
+                }
+                for day, municipality, runs, wins, active_students, active_schools in rows
+            ],
+        }, status=status.HTTP_200_OK)
+
+class StudentSearchView(APIView):
+    """
+    Finds students by name for the teacher dashboards.
+
+    Query parameters: q (required, every word has to match), classroom (a classroom key) and
+    limit (default 20, at most 100). Names that start with the first word come first. Uses the
+    trigram indexes on Postgres (search.py). Teachers only find students of their own classrooms.
+    """
+    permission_classes = [IsAuthenticated]
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 100
+
+    def get(self, request, *args, **kwargs):
+        search_term = request.query_params.get('q', '').strip()
+        if not search_term:
+            return Response({"error": "Invalid input: q missing"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = request.query_params.get('limit')
+        if limit is not None and not (limit.isdigit() and 0 < int(limit) <= self.MAX_LIMIT):
+            return Response({"error": f"Invalid limit: expected a number from 1 to {self.MAX_LIMIT}"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = int(limit) if limit else self.DEFAULT_LIMIT
+
+        students = Student.objects.using(read_alias())
+        if not request.user.is_superuser:
+            teacher = getattr(request.user, 'teacher_profile', None)
+            students = students.filter(classroom__teacher=teacher) if teacher else students.none()
+        if request.query_params.get('classroom'):
+            students = students.filter(classroom__classroom_key=request.query_params['classroom'])
+
+        rows = (
+            search_queryset(students, ['full_name'], search_term)
+            .annotate(prefix_match=Case(When(full_name__istartswith=search_term.split()[0], then=Value(0)), default=Value(1)))
+            .order_by('prefix_match', 'full_name', 'classroom__classroom_key')
+            .values_list('id', 'full_name', 'classroom__classroom_key')[:limit]
+        )
+        return Response({
+            'students': [
+                {'id': student_id, 'name': full_name, 'classroom': classroom_key}
+                for student_id, full_name, classroom_key in rows
+            ],
+        }, status=status.HTTP_200_OK)